@@ -10,13 +10,16 @@ def create_app():
     
     # Create Flask app
     app = Flask(__name__)
-    CORS(app)
+    CORS(app, expose_headers=['X-Next-Cursor'])
     
     # Only initialize database pool if not testing
     if not os.getenv('TESTING'):
         try:
-            from .database import init_db_pool
-            init_db_pool()
+            from .database import init_db_pool, get_db_connection, return_db_connection
+            if init_db_pool():
+                # Build the serial index in the background so lookups are served from memory
+                from .serial_index import refresh_serial_index
+                refresh_serial_index(get_db_connection, return_db_connection, app.logger)
         except Exception as e:
             print(f"Warning: Database pool initialization failed: {e}")
     
@@ -32,10 +35,12 @@ def create_app():
     from app.routes.data_routes import data_bp
     from app.routes.search_routes import search_bp
     from app.routes.report_routes import report_bp
+    from app.routes.export_routes import export_bp
     
     app.register_blueprint(db_bp, url_prefix='/api')
     app.register_blueprint(data_bp, url_prefix='/api')
     app.register_blueprint(search_bp, url_prefix='/api')
     app.register_blueprint(report_bp, url_prefix='/api')
+    app.register_blueprint(export_bp, url_prefix='/api')
     
     return app
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""Pre-aggregated report tables derived from the rings table.
+
+``rings_daily_stats`` holds ring counts per (date, vendor, hour, VQC status, FT
+status, final status, final stage, final reason) and ``rings_rejection_facts``
+holds rejection counts per (date, vendor, rejection stage, taxonomy reason code). The data
+migration refreshes only the dates it touched, and ``rings_aggregate_dates``
+records which dates are current so reports can backfill any date that was never
+aggregated. Refreshing a date also drops its cached daily reports.
+"""
+from app.report_cache import invalidate_report_cache
+from app.taxonomy import backfill_reason_codes, reclassify_reasons
+
+# Arbitrary key for the advisory lock that serialises aggregate refreshes
+AGGREGATE_LOCK_KEY = 7_241_003
+
+# Tables that are derived from rings and must be emptied alongside it
+AGGREGATE_TABLES = ['rings_daily_stats', 'rings_rejection_facts', 'rings_aggregate_dates', 'rings_report_cache']
+
+# Final status rules: FT is final whenever FT data exists (only VQC-accepted rings go
+# to FT), otherwise VQC is final, and a ring with neither is pending. The rings
+# trigger uses these to keep final_status, final_stage and final_reason current.
+HAS_VQC_SQL = "NULLIF(BTRIM(vqc_status), '') IS NOT NULL"
+HAS_FT_SQL = "NULLIF(BTRIM(ft_status), '') IS NOT NULL"
+FINAL_STATUS_SQL = f"""
+    CASE
+        WHEN {HAS_FT_SQL} THEN
+            CASE WHEN UPPER(ft_status) IN ('ACCEPTED', 'PASS') THEN 'Accepted' ELSE 'Rejected' END
+        WHEN {HAS_VQC_SQL} THEN
+            CASE WHEN UPPER(vqc_status) IN ('ACCEPTED', 'PASS') THEN 'Accepted' ELSE 'Rejected' END
+        ELSE 'Pending'
+    END
+"""
+FINAL_STAGE_SQL = f"CASE WHEN {HAS_FT_SQL} THEN 'FT' ELSE 'VQC' END"
+FINAL_REASON_SQL = f"""
+    CASE
+        WHEN {HAS_FT_SQL} THEN
+            CASE WHEN UPPER(ft_status) IN ('ACCEPTED', 'PASS') THEN '' ELSE COALESCE(BTRIM(ft_reason), '') END
+        WHEN {HAS_VQC_SQL} THEN
+            CASE WHEN UPPER(vqc_status) IN ('ACCEPTED', 'PASS') THEN '' ELSE COALESCE(BTRIM(vqc_reason), '') END
+        ELSE ''
+    END
+"""
+
+# Rejection trends rules: a VQC rejection is final and takes precedence, otherwise an
+# FT rejection counts. Reasons are grouped by their taxonomy code (see app.taxonomy).
+IS_VQC_REJECTED_SQL = "vqc_status IS NOT NULL AND UPPER(vqc_status) NOT IN ('ACCEPTED', 'PASS', '')"
+IS_FT_REJECTED_SQL = "ft_status IS NOT NULL AND UPPER(ft_status) NOT IN ('ACCEPTED', 'PASS', '')"
+REJECTION_STAGE_SQL = f"""
+    CASE WHEN {IS_VQC_REJECTED_SQL} THEN 'vqc' WHEN {IS_FT_REJECTED_SQL} THEN 'ft' END
+"""
+REJECTION_REASON_CODE_SQL = f"""
+    CASE WHEN {IS_VQC_REJECTED_SQL} THEN vqc_reason_code ELSE ft_reason_code END
+"""
+
+
+def refresh_daily_stats(cursor, dates):
+    """Recomputes rings_daily_stats for the given dates from the rings table and its final_* columns."""
+    dates = sorted(set(dates))
+    if not dates:
+        return 0
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (AGGREGATE_LOCK_KEY,))
+    cursor.execute("DELETE FROM rings_daily_stats WHERE date = ANY(%s)", (dates,))
+    cursor.execute("""
+        INSERT INTO rings_daily_stats (
+            date, vendor, hour, vqc_status, ft_status, final_status, final_stage, final_reason, ring_count
+        )
+        SELECT
+            date, vendor, COALESCE(EXTRACT(HOUR FROM created_at)::int, 0),
+            COALESCE(vqc_status, ''), COALESCE(ft_status, ''),
+            final_status, final_stage, final_reason, COUNT(*)
+        FROM rings
+        WHERE date = ANY(%s)
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+    """, (dates,))
+    cursor.execute("""
+        INSERT INTO rings_aggregate_dates (date)
+        SELECT unnest(%s::date[])
+        ON CONFLICT (date) DO UPDATE SET refreshed_at = CURRENT_TIMESTAMP
+    """, (dates,))
+    return len(dates)
+
+
+def refresh_rejection_facts(cursor, dates):
+    """Recomputes rings_rejection_facts for the given dates from the rings table.
+
+    Rows whose reasons were never classified (written behind the migration's back)
+    get their reason codes first.
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return 0
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (AGGREGATE_LOCK_KEY,))
+    backfill_reason_codes(cursor, dates)
+    cursor.execute("DELETE FROM rings_rejection_facts WHERE date = ANY(%s)", (dates,))
+    cursor.execute(f"""
+        INSERT INTO rings_rejection_facts (date, vendor, stage, reason_code, rejection_count)
+        SELECT date, vendor, stage, reason_code, COUNT(*)
+        FROM (
+            SELECT date, vendor, {REJECTION_STAGE_SQL} AS stage, {REJECTION_REASON_CODE_SQL} AS reason_code
+            FROM rings
+            WHERE date = ANY(%s) AND (({IS_VQC_REJECTED_SQL}) OR ({IS_FT_REJECTED_SQL}))
+        ) AS rejections
+        WHERE reason_code IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    """, (dates,))
+    return len(dates)
+
+
+def refresh_aggregates(cursor, dates):
+    """Recomputes every aggregate table for the given dates. Returns the number of dates refreshed."""
+    refresh_rejection_facts(cursor, dates)
+    invalidate_report_cache(cursor, dates)
+    return refresh_daily_stats(cursor, dates)
+
+
+def drop_aggregates(cursor, date_from, date_to):
+    """Deletes the aggregates, aggregate dates and cached reports dated date_from up to (not including) date_to.
+
+    For rows removed from rings without a per-date refresh, such as detached partitions.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (AGGREGATE_LOCK_KEY,))
+    for table in AGGREGATE_TABLES:
+        cursor.execute(f"DELETE FROM {table} WHERE date >= %s AND date < %s", (date_from, date_to))
+
+
+def apply_taxonomy_changes(cursor):
+    """Reclassifies stored reasons after a taxonomy change and refreshes the dates it affected.
+
+    Returns the refreshed dates, or None when the taxonomy is unchanged.
+    """
+    dates = reclassify_reasons(cursor)
+    if dates:
+        refresh_aggregates(cursor, dates)
+    return dates
+
+
+def ensure_aggregates(cursor, date_from, date_to=None):
+    """Backfills the aggregates for any date in date_from..date_to that was never aggregated.
+
+    Returns the dates that had to be refreshed.
+    """
+    cursor.execute("""
+        SELECT d::date FROM generate_series(%s::date, %s::date, '1 day'::interval) AS d
+        WHERE NOT EXISTS (SELECT 1 FROM rings_aggregate_dates a WHERE a.date = d::date)
+    """, (date_from, date_to or date_from))
+    missing = [row[0] for row in cursor.fetchall()]
+    if missing:
+        refresh_aggregates(cursor, missing)
+    return missing
@@ -0,0 +1,98 @@
+"""Serial and MO number suggestions for partially typed input.
+
+Suggestions are read from the ``text_pattern_ops`` indexes on UPPER(serial_number)
+and UPPER(mo_number): a prefix LIKE becomes a range scan on the index, read in
+the index's (byte-wise) order, so the first few distinct values come back
+without touching the rest of the table. Substring matches (match='contains')
+have no index to use and only fill the suggestions left over after the prefix
+matches.
+
+Every query runs under a statement timeout of AUTOCOMPLETE_TIMEOUT_MS. When
+the budget runs out, the suggestions found so far are returned and marked
+incomplete rather than failing the request.
+"""
+import os
+
+import psycopg2
+from psycopg2 import errors
+
+# Field name in the request -> rings column
+AUTOCOMPLETE_FIELDS = {'serial': 'serial_number', 'mo': 'mo_number'}
+AUTOCOMPLETE_MATCHES = ('prefix', 'contains')
+
+DEFAULT_AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+AUTOCOMPLETE_TIMEOUT_MS = int(os.getenv('AUTOCOMPLETE_TIMEOUT_MS', '200'))
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_autocomplete_request(args):
+    """Returns (field, text, limit, match) for the query arguments; raises ValueError if they are invalid."""
+    field = args.get('field', 'serial')
+    if field not in AUTOCOMPLETE_FIELDS:
+        raise ValueError(f"Invalid field: {field} (expected 'serial' or 'mo')")
+    text = (args.get('q') or '').strip().upper()
+    if not text:
+        raise ValueError('A search text (q) is required')
+    match = args.get('match', 'prefix')
+    if match not in AUTOCOMPLETE_MATCHES:
+        raise ValueError(f"Invalid match: {match} (expected 'prefix' or 'contains')")
+    try:
+        limit = int(args.get('limit', DEFAULT_AUTOCOMPLETE_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid limit: {args.get('limit')}")
+    if limit < 1:
+        raise ValueError(f"Invalid limit: {args.get('limit')}")
+    return field, text, min(limit, MAX_AUTOCOMPLETE_LIMIT), match
+
+
+def prefix_suggestions_sql(field):
+    """Returns the query for the first distinct values of a field that match a LIKE prefix pattern."""
+    column = f"UPPER({AUTOCOMPLETE_FIELDS[field]})"
+    # Ordering by the pattern operator class (~<~) lets the pattern index return
+    # matches in order, so the scan stops after limit distinct values
+    return f"""
+        SELECT DISTINCT {column} FROM rings
+        WHERE {column} LIKE %s
+        ORDER BY {column} USING ~<~
+        LIMIT %s
+    """
+
+
+def autocomplete(conn, field, text, limit, match='prefix'):
+    """Returns (suggestions, complete) for the upper-cased text typed into a field.
+
+    Prefix matches come first, in order; with match='contains' the remaining
+    slots are filled with values that contain the text elsewhere. complete is
+    False when the time budget ran out before the lookup finished.
+    """
+    column = f"UPPER({AUTOCOMPLETE_FIELDS[field]})"
+    escaped = _escape_like(text)
+    suggestions = []
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = %s", (AUTOCOMPLETE_TIMEOUT_MS,))
+            cursor.execute(prefix_suggestions_sql(field), (escaped + '%', limit))
+            suggestions.extend(row[0] for row in cursor.fetchall())
+
+            if match == 'contains' and len(suggestions) < limit:
+                # Rings share MO numbers, so read a few rows for every value still wanted
+                cursor.execute(f"""
+                    SELECT DISTINCT value FROM (
+                        SELECT {column} AS value FROM rings
+                        WHERE {column} LIKE %s AND {column} NOT LIKE %s
+                        LIMIT %s
+                    ) AS matches
+                """, ('%' + escaped + '%', escaped + '%', (limit - len(suggestions)) * 10))
+                suggestions.extend(sorted(row[0] for row in cursor.fetchall())[:limit - len(suggestions)])
+        conn.rollback()
+        return suggestions, True
+    except errors.QueryCanceled:
+        conn.rollback()
+        return suggestions, False
+    except psycopg2.Error:
+        conn.rollback()
+        raise
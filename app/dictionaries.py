@@ -0,0 +1,159 @@
+"""Filter option dictionaries for the low-cardinality rings columns.
+
+``vendor``, ``vqc_status`` and ``ft_status`` each have a dictionary table holding
+every value written to the column, so /api/search/filters reads a few small
+tables instead of scanning rings for distinct values. A rings trigger adds
+unseen values and the data migration loads new ones in bulk before writing.
+rings itself keeps the strings; the values are not replaced by ids.
+
+Rejection reasons come from two columns and get an options table of their own,
+``ring_reason_options``, maintained the same way.
+
+The tables only grow on write. Values no row holds any more are pruned after a
+sync rewrites rows and after old partitions are detached.
+"""
+
+# rings column -> dictionary table
+DICTIONARY_COLUMNS = {
+    'vendor': 'ring_vendors',
+    'vqc_status': 'ring_vqc_statuses',
+    'ft_status': 'ring_ft_statuses',
+}
+
+DICTIONARY_TABLES = list(DICTIONARY_COLUMNS.values())
+
+# Distinct non-empty vqc_reason/ft_reason values, for the reason filter
+REASON_OPTIONS_TABLE = 'ring_reason_options'
+# Reasons are free text, too long for a btree entry, so options are unique on md5(name)
+REASON_OPTIONS_TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {REASON_OPTIONS_TABLE} (name TEXT NOT NULL);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_{REASON_OPTIONS_TABLE}_name_md5 ON {REASON_OPTIONS_TABLE} (md5(name));
+"""
+REASON_COLUMNS = ('vqc_reason', 'ft_reason')
+
+# Every table holding filter options; emptied together with rings
+FILTER_OPTION_TABLES = DICTIONARY_TABLES + [REASON_OPTIONS_TABLE]
+
+
+def create_dictionaries_sql():
+    """SQL creating every dictionary table."""
+    return "\n".join(f"""
+        CREATE TABLE IF NOT EXISTS {table} (name VARCHAR(100) PRIMARY KEY);
+    """ for table in DICTIONARY_TABLES)
+
+
+def dictionary_trigger_function_sql():
+    """SQL for the rings trigger function that records unseen vendor and status values."""
+    blocks = "\n".join(f"""
+        IF NEW.{column} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {table} WHERE name = NEW.{column}) THEN
+            INSERT INTO {table} (name) VALUES (NEW.{column}) ON CONFLICT (name) DO NOTHING;
+        END IF;
+    """ for column, table in DICTIONARY_COLUMNS.items())
+    return f"""
+        CREATE OR REPLACE FUNCTION update_rings_dictionaries_trigger() RETURNS trigger AS $$
+        BEGIN
+            {blocks}
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+def reason_options_trigger_function_sql():
+    """SQL for the rings trigger function that records unseen rejection reasons."""
+    blocks = "\n".join(f"""
+        IF NEW.{column} IS NOT NULL AND NEW.{column} <> ''
+           AND NOT EXISTS (SELECT 1 FROM {REASON_OPTIONS_TABLE} WHERE md5(name) = md5(NEW.{column})) THEN
+            INSERT INTO {REASON_OPTIONS_TABLE} (name) VALUES (NEW.{column}) ON CONFLICT ((md5(name))) DO NOTHING;
+        END IF;
+    """ for column in REASON_COLUMNS)
+    return f"""
+        CREATE OR REPLACE FUNCTION update_rings_reason_options_trigger() RETURNS trigger AS $$
+        BEGIN
+            {blocks}
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+def sync_dictionaries(cursor, source_table):
+    """Adds every vendor and status in source_table that its dictionary does not have yet.
+
+    Returns the number of new dictionary entries.
+    """
+    added = 0
+    for column, table in DICTIONARY_COLUMNS.items():
+        cursor.execute(f"""
+            INSERT INTO {table} (name)
+            SELECT DISTINCT s.{column} FROM {source_table} s
+            WHERE s.{column} IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM {table} d WHERE d.name = s.{column})
+            ON CONFLICT (name) DO NOTHING
+        """)
+        added += cursor.rowcount
+    return added
+
+
+def sync_reason_options(cursor, source_table):
+    """Adds every rejection reason in source_table that is not a filter option yet.
+
+    Returns the number of new options.
+    """
+    reasons = " UNION ".join(f"SELECT {column} FROM {source_table}" for column in REASON_COLUMNS)
+    cursor.execute(f"""
+        INSERT INTO {REASON_OPTIONS_TABLE} (name)
+        SELECT s.reason FROM ({reasons}) AS s(reason)
+        WHERE s.reason IS NOT NULL AND s.reason <> ''
+          AND NOT EXISTS (SELECT 1 FROM {REASON_OPTIONS_TABLE} o WHERE md5(o.name) = md5(s.reason))
+        ON CONFLICT ((md5(name))) DO NOTHING
+    """)
+    return cursor.rowcount
+
+
+def prune_filter_options(cursor, candidates=None):
+    """Deletes the vendor, status and reason options that no rings row holds any more.
+
+    candidates maps rings columns to values rows were changed away from; only those
+    options are checked. Without candidates every option is checked.
+    Returns the number of options deleted.
+    """
+    checks = [(table, (column,)) for column, table in DICTIONARY_COLUMNS.items()]
+    checks.append((REASON_OPTIONS_TABLE, REASON_COLUMNS))
+    deleted = 0
+    for table, columns in checks:
+        # One NOT EXISTS per column, so each plans as an anti-join over rings
+        unused = " AND ".join(
+            f"NOT EXISTS (SELECT 1 FROM rings r WHERE r.{column} = o.name)" for column in columns
+        )
+        if candidates is None:
+            cursor.execute(f"DELETE FROM {table} o WHERE {unused}")
+        else:
+            values = sorted({value for column in columns for value in candidates.get(column, ()) if value})
+            if not values:
+                continue
+            cursor.execute(f"DELETE FROM {table} o WHERE o.name = ANY(%s) AND {unused}", (values,))
+        deleted += cursor.rowcount
+    return deleted
+
+
+def backfill_reason_options(cursor):
+    """Loads the reason filter options from rings."""
+    return sync_reason_options(cursor, 'rings')
+
+
+def backfill_dictionaries(cursor):
+    """Loads the dictionaries from rings."""
+    return sync_dictionaries(cursor, 'rings')
+
+
+def load_dictionary(cursor, column):
+    """Returns the non-empty values of one dictionary, sorted."""
+    cursor.execute(f"SELECT name FROM {DICTIONARY_COLUMNS[column]} WHERE name <> '' ORDER BY name")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def load_reason_options(cursor):
+    """Returns every rejection reason filter option, sorted."""
+    cursor.execute(f"SELECT name FROM {REASON_OPTIONS_TABLE} ORDER BY name")
+    return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,97 @@
+"""Streaming Excel (.xlsx) export helpers.
+
+Rows are written through an openpyxl write-only workbook, which serialises each
+row to a temporary file as it is appended instead of keeping a cell tree in
+memory. Column widths have to be known before the first row is written, so they
+are computed from the header and a bounded sample of leading rows; only that
+sample is ever held in memory.
+"""
+import tempfile
+from itertools import islice
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Leading rows used to size the columns
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 30
+
+# Bytes per chunk when streaming the finished file
+CHUNK_SIZE = 64 * 1024
+
+HEADER_FILL = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+HEADER_FONT = Font(color="FFFFFF", bold=True)
+HEADER_ALIGNMENT = Alignment(horizontal="center")
+
+
+def write_xlsx(sheet_title, headers, rows, row_fill=None, styled_columns=0, style_header=False, autosize=False):
+    """Writes headers and rows to a temporary .xlsx file and returns it, rewound.
+
+    rows may be any iterable, including a server-side cursor. row_fill(row)
+    returns a PatternFill (or None) applied to the first styled_columns cells of
+    that row; fills are created once by the caller and shared between rows.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_title)
+    rows = iter(rows)
+
+    sample = []
+    if autosize:
+        sample = list(islice(rows, WIDTH_SAMPLE_ROWS))
+        widths = [len(str(header)) for header in headers]
+        for row in sample:
+            for index, value in enumerate(row):
+                if value is not None:
+                    widths[index] = max(widths[index], len(str(value)))
+        for index, width in enumerate(widths, start=1):
+            worksheet.column_dimensions[get_column_letter(index)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+    if style_header:
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(worksheet, value=header)
+            cell.fill = HEADER_FILL
+            cell.font = HEADER_FONT
+            cell.alignment = HEADER_ALIGNMENT
+            header_cells.append(cell)
+        worksheet.append(header_cells)
+    else:
+        worksheet.append(list(headers))
+
+    def write_row(row):
+        fill = row_fill(row) if row_fill else None
+        if fill is None:
+            worksheet.append(list(row))
+            return
+        cells = list(row)
+        for index in range(min(styled_columns, len(cells))):
+            cell = WriteOnlyCell(worksheet, value=cells[index])
+            cell.fill = fill
+            cells[index] = cell
+        worksheet.append(cells)
+
+    for row in sample:
+        write_row(row)
+    for row in rows:
+        write_row(row)
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def iter_file(fileobj, chunk_size=CHUNK_SIZE):
+    """Yields the contents of fileobj in chunks and closes it when done."""
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
@@ -0,0 +1,172 @@
+"""Asynchronous export jobs with on-disk artifacts.
+
+Exports that may outlive a proxy timeout run on a small background thread pool
+and write their file into a local artifact store (EXPORT_ARTIFACT_DIR). Each
+job is described by a JSON status file next to its artifact, so any process on
+the host can answer polls and serve downloads, and status files are replaced
+atomically so readers never see a partial one.
+
+A job id is a fingerprint of the export type, format and normalised request,
+so identical requests share one job and one artifact for as long as it lives:
+the first submission claims the id (exclusive file creation) and later ones
+get the existing job back. Artifacts expire EXPORT_ARTIFACT_TTL seconds after
+they finish and are swept on the next submission; a failed job is retried by
+the next identical request.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+EXPORT_ARTIFACT_DIR = os.getenv('EXPORT_ARTIFACT_DIR', os.path.join(tempfile.gettempdir(), 'rings_exports'))
+EXPORT_ARTIFACT_TTL = int(os.getenv('EXPORT_ARTIFACT_TTL', '3600'))
+EXPORT_JOB_WORKERS = 2
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+_executor = None
+_jobs_lock = threading.Lock()
+
+
+def export_job_id(export_type, export_format, spec):
+    """Returns the job id shared by every request for the same export."""
+    key = json.dumps([export_type, export_format, spec], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _status_path(job_id):
+    return os.path.join(EXPORT_ARTIFACT_DIR, f'{job_id}.json')
+
+
+def artifact_path(job_id):
+    return os.path.join(EXPORT_ARTIFACT_DIR, f'{job_id}.artifact')
+
+
+def _write_status(job, exclusive=False):
+    """Writes a job's status file; with exclusive, fails with FileExistsError if the job is already claimed."""
+    path = _status_path(job['jobId'])
+    if exclusive:
+        with os.fdopen(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY), 'w') as status_file:
+            json.dump(job, status_file)
+        return
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as status_file:
+        json.dump(job, status_file)
+    os.replace(temp_path, path)
+
+
+def _read_status(job_id):
+    try:
+        with open(_status_path(job_id)) as status_file:
+            return json.load(status_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _remove_job(job_id):
+    for path in (_status_path(job_id), artifact_path(job_id), f'{artifact_path(job_id)}.part'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_export_job(job_id):
+    """Returns the status of a job, or None if it is unknown or has expired."""
+    if not job_id.isalnum():
+        return None
+    job = _read_status(job_id)
+    if job is None:
+        return None
+    if job['expiresAt'] <= time.time():
+        _remove_job(job_id)
+        return None
+    return job
+
+
+def cleanup_expired_exports():
+    """Deletes the status files and artifacts of expired jobs. Returns the number removed."""
+    if not os.path.isdir(EXPORT_ARTIFACT_DIR):
+        return 0
+    removed = 0
+    now = time.time()
+    for entry in os.listdir(EXPORT_ARTIFACT_DIR):
+        job_id, extension = os.path.splitext(entry)
+        if extension != '.json':
+            continue
+        job = _read_status(job_id)
+        if job is not None and job['expiresAt'] <= now:
+            _remove_job(job_id)
+            removed += 1
+    return removed
+
+
+def _get_executor():
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix='export-job')
+        return _executor
+
+
+def submit_export_job(export_type, export_format, spec, filename, mimetype, produce, logger=None):
+    """Starts an export job, or returns the live job for an identical request.
+
+    produce(fileobj) writes the export into an open binary file. Returns
+    (job status, created) where created is False for a deduplicated request.
+    """
+    os.makedirs(EXPORT_ARTIFACT_DIR, exist_ok=True)
+    cleanup_expired_exports()
+    job_id = export_job_id(export_type, export_format, spec)
+    now = time.time()
+
+    with _jobs_lock:
+        job = get_export_job(job_id)
+        if job is not None and job['status'] != JOB_FAILED:
+            return job, False
+        if job is not None:
+            _remove_job(job_id)
+
+        job = {
+            'jobId': job_id, 'type': export_type, 'format': export_format, 'status': JOB_PENDING,
+            'filename': filename, 'mimetype': mimetype, 'size': None, 'error': None,
+            # Until it finishes, a job that never completes (its process died) expires as well
+            'createdAt': now, 'finishedAt': None, 'expiresAt': now + EXPORT_ARTIFACT_TTL,
+        }
+        try:
+            _write_status(job, exclusive=True)
+        except FileExistsError:
+            # Another process claimed the same export first
+            return _read_status(job_id), False
+
+    _get_executor().submit(_run_export_job, job, produce, logger)
+    return job, True
+
+
+def _run_export_job(job, produce, logger):
+    job_id = job['jobId']
+    part_path = f'{artifact_path(job_id)}.part'
+    _write_status(dict(job, status=JOB_RUNNING))
+    try:
+        with open(part_path, 'wb') as output:
+            produce(output)
+        os.replace(part_path, artifact_path(job_id))
+        finished = time.time()
+        _write_status(dict(
+            job, status=JOB_DONE, size=os.path.getsize(artifact_path(job_id)),
+            finishedAt=finished, expiresAt=finished + EXPORT_ARTIFACT_TTL,
+        ))
+        if logger:
+            logger.info(f"Export job {job_id} ({job['type']}) finished.")
+    except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        _write_status(dict(job, status=JOB_FAILED, error=str(e), finishedAt=time.time()))
+        if logger:
+            logger.error(f"Export job {job_id} ({job['type']}) failed: {e}")
@@ -0,0 +1,195 @@
+"""Monthly range partitioning of the rings table on its date column.
+
+Partitions are named ``rings_yYYYYmMM`` and cover one calendar month each. Rows
+without a date land in ``rings_default``. Every report filters on date, so the
+planner prunes the query down to the months it touches, and old months can be
+detached without rewriting the rest of the table.
+"""
+import re
+from datetime import date
+
+import psycopg2
+
+from app.aggregates import drop_aggregates
+from app.dictionaries import prune_filter_options
+from app.search_cache import bump_data_version
+
+# How many months past the current one to keep partitions ready for
+PARTITION_MONTHS_AHEAD = 3
+
+DEFAULT_PARTITION = 'rings_default'
+PARTITION_NAME_RE = re.compile(r'^rings_y(\d{4})m(\d{2})$')
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+
+
+def partition_name(month):
+    return f"rings_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(cursor, table='rings'):
+    """Returns True when table is a declaratively partitioned table."""
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def list_partition_tables(cursor, table='rings'):
+    """Returns the names of the partitions attached to table."""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def list_partitions(cursor):
+    """Returns (partition_name, month_start or None, estimated_rows) for every attached partition."""
+    cursor.execute("""
+        SELECT c.relname, c.reltuples::bigint
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'rings'::regclass
+        ORDER BY c.relname
+    """)
+    partitions = []
+    for name, estimated_rows in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        month = date(int(match.group(1)), int(match.group(2)), 1) if match else None
+        partitions.append((name, month, max(estimated_rows, 0)))
+    return partitions
+
+
+def ensure_partitions(cursor, date_from=None, date_to=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Creates any missing monthly partitions covering date_from..date_to plus the months ahead of today.
+
+    Returns the names of the partitions that were created.
+    """
+    today = date.today()
+    first = month_start(min(d for d in (date_from, today) if d is not None))
+    last = month_start(max(d for d in (date_to, today) if d is not None))
+    for _ in range(months_ahead):
+        last = next_month(last)
+
+    created = []
+    month = first
+    while month <= last:
+        name = partition_name(month)
+        cursor.execute("SELECT to_regclass(%s) IS NULL", (name,))
+        if cursor.fetchone()[0]:
+            cursor.execute(
+                f"CREATE TABLE {name} PARTITION OF rings FOR VALUES FROM (%s) TO (%s)",
+                (month, next_month(month))
+            )
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def convert_rings_to_partitioned(conn, log=None):
+    """Rebuilds an ordinary rings table as a monthly range-partitioned one, keeping every row.
+
+    Indexes and triggers are carried over from their current definitions, so this
+    works at any schema version. Partitioned tables cannot enforce a UNIQUE
+    constraint without the partition key, so serial_number gets a plain index and
+    uniqueness is kept by the upsert in /api/migrate. The table is locked for the
+    duration of the copy.
+    """
+    if log is None:
+        log = []
+    try:
+        with conn.cursor() as cursor:
+            if is_partitioned(cursor):
+                log.append("The 'rings' table is already partitioned.")
+                return False
+
+            log.append("Converting 'rings' to a table partitioned by month...")
+            cursor.execute("LOCK TABLE rings IN ACCESS EXCLUSIVE MODE")
+
+            # Capture everything that has to be recreated on the new table
+            cursor.execute("""
+                SELECT pg_get_indexdef(i.indexrelid)
+                FROM pg_index i
+                WHERE i.indrelid = 'rings'::regclass
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+            """)
+            index_defs = [row[0] for row in cursor.fetchall()]
+            cursor.execute("""
+                SELECT pg_get_triggerdef(oid) FROM pg_trigger
+                WHERE tgrelid = 'rings'::regclass AND NOT tgisinternal
+            """)
+            trigger_defs = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT MIN(date), MAX(date) FROM rings")
+            min_date, max_date = cursor.fetchone()
+
+            cursor.execute("ALTER TABLE rings RENAME TO rings_unpartitioned")
+            cursor.execute("ALTER SEQUENCE rings_id_seq OWNED BY NONE")
+            cursor.execute("""
+                CREATE TABLE rings (LIKE rings_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED)
+                PARTITION BY RANGE (date)
+            """)
+            cursor.execute("ALTER TABLE rings ALTER COLUMN id SET NOT NULL")
+            cursor.execute("ALTER SEQUENCE rings_id_seq OWNED BY rings.id")
+            cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF rings DEFAULT")
+            created = ensure_partitions(cursor, min_date, max_date)
+            log.append(f"Created {len(created)} monthly partitions.")
+
+            cursor.execute("INSERT INTO rings SELECT * FROM rings_unpartitioned")
+            log.append(f"Copied {cursor.rowcount} rows into the partitioned table.")
+            cursor.execute("DROP TABLE rings_unpartitioned")
+
+            log.append("Recreating indexes and triggers on the partitioned table...")
+            cursor.execute("CREATE INDEX idx_rings_id ON rings(id)")
+            cursor.execute("CREATE INDEX idx_rings_serial_number ON rings(serial_number)")
+            for definition in index_defs + trigger_defs:
+                cursor.execute(re.sub(r'\bON (\w+\.)?rings_unpartitioned\b', r'ON \1rings', definition))
+        conn.commit()
+        return True
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+
+
+def detach_partitions_before(conn, cutoff, drop=False, log=None):
+    """Detaches every monthly partition that ends on or before cutoff.
+
+    Detaching only touches the catalog, so it is cheap regardless of partition size.
+    Detached tables are kept as standalone archives unless drop is True. The
+    aggregates and cached reports of the detached months, and the filter options
+    only they held, are deleted in the same transaction. Returns the names of the detached partitions.
+    """
+    if log is None:
+        log = []
+    try:
+        with conn.cursor() as cursor:
+            partitions = [
+                (name, month) for name, month, _ in list_partitions(cursor)
+                if month is not None and next_month(month) <= cutoff
+            ]
+            for name, month in partitions:
+                cursor.execute(f"ALTER TABLE rings DETACH PARTITION {name}")
+                # Reports must stop counting the detached rows
+                drop_aggregates(cursor, month, next_month(month))
+                if drop:
+                    cursor.execute(f"DROP TABLE {name}")
+                    log.append(f"Detached and dropped partition {name}.")
+                else:
+                    log.append(f"Detached partition {name}.")
+            if partitions:
+                # Vendors, statuses and reasons only the detached months held stop being offered
+                pruned = prune_filter_options(cursor)
+                if pruned:
+                    log.append(f"Removed {pruned} filter option(s) no longer in use.")
+                bump_data_version(cursor)
+        conn.commit()
+        return [name for name, _ in partitions]
+    except psycopg2.Error:
+        conn.rollback()
+        raise
@@ -0,0 +1,63 @@
+"""Persistent cache of daily reports for closed production days.
+
+``rings_report_cache`` stores the finished /api/reports/daily payload keyed by
+(date, vendor, report version). Rows are only written for days before today,
+are deleted whenever the aggregates of their date are refreshed (which every
+sync does for the dates it touched), and the previous day is pre-warmed after
+each sync. Bump DAILY_REPORT_VERSION whenever the report payload changes so old
+entries stop matching.
+"""
+from datetime import date, timedelta
+
+from psycopg2.extras import Json
+
+DAILY_REPORT_VERSION = 1
+
+# Cache key used for the all-vendor report
+ALL_VENDORS = 'all'
+
+
+def get_cached_report(cursor, report_date, vendor):
+    """Returns the cached report payload, or None."""
+    cursor.execute("""
+        SELECT payload FROM rings_report_cache
+        WHERE date = %s AND vendor = %s AND report_version = %s
+    """, (report_date, vendor, DAILY_REPORT_VERSION))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def store_cached_report(cursor, report_date, vendor, payload):
+    cursor.execute("""
+        INSERT INTO rings_report_cache (date, vendor, report_version, payload)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (date, vendor, report_version)
+        DO UPDATE SET payload = EXCLUDED.payload, created_at = CURRENT_TIMESTAMP
+    """, (report_date, vendor, DAILY_REPORT_VERSION, Json(payload)))
+
+
+def invalidate_report_cache(cursor, dates):
+    """Drops the cached reports of the given dates."""
+    cursor.execute("DELETE FROM rings_report_cache WHERE date = ANY(%s)", (sorted(set(dates)),))
+    return cursor.rowcount
+
+
+def warm_report_cache(cursor, build_report, report_date=None):
+    """Builds and caches the all-vendor and per-vendor reports of report_date (default: yesterday).
+
+    build_report(cursor, date_string, vendor) computes one report. Reports that are
+    already cached are left alone. Returns the number of reports built.
+    """
+    report_date = report_date or date.today() - timedelta(days=1)
+    cursor.execute("SELECT DISTINCT vendor FROM rings WHERE date = %s AND vendor IS NOT NULL", (report_date,))
+    vendors = sorted(row[0] for row in cursor.fetchall())
+    if not vendors:
+        return 0
+    vendors.insert(0, ALL_VENDORS)
+
+    built = 0
+    for vendor in vendors:
+        if get_cached_report(cursor, report_date, vendor) is None:
+            store_cached_report(cursor, report_date, vendor, build_report(cursor, report_date.isoformat(), vendor))
+            built += 1
+    return built
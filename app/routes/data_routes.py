@@ -6,15 +6,48 @@ import gspread
 from google.oauth2.service_account import Credentials
 from app.database import get_db_connection, return_db_connection
 from app.data_handler import load_sheets_data_parallel, merge_ring_data_fast, test_sheets_connection
+from app.aggregates import apply_taxonomy_changes, refresh_aggregates
+from app.dictionaries import prune_filter_options, sync_dictionaries, sync_reason_options
+from app.partitions import ensure_partitions, is_partitioned
+from app.report_cache import warm_report_cache
+from app.search_cache import bump_data_version
+from app.serial_index import apply_serial_index_changes, refresh_serial_index
+from app.streaming import open_server_cursor, requested_stream_format, stream_records
+from app.routes.report_routes import build_daily_report
+from app.taxonomy import sync_reason_lookup
 
 data_bp = Blueprint('data', __name__)
 
+# Arbitrary key for the advisory lock that serialises data migrations
+MIGRATE_LOCK_KEY = 7_241_002
+
+# rings columns a sync writes besides serial_number
+SYNC_COLUMNS = ['date', 'mo_number', 'vendor', 'ring_size', 'sku', 'vqc_status', 'vqc_reason', 'ft_status', 'ft_reason']
+# Synced columns with filter options, pruned when a sync changes rows away from a value
+PRUNE_COLUMNS = ['vendor', 'vqc_status', 'ft_status', 'vqc_reason', 'ft_reason']
+
 @data_bp.route('/data', methods=['GET'])
 def get_data():
-    """Get all rings data from the database."""
+    """Get all rings data from the database.
+
+    With ?stream=json or ?stream=ndjson (or Accept: application/x-ndjson) the rows
+    are streamed from a server-side cursor instead of being loaded at once.
+    """
     conn = None
+    try:
+        stream_format = requested_stream_format(request)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
     try:
         conn = get_db_connection()
+        if stream_format:
+            cursor = open_server_cursor(conn, 'data_stream', 'SELECT * FROM rings;')
+            response = stream_records(conn, cursor, stream_format, current_app.json.dumps, return_db_connection)
+            # The response now owns the connection
+            conn = None
+            return response
+
         cur = conn.cursor()
         cur.execute('SELECT * FROM rings;')
         
@@ -37,7 +70,9 @@ def get_data():
 def migrate():
     """Migrate data from Google Sheets to database with streaming response."""
     config = request.json
-    
+    # The stream outlives the request context
+    logger = current_app.logger
+
     def generate():
         def log_callback(message):
             # This helper is still useful for streaming from the main thread
@@ -130,17 +165,50 @@ def migrate():
                 yield from log_callback(f"Copying {len(merged_data)} records to DB...")
                 cursor.copy_expert(f"COPY rings_temp({','.join(cols)}) FROM STDIN WITH (FORMAT text, NULL '{null_identifier}')", string_buffer)
 
+                # Serialise concurrent syncs; a partitioned table cannot enforce UNIQUE(serial_number)
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATE_LOCK_KEY,))
+                if is_partitioned(cursor):
+                    cursor.execute("SELECT MIN(date), MAX(date) FROM rings_temp")
+                    created = ensure_partitions(cursor, *cursor.fetchone())
+                    if created:
+                        yield from log_callback(f"Created partitions: {', '.join(created)}.")
+
+                reclassified = apply_taxonomy_changes(cursor)
+                if reclassified:
+                    yield from log_callback(
+                        f"Reclassified rejection reasons on {len(reclassified)} date(s) after a taxonomy change."
+                    )
+
+                # Classify reasons not seen before so the rings trigger can store their codes
+                new_reasons = sync_reason_lookup(
+                    cursor, "SELECT vqc_reason FROM rings_temp UNION SELECT ft_reason FROM rings_temp"
+                )
+                if new_reasons:
+                    yield from log_callback(f"Classified {new_reasons} new rejection reason(s).")
+                new_values = sync_dictionaries(cursor, 'rings_temp') + sync_reason_options(cursor, 'rings_temp')
+                if new_values:
+                    yield from log_callback(f"Added {new_values} new vendor/status/reason filter option(s).")
+
                 yield from log_callback("Updating existing records...")
-                update_sql = """
+                # Only rows the sheet changed are rewritten. Each returns its serial index record,
+                # then from o, the row as it was, its old date and the filter options it may have
+                # been the last row to hold
+                update_sql = f"""
                 UPDATE rings r SET
                     date = t.date, mo_number = t.mo_number, vendor = t.vendor, ring_size = t.ring_size,
                     sku = t.sku, vqc_status = t.vqc_status, vqc_reason = t.vqc_reason,
                     ft_status = t.ft_status, ft_reason = t.ft_reason, updated_at = CURRENT_TIMESTAMP
                 FROM rings_temp t
-                WHERE r.serial_number = t.serial_number;
+                JOIN rings o ON o.serial_number = t.serial_number
+                WHERE r.serial_number = t.serial_number AND r.id = o.id
+                  AND ({', '.join(f'o.{column}' for column in SYNC_COLUMNS)})
+                      IS DISTINCT FROM ({', '.join(f't.{column}' for column in SYNC_COLUMNS)})
+                RETURNING UPPER(r.serial_number), r.date, r.vendor, r.vqc_status, r.ft_status,
+                          o.date, {', '.join(f'o.{column}' for column in PRUNE_COLUMNS)};
                 """
                 cursor.execute(update_sql)
-                yield from log_callback(f"{cursor.rowcount} existing records updated.")
+                updated = cursor.fetchall()
+                yield from log_callback(f"{len(updated)} existing records updated.")
 
                 yield from log_callback("Inserting new records...")
                 insert_sql = """
@@ -148,14 +216,48 @@ def migrate():
                 SELECT t.date, t.mo_number, t.vendor, t.serial_number, t.ring_size, t.sku, t.vqc_status, t.vqc_reason, t.ft_status, t.ft_reason
                 FROM rings_temp t
                 LEFT JOIN rings r ON t.serial_number = r.serial_number
-                WHERE r.serial_number IS NULL;
+                WHERE r.serial_number IS NULL
+                RETURNING UPPER(serial_number), date, vendor, vqc_status, ft_status;
                 """
                 cursor.execute(insert_sql)
-                yield from log_callback(f"{cursor.rowcount} new records inserted.")
+                inserted = cursor.fetchall()
+                yield from log_callback(f"{len(inserted)} new records inserted.")
+
+                # The dates the changed rows moved away from or to
+                touched_dates = sorted({row[1] for row in updated + inserted if row[1] is not None}
+                                       | {row[5] for row in updated if row[5] is not None})
+                data_version = None
+                if updated or inserted or reclassified:
+                    yield from log_callback(f"Refreshing report aggregates for {len(touched_dates)} date(s)...")
+                    refresh_aggregates(cursor, touched_dates)
+                    pruned = prune_filter_options(cursor, {
+                        column: {row[6 + i] for row in updated} for i, column in enumerate(PRUNE_COLUMNS)
+                    })
+                    if pruned:
+                        yield from log_callback(f"Removed {pruned} filter option(s) no longer in use.")
+                    data_version = bump_data_version(cursor)
+                    # The serial index records of the changed and inserted rows
+                    index_changes = [row[:5] for row in updated] + inserted
+                else:
+                    yield from log_callback("No records changed; report aggregates and caches are kept.")
 
             conn.commit()
             yield from log_callback("Migration completed successfully!")
 
+            if data_version is not None and not apply_serial_index_changes(index_changes, data_version):
+                refresh_serial_index(get_db_connection, return_db_connection, logger)
+
+            # Serve yesterday's reports from the cache from the first view on
+            try:
+                with conn.cursor() as cursor:
+                    warmed = warm_report_cache(cursor, build_daily_report)
+                conn.commit()
+                if warmed:
+                    yield from log_callback(f"Pre-computed {warmed} report(s) for the previous day.")
+            except psycopg2.Error as e:
+                conn.rollback()
+                logger.warning(f"Could not pre-warm the report cache: {e}")
+
         except (psycopg2.Error, Exception) as e:
             if conn:
                 conn.rollback()
@@ -1,6 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 import psycopg2
+import pandas as pd
+from app.aggregates import AGGREGATE_TABLES, apply_taxonomy_changes, refresh_aggregates
+from app.dictionaries import FILTER_OPTION_TABLES
 from app.database import check_single_db_connection, get_db_connection, return_db_connection
+from app.partitions import (
+    convert_rings_to_partitioned, detach_partitions_before, ensure_partitions, is_partitioned, list_partitions
+)
+from app.search_cache import bump_data_version
+from app.serial_index import invalidate_serial_index, refresh_serial_index
+from app.schema import (
+    LATEST_SCHEMA_VERSION, SCHEMA_MIGRATIONS, apply_migrations, get_applied_migrations,
+    get_schema_version, reset_schema
+)
 
 db_bp = Blueprint('db', __name__)
 
@@ -25,73 +37,167 @@ def test_db_connection():
 
 @db_bp.route('/db/schema', methods=['POST'])
 def create_schema_endpoint():
-    """Endpoint to create the database schema."""
+    """Endpoint to bring the database schema up to the latest version.
+
+    Pending migrations are applied incrementally and existing data is kept.
+    Pass {"reset": true} to drop and recreate everything from scratch, and
+    {"partitioned": true} to convert 'rings' to monthly range partitions.
+    """
+    config = request.get_json(silent=True) or {}
     conn = None
     log = []
     try:
         conn = get_db_connection()
+        if config.get('reset'):
+            reset_schema(conn, log)
+
+        applied = apply_migrations(conn, log)
+        if config.get('partitioned'):
+            convert_rings_to_partitioned(conn, log)
+
         with conn.cursor() as cursor:
-            log.append("Dropping existing schema objects if they exist...")
-            cursor.execute("DROP TABLE IF EXISTS rings;")
-            cursor.execute("DROP FUNCTION IF EXISTS update_rings_tsvector_trigger CASCADE;")
+            reclassified = apply_taxonomy_changes(cursor)
+            if reclassified:
+                log.append(f"Reclassified rejection reasons on {len(reclassified)} date(s) after a taxonomy change.")
+            partitioned = is_partitioned(cursor)
+            if partitioned:
+                created = ensure_partitions(cursor)
+                if created:
+                    log.append(f"Created upcoming partitions: {', '.join(created)}.")
+        conn.commit()
+        if config.get('reset'):
+            invalidate_serial_index()
+            refresh_serial_index(get_db_connection, return_db_connection, current_app.logger)
+        log.append("Database schema, optimized indexes, and triggers are up to date.")
+        return jsonify(
+            status="success", logs=log, applied=applied,
+            version=get_schema_version(conn), partitioned=partitioned
+        )
+    except psycopg2.Error as db_err:
+        if conn:
+            conn.rollback()
+        return jsonify(status="error", message=f"Database error during schema creation: {db_err}"), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
 
-            log.append("Creating the 'rings' table and base indexes...")
-            create_table_sql = """
-            CREATE TABLE rings (
-                id SERIAL PRIMARY KEY, date DATE, mo_number VARCHAR(50), vendor VARCHAR(50),
-                serial_number VARCHAR(100) UNIQUE, ring_size VARCHAR(100), sku VARCHAR(50),
-                vqc_status VARCHAR(100), vqc_reason TEXT, ft_status VARCHAR(100), ft_reason TEXT,
-                reason_tsvector TSVECTOR, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            CREATE INDEX idx_serial_number ON rings(serial_number);
-            CREATE INDEX idx_vendor ON rings(vendor);
-            CREATE INDEX idx_date_desc ON rings(date DESC);
-            """
-            cursor.execute(create_table_sql)
+@db_bp.route('/db/schema', methods=['GET'])
+def get_schema_status_endpoint():
+    """Endpoint to report the applied and pending schema migrations."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        applied = get_applied_migrations(conn)
+        applied_versions = {row[0] for row in applied}
+        return jsonify(
+            status="success",
+            version=max(applied_versions, default=0),
+            latestVersion=LATEST_SCHEMA_VERSION,
+            applied=[
+                {'version': version, 'description': description, 'appliedAt': applied_at.isoformat()}
+                for version, description, applied_at in applied
+            ],
+            pending=[
+                {'version': m['version'], 'description': m['description']}
+                for m in SCHEMA_MIGRATIONS if m['version'] not in applied_versions
+            ]
+        )
+    except psycopg2.Error as db_err:
+        return jsonify(status="error", message=f"Database error reading schema version: {db_err}"), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
 
-            log.append("Adding optimized composite and full-text search indexes...")
-            optimized_indexes_sql = """
-            CREATE INDEX idx_rings_composite ON rings(vendor, vqc_status, ft_status);
-            CREATE INDEX idx_rings_text_search ON rings USING GIN(reason_tsvector);
-            """
-            cursor.execute(optimized_indexes_sql)
+@db_bp.route('/db/partitions', methods=['GET'])
+def list_partitions_endpoint():
+    """Endpoint to list the monthly partitions of the 'rings' table."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            if not is_partitioned(cursor):
+                return jsonify(status="success", partitioned=False, partitions=[])
+            partitions = list_partitions(cursor)
+        return jsonify(status="success", partitioned=True, partitions=[
+            {'name': name, 'month': month.isoformat() if month else None, 'estimatedRows': rows}
+            for name, month, rows in partitions
+        ])
+    except psycopg2.Error as db_err:
+        return jsonify(status="error", message=f"Database error listing partitions: {db_err}"), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
 
-            log.append("Creating trigger function for automatic full-text search indexing...")
-            tsvector_trigger_sql = """
-            CREATE OR REPLACE FUNCTION update_rings_tsvector_trigger() RETURNS trigger AS $$
-            BEGIN
-                NEW.reason_tsvector :=
-                    to_tsvector('english', COALESCE(NEW.vqc_reason, '') || ' ' || COALESCE(NEW.ft_reason, ''));
-                RETURN NEW;
-            END;
-            $$ LANGUAGE plpgsql;
+@db_bp.route('/db/partitions/detach', methods=['POST'])
+def detach_partitions_endpoint():
+    """Endpoint to detach (and optionally drop) monthly partitions that end on or before a cutoff date."""
+    config = request.get_json(silent=True) or {}
+    if not config.get('before'):
+        return jsonify(status='error', message='A "before" date is required.'), 400
+    try:
+        cutoff = pd.to_datetime(config['before']).date()
+    except (ValueError, TypeError):
+        return jsonify(status='error', message=f"Invalid date: {config['before']}"), 400
 
-            CREATE TRIGGER tsvectorupdate BEFORE INSERT OR UPDATE
-            ON rings FOR EACH ROW EXECUTE PROCEDURE update_rings_tsvector_trigger();
-            """
-            cursor.execute(tsvector_trigger_sql)
+    conn = None
+    log = []
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            if not is_partitioned(cursor):
+                return jsonify(status='error', message="The 'rings' table is not partitioned."), 400
+        detached = detach_partitions_before(conn, cutoff, drop=bool(config.get('drop')), log=log)
+        if detached:
+            invalidate_serial_index()
+            refresh_serial_index(get_db_connection, return_db_connection, current_app.logger)
+        return jsonify(status="success", detached=detached, logs=log)
+    except psycopg2.Error as db_err:
+        return jsonify(status="error", message=f"Database error detaching partitions: {db_err}"), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
 
+@db_bp.route('/db/aggregates/refresh', methods=['POST'])
+def refresh_aggregates_endpoint():
+    """Endpoint to recompute the report aggregates for a date range, or for every date in 'rings'."""
+    config = request.get_json(silent=True) or {}
+    date_from, date_to = config.get('dateFrom'), config.get('dateTo')
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            if date_from or date_to:
+                cursor.execute("""
+                    SELECT d::date FROM generate_series(%s::date, %s::date, '1 day'::interval) AS d
+                """, (date_from or date_to, date_to or date_from))
+            else:
+                cursor.execute("SELECT DISTINCT date FROM rings WHERE date IS NOT NULL")
+            dates = [row[0] for row in cursor.fetchall()]
+            refreshed = refresh_aggregates(cursor, dates)
         conn.commit()
-        log.append("Database schema, optimized indexes, and triggers created successfully.")
-        return jsonify(status="success", logs=log)
+        return jsonify(status="success", message=f"Refreshed report aggregates for {refreshed} date(s).")
     except psycopg2.Error as db_err:
         if conn:
             conn.rollback()
-        return jsonify(status="error", message=f"Database error during schema creation: {db_err}"), 500
+        return jsonify(status="error", message=f"Database error refreshing aggregates: {db_err}"), 500
     finally:
         if conn:
             return_db_connection(conn)
 
 @db_bp.route('/db/clear', methods=['DELETE'])
 def clear_database_endpoint():
-    """Endpoint to clear the 'rings' table."""
+    """Endpoint to clear the 'rings' table and everything aggregated from it."""
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            cursor.execute("TRUNCATE TABLE rings RESTART IDENTITY")
+            cursor.execute(
+                f"TRUNCATE TABLE rings, {', '.join(AGGREGATE_TABLES + FILTER_OPTION_TABLES)} RESTART IDENTITY"
+            )
+            bump_data_version(cursor)
         conn.commit()
+        invalidate_serial_index()
+        refresh_serial_index(get_db_connection, return_db_connection, current_app.logger)
         return jsonify(status="success", message="Database 'rings' table has been cleared.")
     except (psycopg2.Error, Exception) as e:
         if conn:
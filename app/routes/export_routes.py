@@ -0,0 +1,158 @@
+from flask import Blueprint, request, jsonify, send_file, url_for, current_app
+import io
+import shutil
+from datetime import datetime, timezone
+import psycopg2
+from app.database import get_db_connection, return_db_connection
+from app.excel import XLSX_MIMETYPE
+from app.export_jobs import JOB_DONE, artifact_path, get_export_job, submit_export_job
+from app.routes.report_routes import (
+    parse_rejection_trends_export, rejection_trends_export_filename, write_rejection_trends_export,
+)
+from app.search_cache import get_data_version
+from app.search_query import SEARCH_COLUMNS, search_export_query
+from app.streaming import csv_chunks, open_server_cursor
+
+export_bp = Blueprint('exports', __name__)
+
+EXPORT_TYPES = ('search', 'rejection-trends')
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc).isoformat() if value else None
+
+
+def _job_response(job):
+    response = {
+        'jobId': job['jobId'],
+        'type': job['type'],
+        'format': job['format'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'size': job['size'],
+        'error': job['error'],
+        'createdAt': _timestamp(job['createdAt']),
+        'finishedAt': _timestamp(job['finishedAt']),
+        'expiresAt': _timestamp(job['expiresAt']),
+    }
+    if job['status'] == JOB_DONE:
+        response['downloadUrl'] = url_for('exports.download_export', job_id=job['jobId'])
+    return response
+
+
+def _search_export_producer(query, params):
+    def produce(output):
+        conn = get_db_connection()
+        try:
+            cursor = open_server_cursor(conn, 'export_search_job', query, tuple(params))
+            try:
+                text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+                for chunk in csv_chunks(SEARCH_COLUMNS, cursor):
+                    text.write(chunk)
+                text.flush()
+                text.detach()
+            finally:
+                cursor.close()
+        finally:
+            return_db_connection(conn)
+    return produce
+
+
+def _rejection_trends_producer(spec):
+    def produce(output):
+        conn = get_db_connection()
+        try:
+            with write_rejection_trends_export(conn, spec) as export_file:
+                shutil.copyfileobj(export_file, output)
+        finally:
+            return_db_connection(conn)
+    return produce
+
+
+@export_bp.route('/exports', methods=['POST'])
+def submit_export():
+    """Starts an export job and returns its status.
+
+    The body names the export type ('search' or 'rejection-trends') and carries
+    in filters the same request the synchronous export endpoint takes. Identical
+    requests share one job while its artifact lives and the data is unchanged.
+    """
+    body = request.json or {}
+    export_type = body.get('type')
+    filters = dict(body.get('filters') or {})
+    if 'format' in body:
+        filters['format'] = body['format']
+
+    if export_type not in EXPORT_TYPES:
+        return jsonify({'error': f"Invalid export type: {export_type} (expected 'search' or 'rejection-trends')"}), 400
+
+    try:
+        if export_type == 'search':
+            export_format = str(filters.get('format', 'csv')).lower()
+            if export_format != 'csv':
+                raise ValueError('Search results can only be exported as CSV')
+            query, params = search_export_query(filters)
+            spec = {'query': query, 'params': params}
+            filename, mimetype = 'search_results.csv', 'text/csv'
+            produce = _search_export_producer(query, params)
+        else:
+            spec = parse_rejection_trends_export(filters)
+            export_format = spec['format']
+            filename = rejection_trends_export_filename(spec)
+            mimetype = 'text/csv' if export_format == 'csv' else XLSX_MIMETYPE
+            produce = _rejection_trends_producer(spec)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = None
+    try:
+        # Exports of different data versions must not share an artifact
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            spec = {'dataVersion': get_data_version(cursor), 'request': spec}
+    except psycopg2.Error as e:
+        current_app.logger.error(f"Could not start export job: {e}")
+        return jsonify({'error': f'Database error: {e}'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+    try:
+        job, created = submit_export_job(
+            export_type, export_format, spec, filename, mimetype, produce, current_app.logger
+        )
+    except OSError as e:
+        current_app.logger.error(f"Could not start export job: {e}")
+        return jsonify({'error': f'Could not start export job: {e}'}), 500
+
+    if created:
+        current_app.logger.info(f"Started export job {job['jobId']} ({export_type}).")
+    response = jsonify(_job_response(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('exports.get_export', job_id=job['jobId'])
+    return response
+
+
+@export_bp.route('/exports/<job_id>', methods=['GET'])
+def get_export(job_id):
+    """Returns the status of an export job."""
+    job = get_export_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Export job not found or expired'}), 404
+    return jsonify(_job_response(job))
+
+
+@export_bp.route('/exports/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    """Downloads the artifact of a finished export job."""
+    job = get_export_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Export job not found or expired'}), 404
+    if job['status'] != JOB_DONE:
+        return jsonify({'error': f"Export job is {job['status']}", 'status': job['status']}), 409
+    try:
+        return send_file(
+            artifact_path(job_id), mimetype=job['mimetype'], as_attachment=True, download_name=job['filename']
+        )
+    except FileNotFoundError:
+        return jsonify({'error': 'Export job not found or expired'}), 404
@@ -1,12 +1,314 @@
 from flask import Blueprint, request, jsonify, Response, current_app
 import csv
 import io
+import tempfile
+import threading
 import psycopg2
 import pandas as pd
+from collections import OrderedDict
+from datetime import date
+from openpyxl.styles import PatternFill
+from app.aggregates import ensure_aggregates
 from app.database import get_db_connection, return_db_connection
+from app.excel import XLSX_MIMETYPE, iter_file, write_xlsx
+from app.report_cache import get_cached_report, store_cached_report
+from app.streaming import open_server_cursor, stream_csv
+from app.taxonomy import REJECTION_REASONS
 
 report_bp = Blueprint('reports', __name__)
 
+# Rows per round trip when exports read from a server-side cursor
+EXPORT_FETCH_SIZE = 2000
+
+# Row colours of the rejection trends Excel export, per taxonomy category
+STAGE_FILLS = {
+    'ASSEMBLY': PatternFill(start_color="E3F2FD", end_color="E3F2FD", fill_type="solid"),
+    'CASTING': PatternFill(start_color="F3E5F5", end_color="F3E5F5", fill_type="solid"),
+    'FUNCTIONAL': PatternFill(start_color="FFEBEE", end_color="FFEBEE", fill_type="solid"),
+    'POLISHING': PatternFill(start_color="E8F5E8", end_color="E8F5E8", fill_type="solid"),
+    'SHELL': PatternFill(start_color="FFF3E0", end_color="FFF3E0", fill_type="solid")
+}
+
+# Longest window /reports/daily-range serves in one request
+MAX_RANGE_REPORT_DAYS = 366
+# Most rejection reasons /reports/daily-range lists per day
+MAX_RANGE_TOP_REASONS = 50
+
+# In-process cache of per-day rejection buckets for the trends reports:
+# date -> (aggregates refreshed_at, {(vendor, stage, reason_code): count}), least recently used first
+REJECTION_BUCKET_CACHE_DAYS = 400
+_rejection_buckets = OrderedDict()
+_rejection_buckets_lock = threading.Lock()
+
+def _yield_counts(received, accepted, rejected, pending):
+    """Report figures for one bucket; yield excludes pending rings."""
+    completed = accepted + rejected
+    return {
+        'totalReceived': received,
+        'totalAccepted': accepted,
+        'totalRejected': rejected,
+        'totalPending': pending,
+        'yield': round(accepted / completed * 100, 2) if completed > 0 else 0
+    }
+
+def _parse_vendor_selection(selected_vendor):
+    """Returns the vendors a trends request covers, None for 'all', or [] for an empty selection."""
+    if selected_vendor == 'all':
+        return None
+    if isinstance(selected_vendor, list):
+        return [vendor for vendor in selected_vendor if vendor]
+    return [selected_vendor] if selected_vendor else []
+
+def _load_rejection_buckets(cursor, date_from, date_to):
+    """Returns {date: {(vendor, stage, reason_code): final rejections}} for every aggregated date in the window.
+
+    Days are kept in the in-process cache together with the refreshed_at stamp of
+    their aggregates. Only days that are missing or were refreshed since (every
+    sync refreshes the dates it touched) are read from the fact table, in one
+    grouped query.
+    """
+    cursor.execute("""
+        SELECT date, refreshed_at FROM rings_aggregate_dates WHERE date BETWEEN %s AND %s
+    """, (date_from, date_to))
+    versions = dict(cursor.fetchall())
+
+    with _rejection_buckets_lock:
+        buckets = {}
+        for day, refreshed_at in versions.items():
+            cached = _rejection_buckets.get(day)
+            if cached is not None and cached[0] == refreshed_at:
+                _rejection_buckets.move_to_end(day)
+                buckets[day] = cached[1]
+    dirty_days = sorted(day for day in versions if day not in buckets)
+
+    if dirty_days:
+        loaded = {day: {} for day in dirty_days}
+        cursor.execute("""
+            SELECT date, vendor, stage, reason_code, SUM(rejection_count)
+            FROM rings_rejection_facts
+            WHERE date = ANY(%s)
+            GROUP BY date, vendor, stage, reason_code
+        """, (dirty_days,))
+        for day, vendor, stage, code, count in cursor.fetchall():
+            loaded[day][(vendor, stage, code)] = int(count)
+
+        with _rejection_buckets_lock:
+            for day, day_buckets in loaded.items():
+                _rejection_buckets[day] = (versions[day], day_buckets)
+                _rejection_buckets.move_to_end(day)
+            while len(_rejection_buckets) > REJECTION_BUCKET_CACHE_DAYS:
+                _rejection_buckets.popitem(last=False)
+        buckets.update(loaded)
+    return buckets
+
+def _load_rejection_counts(cursor, vendors, date_from, date_to, rejection_stage):
+    """Returns {(vendor, reason_code, date): final rejections} assembled from the per-day buckets.
+
+    vendors=None covers every vendor.
+    """
+    selected = None if vendors is None else set(vendors)
+    counts = {}
+    for day, day_buckets in _load_rejection_buckets(cursor, date_from, date_to).items():
+        for (vendor, stage, code), count in day_buckets.items():
+            if (selected is None or vendor in selected) and rejection_stage in ('both', stage):
+                key = (vendor, code, day)
+                counts[key] = counts.get(key, 0) + count
+    return counts
+
+def _combine_rejection_counts(rejection_counts):
+    """Sums {(vendor, reason_code, date): count} across vendors into {(reason_code, date): count}."""
+    combined = {}
+    for (_, code, day), count in rejection_counts.items():
+        combined[(code, day)] = combined.get((code, day), 0) + count
+    return combined
+
+def _build_trends_matrix(counts, days, date_range):
+    """Returns (rows, summary) of the trends spreadsheet for {(reason_code, date): count}."""
+    trends_data = []
+    stage_wise_totals = {}
+    for code, stage, rejection_type in REJECTION_REASONS:
+        date_wise_data = {label: counts.get((code, day), 0) for day, label in zip(days, date_range)}
+        total = sum(date_wise_data.values())
+        trends_data.append({
+            'stage': stage,
+            'rejection': rejection_type,
+            'dateWiseData': date_wise_data,
+            'totals': {'total': total}
+        })
+        stage_wise_totals[stage] = stage_wise_totals.get(stage, 0) + total
+
+    summary = {
+        'totalRejections': sum(stage_wise_totals.values()),
+        'stageWiseTotals': stage_wise_totals,
+        'dateRange': len(date_range)
+    }
+    return trends_data, summary
+
+def build_daily_report(cursor, selected_date, selected_vendor):
+    """Computes the daily report for one date and vendor (or 'all') from rings_daily_stats."""
+    # Aggregate the date on demand if no sync has done it yet
+    ensure_aggregates(cursor, selected_date)
+
+    vendor_condition = "" if selected_vendor == 'all' else " AND vendor = %s"
+    params = [selected_date]
+    if selected_vendor != 'all':
+        params.append(selected_vendor)
+
+    # One pass over the pre-aggregated rows, grouped per vendor, per hour, per
+    # rejection reason and per VQC/FT status class
+    cursor.execute(f"""
+        SELECT
+            CASE
+                WHEN GROUPING(vendor) = 0 THEN 'vendor'
+                WHEN GROUPING(hour) = 0 THEN 'hour'
+                WHEN GROUPING(final_reason) = 0 THEN 'reason'
+                WHEN GROUPING(vqc_class) = 0 THEN 'vqc'
+                ELSE 'ft'
+            END AS grouping_set,
+            vendor, hour, final_stage, final_reason, COALESCE(vqc_class, ft_class) AS status_class,
+            SUM(ring_count) AS received,
+            COALESCE(SUM(ring_count) FILTER (WHERE final_status = 'Accepted'), 0) AS accepted,
+            COALESCE(SUM(ring_count) FILTER (WHERE final_status = 'Rejected'), 0) AS rejected,
+            COALESCE(SUM(ring_count) FILTER (WHERE final_status = 'Pending'), 0) AS pending
+        FROM (
+            SELECT
+                vendor, hour, final_status, final_stage, final_reason, ring_count,
+                CASE WHEN BTRIM(vqc_status) = '' THEN 'pending'
+                     WHEN UPPER(vqc_status) IN ('ACCEPTED', 'PASS') THEN 'accepted'
+                     ELSE 'rejected' END AS vqc_class,
+                CASE WHEN BTRIM(ft_status) = '' THEN 'pending'
+                     WHEN UPPER(ft_status) IN ('ACCEPTED', 'PASS') THEN 'accepted'
+                     ELSE 'rejected' END AS ft_class
+            FROM rings_daily_stats
+            WHERE date = %s{vendor_condition}
+        ) AS stats
+        GROUP BY GROUPING SETS ((vendor), (hour), (final_stage, final_reason), (vqc_class), (ft_class))
+        ORDER BY grouping_set, vendor, hour
+    """, tuple(params))
+
+    grouped_rows = cursor.fetchall()
+
+    if not grouped_rows:
+        return {
+            'date': selected_date,
+            'vendor': selected_vendor,
+            'totalReceived': 0,
+            'totalAccepted': 0,
+            'totalRejected': 0,
+            'totalPending': 0,
+            'yield': 0,
+            'vqcBreakdown': {'accepted': 0, 'rejected': 0, 'pending': 0, 'rejectionReasons': []},
+            'ftBreakdown': {'accepted': 0, 'rejected': 0, 'pending': 0, 'rejectionReasons': []},
+            'hourlyData': [],
+            'vendorBreakdown': []
+        }
+
+    vendor_stats = {}
+    vqc_rejection_reasons = {}
+    ft_rejection_reasons = {}
+    hourly_stats = {}
+    stage_counts = {
+        'vqc': {'accepted': 0, 'rejected': 0, 'pending': 0},
+        'ft': {'accepted': 0, 'rejected': 0, 'pending': 0}
+    }
+
+    for grouping_set, vendor, hour, stage, final_reason, status_class, *counts in grouped_rows:
+        received, accepted, rejected, pending = (int(count) for count in counts)
+        totals = {'received': received, 'accepted': accepted, 'rejected': rejected, 'pending': pending}
+        if grouping_set == 'vendor':
+            vendor_stats[vendor] = totals
+        elif grouping_set == 'hour':
+            hourly_stats[hour] = totals
+        elif grouping_set == 'reason':
+            # Rejection reasons are tracked against the stage that made the final call
+            if rejected and final_reason:
+                reasons = vqc_rejection_reasons if stage == 'VQC' else ft_rejection_reasons
+                reasons[final_reason] = rejected
+        else:
+            stage_counts[grouping_set][status_class] = received
+
+    # Calculate totals
+    total_received = sum(stats['received'] for stats in vendor_stats.values())
+    total_accepted = sum(stats['accepted'] for stats in vendor_stats.values())
+    total_rejected = sum(stats['rejected'] for stats in vendor_stats.values())
+    total_pending = sum(stats['pending'] for stats in vendor_stats.values())
+    
+    # Calculate yield (excluding pending rings from yield calculation)
+    completed_rings = total_accepted + total_rejected
+    overall_yield = (total_accepted / completed_rings * 100) if completed_rings > 0 else 0
+    
+    # Prepare vendor breakdown if 'all' is selected
+    vendor_breakdown_data = []
+    if selected_vendor == 'all':
+        for vendor_name, stats in vendor_stats.items():
+            completed = stats['accepted'] + stats['rejected']
+            vendor_yield = (stats['accepted'] / completed * 100) if completed > 0 else 0
+            vendor_breakdown_data.append({
+                'vendor': vendor_name,
+                'totalReceived': stats['received'],
+                'totalAccepted': stats['accepted'],
+                'totalRejected': stats['rejected'],
+                'totalPending': stats['pending'],
+                'yield': round(vendor_yield, 2)
+            })
+    
+    # Prepare VQC rejection reasons
+    total_vqc_rejected = sum(vqc_rejection_reasons.values())
+    vqc_rejection_list = []
+    for reason, count in sorted(vqc_rejection_reasons.items(), key=lambda x: (-x[1], x[0])):
+        percentage = (count / total_vqc_rejected * 100) if total_vqc_rejected > 0 else 0
+        vqc_rejection_list.append({
+            'reason': reason,
+            'count': count,
+            'percentage': round(percentage, 1)
+        })
+    
+    # Prepare FT rejection reasons
+    total_ft_rejected = sum(ft_rejection_reasons.values())
+    ft_rejection_list = []
+    for reason, count in sorted(ft_rejection_reasons.items(), key=lambda x: (-x[1], x[0])):
+        percentage = (count / total_ft_rejected * 100) if total_ft_rejected > 0 else 0
+        ft_rejection_list.append({
+            'reason': reason,
+            'count': count,
+            'percentage': round(percentage, 1)
+        })
+    
+    # Prepare hourly data
+    hourly_data = []
+    for hour in sorted(hourly_stats.keys()):
+        hourly_data.append({
+            'hour': f"{hour:02d}:00",
+            'received': hourly_stats[hour]['received'],
+            'accepted': hourly_stats[hour]['accepted'],
+            'rejected': hourly_stats[hour]['rejected'],
+            'pending': hourly_stats[hour]['pending']
+        })
+    
+    return {
+        'date': selected_date,
+        'vendor': selected_vendor,
+        'totalReceived': total_received,
+        'totalAccepted': total_accepted,
+        'totalRejected': total_rejected,
+        'totalPending': total_pending,
+        'yield': round(overall_yield, 2),
+        'vqcBreakdown': {
+            'accepted': stage_counts['vqc']['accepted'],
+            'rejected': stage_counts['vqc']['rejected'],
+            'pending': stage_counts['vqc']['pending'],
+            'rejectionReasons': vqc_rejection_list
+        },
+        'ftBreakdown': {
+            'accepted': stage_counts['ft']['accepted'],
+            'rejected': stage_counts['ft']['rejected'],
+            'pending': stage_counts['ft']['pending'],
+            'rejectionReasons': ft_rejection_list
+        },
+        'hourlyData': hourly_data,
+        'vendorBreakdown': vendor_breakdown_data
+    }
+
 @report_bp.route('/reports/daily', methods=['POST'])
 def get_daily_report():
     """Generates a comprehensive daily production report with correct ring status logic."""
@@ -21,228 +323,116 @@ def get_daily_report():
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            # Base query conditions
-            date_condition = "date = %s"
+            # Closed days never change until a sync touches them again
+            report_date = pd.to_datetime(selected_date).date()
+            is_closed_day = report_date < date.today()
+            if is_closed_day:
+                cached = get_cached_report(cursor, report_date, selected_vendor)
+                if cached is not None:
+                    return jsonify({**cached, 'date': selected_date, 'vendor': selected_vendor})
+
+            report = build_daily_report(cursor, selected_date, selected_vendor)
+            if is_closed_day:
+                store_cached_report(cursor, report_date, selected_vendor, report)
+            conn.commit()
+            return jsonify(report)
+        
+    except (psycopg2.Error, Exception) as e:
+        current_app.logger.error(f"Error generating daily report: {e}")
+        return jsonify({'error': f'Failed to generate report: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+@report_bp.route('/reports/daily-range', methods=['POST'])
+def get_daily_range_report():
+    """Generates per-day and per-vendor production figures for a date window in one grouped query."""
+    config = request.json
+    date_from = config.get('dateFrom')
+    date_to = config.get('dateTo')
+    selected_vendor = config.get('vendor', 'all')
+    top_reasons_limit = config.get('topReasons', 5)
+
+    if not all([date_from, date_to]):
+        return jsonify({'error': 'dateFrom and dateTo are required'}), 400
+    if (isinstance(top_reasons_limit, bool) or not isinstance(top_reasons_limit, int)
+            or not 1 <= top_reasons_limit <= MAX_RANGE_TOP_REASONS):
+        return jsonify({'error': f'topReasons must be an integer from 1 to {MAX_RANGE_TOP_REASONS}'}), 400
+
+    try:
+        days = [day.date() for day in pd.date_range(date_from, date_to)]
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid dateFrom or dateTo'}), 400
+    if len(days) > MAX_RANGE_REPORT_DAYS:
+        return jsonify({'error': f'Date range cannot exceed {MAX_RANGE_REPORT_DAYS} days'}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            # Aggregate any date in the window that no sync has covered yet
+            if ensure_aggregates(cursor, date_from, date_to):
+                conn.commit()
+
             vendor_condition = "" if selected_vendor == 'all' else " AND vendor = %s"
-            params = [selected_date]
+            params = [date_from, date_to]
             if selected_vendor != 'all':
                 params.append(selected_vendor)
-            
-            # Get all rings with their VQC and FT data
+
             cursor.execute(f"""
-                SELECT 
-                    vendor,
-                    serial_number,
-                    mo_number,
-                    sku,
-                    ring_size,
-                    vqc_status,
-                    vqc_reason,
-                    ft_status,
-                    ft_reason,
-                    created_at
-                FROM rings 
-                WHERE {date_condition}{vendor_condition}
-                ORDER BY created_at, vendor, serial_number
+                SELECT
+                    CASE
+                        WHEN GROUPING(date) = 1 THEN 'total'
+                        WHEN GROUPING(vendor) = 0 THEN 'vendor'
+                        WHEN GROUPING(final_reason) = 0 THEN 'reason'
+                        ELSE 'day'
+                    END AS grouping_set,
+                    date, vendor, final_stage, final_reason,
+                    SUM(ring_count) AS received,
+                    COALESCE(SUM(ring_count) FILTER (WHERE final_status = 'Accepted'), 0) AS accepted,
+                    COALESCE(SUM(ring_count) FILTER (WHERE final_status = 'Rejected'), 0) AS rejected,
+                    COALESCE(SUM(ring_count) FILTER (WHERE final_status = 'Pending'), 0) AS pending
+                FROM rings_daily_stats
+                WHERE date BETWEEN %s AND %s{vendor_condition}
+                GROUP BY GROUPING SETS ((date), (date, vendor), (date, final_stage, final_reason), ())
+                ORDER BY date, vendor
             """, tuple(params))
-            
-            rings_data = cursor.fetchall()
-            
-            if not rings_data:
-                return jsonify({
-                    'date': selected_date,
-                    'vendor': selected_vendor,
-                    'totalReceived': 0,
-                    'totalAccepted': 0,
-                    'totalRejected': 0,
-                    'totalPending': 0,
-                    'yield': 0,
-                    'vqcBreakdown': {'accepted': 0, 'rejected': 0, 'pending': 0, 'rejectionReasons': []},
-                    'ftBreakdown': {'accepted': 0, 'rejected': 0, 'pending': 0, 'rejectionReasons': []},
-                    'hourlyData': [],
-                    'vendorBreakdown': []
-                })
-            
-            # Process each ring according to the business logic
-            processed_rings = []
-            vendor_stats = {}
-            vqc_rejection_reasons = {}
-            ft_rejection_reasons = {}
-            hourly_stats = {}
-            
-            for ring in rings_data:
-                vendor, serial, mo, sku, size, vqc_status, vqc_reason, ft_status, ft_reason, created_at = ring
-                
-                # Initialize vendor stats if not exists
-                if vendor not in vendor_stats:
-                    vendor_stats[vendor] = {'received': 0, 'accepted': 0, 'rejected': 0, 'pending': 0}
-                
-                # Initialize hourly stats
-                hour = created_at.hour if created_at else 0
-                if hour not in hourly_stats:
-                    hourly_stats[hour] = {'received': 0, 'accepted': 0, 'rejected': 0, 'pending': 0}
-                
-                vendor_stats[vendor]['received'] += 1
-                hourly_stats[hour]['received'] += 1
-                
-                # Apply business logic to determine final status
-                has_vqc_data = vqc_status is not None and str(vqc_status).strip() != ''
-                has_ft_data = ft_status is not None and str(ft_status).strip() != ''
-                
-                final_status = 'Pending'
-                final_reason = ''
-                stage = 'Unknown'
-                
-                if not has_vqc_data and not has_ft_data:
-                    # Neither VQC nor FT data - Pending
-                    final_status = 'Pending'
-                    stage = 'VQC'
-                    
-                elif not has_vqc_data and has_ft_data:
-                    # No VQC data, but FT data exists - Use FT as final
-                    final_status = 'Accepted' if str(ft_status).upper() in ['ACCEPTED', 'PASS'] else 'Rejected'
-                    final_reason = ft_reason if final_status == 'Rejected' else ''
-                    stage = 'FT'
-                    
-                elif has_vqc_data and not has_ft_data:
-                    # VQC data exists, no FT data - VQC is final (FT pending)
-                    final_status = 'Accepted' if str(vqc_status).upper() in ['ACCEPTED', 'PASS'] else 'Rejected'
-                    final_reason = vqc_reason if final_status == 'Rejected' else ''
-                    stage = 'VQC'
-                    
-                else:
-                    # Both VQC and FT data exist - FT is final (only VQC accepted rings go to FT)
-                    final_status = 'Accepted' if str(ft_status).upper() in ['ACCEPTED', 'PASS'] else 'Rejected'
-                    final_reason = ft_reason if final_status == 'Rejected' else ''
-                    stage = 'FT'
-                
-                # Update statistics
-                if final_status == 'Accepted':
-                    vendor_stats[vendor]['accepted'] += 1
-                    hourly_stats[hour]['accepted'] += 1
-                elif final_status == 'Rejected':
-                    vendor_stats[vendor]['rejected'] += 1
-                    hourly_stats[hour]['rejected'] += 1
-                    
-                    # Track rejection reasons
-                    if final_reason and final_reason.strip():
-                        if stage == 'VQC':
-                            vqc_rejection_reasons[final_reason] = vqc_rejection_reasons.get(final_reason, 0) + 1
-                        else:
-                            ft_rejection_reasons[final_reason] = ft_rejection_reasons.get(final_reason, 0) + 1
-                else:
-                    vendor_stats[vendor]['pending'] += 1
-                    hourly_stats[hour]['pending'] += 1
-                
-                processed_rings.append({
-                    'vendor': vendor,
-                    'serial_number': serial,
-                    'mo_number': mo,
-                    'sku': sku,
-                    'ring_size': size,
-                    'vqc_status': vqc_status,
-                    'vqc_reason': vqc_reason,
-                    'ft_status': ft_status,
-                    'ft_reason': ft_reason,
-                    'final_status': final_status,
-                    'final_reason': final_reason,
-                    'stage': stage,
-                    'created_at': created_at
-                })
-            
-            # Calculate totals
-            total_received = len(processed_rings)
-            total_accepted = sum(stats['accepted'] for stats in vendor_stats.values())
-            total_rejected = sum(stats['rejected'] for stats in vendor_stats.values())
-            total_pending = sum(stats['pending'] for stats in vendor_stats.values())
-            
-            # Calculate yield (excluding pending rings from yield calculation)
-            completed_rings = total_accepted + total_rejected
-            overall_yield = (total_accepted / completed_rings * 100) if completed_rings > 0 else 0
-            
-            # Prepare vendor breakdown if 'all' is selected
-            vendor_breakdown_data = []
-            if selected_vendor == 'all':
-                for vendor_name, stats in vendor_stats.items():
-                    completed = stats['accepted'] + stats['rejected']
-                    vendor_yield = (stats['accepted'] / completed * 100) if completed > 0 else 0
-                    vendor_breakdown_data.append({
-                        'vendor': vendor_name,
-                        'totalReceived': stats['received'],
-                        'totalAccepted': stats['accepted'],
-                        'totalRejected': stats['rejected'],
-                        'totalPending': stats['pending'],
-                        'yield': round(vendor_yield, 2)
+
+            day_data = {
+                day: {
+                    'date': day.strftime('%Y-%m-%d'), **_yield_counts(0, 0, 0, 0),
+                    'vendorBreakdown': [], 'topReasons': [],
+                }
+                for day in days
+            }
+            totals = _yield_counts(0, 0, 0, 0)
+            for grouping_set, day, vendor, stage, reason, *counts in cursor.fetchall():
+                counts = _yield_counts(*(int(count) for count in counts))
+                if grouping_set == 'total':
+                    totals = counts
+                elif grouping_set == 'day':
+                    day_data[day].update(counts)
+                elif grouping_set == 'vendor':
+                    day_data[day]['vendorBreakdown'].append({'vendor': vendor, **counts})
+                elif counts['totalRejected'] and reason:
+                    day_data[day]['topReasons'].append({
+                        'stage': stage, 'reason': reason, 'count': counts['totalRejected']
                     })
-            
-            # Prepare VQC rejection reasons
-            total_vqc_rejected = sum(vqc_rejection_reasons.values())
-            vqc_rejection_list = []
-            for reason, count in sorted(vqc_rejection_reasons.items(), key=lambda x: x[1], reverse=True):
-                percentage = (count / total_vqc_rejected * 100) if total_vqc_rejected > 0 else 0
-                vqc_rejection_list.append({
-                    'reason': reason,
-                    'count': count,
-                    'percentage': round(percentage, 1)
-                })
-            
-            # Prepare FT rejection reasons
-            total_ft_rejected = sum(ft_rejection_reasons.values())
-            ft_rejection_list = []
-            for reason, count in sorted(ft_rejection_reasons.items(), key=lambda x: x[1], reverse=True):
-                percentage = (count / total_ft_rejected * 100) if total_ft_rejected > 0 else 0
-                ft_rejection_list.append({
-                    'reason': reason,
-                    'count': count,
-                    'percentage': round(percentage, 1)
-                })
-            
-            # Prepare hourly data
-            hourly_data = []
-            for hour in sorted(hourly_stats.keys()):
-                hourly_data.append({
-                    'hour': f"{hour:02d}:00",
-                    'received': hourly_stats[hour]['received'],
-                    'accepted': hourly_stats[hour]['accepted'],
-                    'rejected': hourly_stats[hour]['rejected'],
-                    'pending': hourly_stats[hour]['pending']
-                })
-            
-            # Count VQC and FT specific stats for breakdown
-            vqc_accepted = len([r for r in processed_rings if r['vqc_status'] and str(r['vqc_status']).upper() in ['ACCEPTED', 'PASS']])
-            vqc_rejected = len([r for r in processed_rings if r['vqc_status'] and str(r['vqc_status']).upper() not in ['ACCEPTED', 'PASS']])
-            vqc_pending = len([r for r in processed_rings if not r['vqc_status'] or str(r['vqc_status']).strip() == ''])
-            
-            ft_accepted = len([r for r in processed_rings if r['ft_status'] and str(r['ft_status']).upper() in ['ACCEPTED', 'PASS']])
-            ft_rejected = len([r for r in processed_rings if r['ft_status'] and str(r['ft_status']).upper() not in ['ACCEPTED', 'PASS'] and r['ft_status'] and str(r['ft_status']).strip() != ''])
-            ft_pending = len([r for r in processed_rings if not r['ft_status'] or str(r['ft_status']).strip() == ''])
-            
+
+            for data in day_data.values():
+                data['topReasons'].sort(key=lambda r: (-r['count'], r['reason']))
+                del data['topReasons'][top_reasons_limit:]
+
             return jsonify({
-                'date': selected_date,
+                'dateFrom': date_from,
+                'dateTo': date_to,
                 'vendor': selected_vendor,
-                'totalReceived': total_received,
-                'totalAccepted': total_accepted,
-                'totalRejected': total_rejected,
-                'totalPending': total_pending,
-                'yield': round(overall_yield, 2),
-                'vqcBreakdown': {
-                    'accepted': vqc_accepted,
-                    'rejected': vqc_rejected,
-                    'pending': vqc_pending,
-                    'rejectionReasons': vqc_rejection_list
-                },
-                'ftBreakdown': {
-                    'accepted': ft_accepted,
-                    'rejected': ft_rejected,
-                    'pending': ft_pending,
-                    'rejectionReasons': ft_rejection_list
-                },
-                'hourlyData': hourly_data,
-                'vendorBreakdown': vendor_breakdown_data
+                **totals,
+                'days': list(day_data.values())
             })
-        
+
     except (psycopg2.Error, Exception) as e:
-        current_app.logger.error(f"Error generating daily report: {e}")
+        current_app.logger.error(f"Error generating date-range report: {e}")
         return jsonify({'error': f'Failed to generate report: {str(e)}'}), 500
     finally:
         if conn:
@@ -259,193 +449,127 @@ def export_daily_report():
     if not selected_date:
         return jsonify({'error': 'Date is required'}), 400
     
+    export_format = export_format.lower()
+    if export_format not in ('csv', 'excel'):
+        return jsonify({'error': 'Invalid export format'}), 400
+
+    headers = [
+        'Date', 'Vendor', 'Serial Number', 'MO Number', 'SKU', 'Ring Size',
+        'VQC Status', 'VQC Reason', 'FT Status', 'FT Reason', 
+        'Overall Status', 'Created At'
+    ]
+
+    # Get detailed data for export
+    date_condition = "date = %s"
+    vendor_condition = "" if selected_vendor == 'all' else " AND vendor = %s"
+    params = [selected_date]
+    if selected_vendor != 'all':
+        params.append(selected_vendor)
+    query = f"""
+        SELECT 
+            date,
+            vendor,
+            serial_number,
+            mo_number,
+            sku,
+            ring_size,
+            vqc_status,
+            vqc_reason,
+            ft_status,
+            ft_reason,
+            final_status as overall_status,
+            created_at
+        FROM rings 
+        WHERE {date_condition}{vendor_condition}
+        ORDER BY created_at, vendor, serial_number
+    """
+
     conn = None
+    cursor = None
     try:
         conn = get_db_connection()
-        with conn.cursor() as cursor:
-            # Get detailed data for export
-            date_condition = "date = %s"
-            vendor_condition = "" if selected_vendor == 'all' else " AND vendor = %s"
-            params = [selected_date]
-            if selected_vendor != 'all':
-                params.append(selected_vendor)
-            
-            cursor.execute(f"""
-                SELECT 
-                    date,
-                    vendor,
-                    serial_number,
-                    mo_number,
-                    sku,
-                    ring_size,
-                    vqc_status,
-                    vqc_reason,
-                    ft_status,
-                    ft_reason,
-                    CASE 
-                        WHEN vqc_status = 'ACCEPTED' THEN 'Accepted'
-                        ELSE 'Rejected'
-                    END as overall_status,
-                    created_at
-                FROM rings 
-                WHERE {date_condition}{vendor_condition}
-                ORDER BY created_at, vendor, serial_number
-            """, tuple(params))
-            
-            results = cursor.fetchall()
-            
-            if export_format.lower() == 'csv':
-                output = io.StringIO()
-                writer = csv.writer(output)
-                
-                # Write headers
-                headers = [
-                    'Date', 'Vendor', 'Serial Number', 'MO Number', 'SKU', 'Ring Size',
-                    'VQC Status', 'VQC Reason', 'FT Status', 'FT Reason', 
-                    'Overall Status', 'Created At'
-                ]
-                writer.writerow(headers)
-                
-                # Write data
-                for row in results:
-                    writer.writerow(row)
-                
-                output.seek(0)
-                filename = f"daily_report_{selected_date}_{selected_vendor}.csv"
-                
-                return Response(
-                    output.getvalue(),
-                    mimetype="text/csv",
-                    headers={"Content-Disposition": f"attachment;filename={filename}"}
-                )
-            
-            elif export_format.lower() == 'excel':
-                # For Excel export using pandas
-                df = pd.DataFrame(results, columns=[
-                    'Date', 'Vendor', 'Serial Number', 'MO Number', 'SKU', 'Ring Size',
-                    'VQC Status', 'VQC Reason', 'FT Status', 'FT Reason', 
-                    'Overall Status', 'Created At'
-                ])
-                
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='Daily Report', index=False)
-                
-                output.seek(0)
-                filename = f"daily_report_{selected_date}_{selected_vendor}.xlsx"
-                
-                return Response(
-                    output.getvalue(),
-                    mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    headers={"Content-Disposition": f"attachment;filename={filename}"}
-                )
-            
-            else:
-                return jsonify({'error': 'Invalid export format'}), 400
+        # A server-side cursor keeps large days out of memory
+        cursor = open_server_cursor(conn, 'export_daily_report', query, tuple(params), EXPORT_FETCH_SIZE)
+
+        if export_format == 'csv':
+            filename = f"daily_report_{selected_date}_{selected_vendor}.csv"
+            response = stream_csv(conn, cursor, headers, filename, return_db_connection)
+            # The response now owns the cursor and the connection
+            conn = cursor = None
+            return response
+
+        # Rows stream from the server-side cursor into a write-only workbook;
+        # columns are sized from the leading sample
+        output = write_xlsx('Daily Report', headers, cursor, autosize=True)
+        filename = f"daily_report_{selected_date}_{selected_vendor}.xlsx"
+
+        return Response(
+            iter_file(output),
+            mimetype=XLSX_MIMETYPE,
+            headers={"Content-Disposition": f"attachment;filename={filename}"}
+        )
                 
     except (psycopg2.Error, Exception) as e:
         current_app.logger.error(f"Error exporting daily report: {e}")
         return jsonify({'error': f'Failed to export report: {str(e)}'}), 500
     finally:
+        if cursor is not None and not cursor.closed:
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                pass
         if conn:
             return_db_connection(conn)
 
 @report_bp.route('/reports/rejection-trends', methods=['POST'])
 def get_rejection_trends():
-    """Generates rejection trends data in spreadsheet format with stage filtering."""
+    """Generates rejection trends data in spreadsheet format with stage filtering.
+
+    vendor may be one vendor, a list of vendors or 'all'. The top-level matrix
+    combines every selected vendor and vendorData holds one matrix per vendor.
+    """
     config = request.json
     date_from = config.get('dateFrom')
     date_to = config.get('dateTo')
     selected_vendor = config.get('vendor')
     rejection_stage_filter = config.get('rejectionStage', 'both')  # 'vqc', 'ft', or 'both'
+    vendors = _parse_vendor_selection(selected_vendor)
 
-    if not all([date_from, date_to, selected_vendor]):
+    if not all([date_from, date_to, selected_vendor]) or vendors == []:
         return jsonify({'error': 'dateFrom, dateTo, and vendor are required'}), 400
 
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            # Generate date range
-            cursor.execute("""
-                SELECT generate_series(%s::date, %s::date, '1 day'::interval)::date as date_col
-            """, (date_from, date_to))
-            date_range = [row[0].strftime('%Y-%m-%d') for row in cursor.fetchall()]
-
-            # Fetch all potentially rejected rings
-            cursor.execute("""
-                SELECT date, vqc_status, vqc_reason, ft_status, ft_reason
-                FROM rings
-                WHERE date BETWEEN %s AND %s AND vendor = %s
-                AND (
-                    (vqc_status IS NOT NULL AND UPPER(vqc_status) NOT IN ('ACCEPTED', 'PASS', '')) OR
-                    (ft_status IS NOT NULL AND UPPER(ft_status) NOT IN ('ACCEPTED', 'PASS', ''))
-                )
-            """, (date_from, date_to, selected_vendor))
+            days = [day.date() for day in pd.date_range(date_from, date_to)]
+            date_range = [day.strftime('%Y-%m-%d') for day in days]
 
-            raw_records = cursor.fetchall()
-            
-            # Process records based on business logic to get final rejection reason
-            processed_rejections = []
-            for record in raw_records:
-                date, vqc_status, vqc_reason, ft_status, ft_reason = record
-                
-                is_vqc_rejected = vqc_status and vqc_status.upper() not in ['ACCEPTED', 'PASS', '']
-                is_ft_rejected = ft_status and ft_status.upper() not in ['ACCEPTED', 'PASS', '']
-
-                final_reason = None
-                final_stage = None
-
-                # VQC rejection is final and takes precedence
-                if is_vqc_rejected:
-                    final_stage = 'vqc'
-                    final_reason = vqc_reason
-                # If not VQC rejected, check for FT rejection
-                elif is_ft_rejected:
-                    final_stage = 'ft'
-                    final_reason = ft_reason
-                
-                # If a final rejection was determined, and it matches the filter, add it
-                if final_stage and final_reason and (rejection_stage_filter == 'both' or rejection_stage_filter == final_stage):
-                    processed_rejections.append({
-                        'date': date.strftime('%Y-%m-%d'),
-                        'reason': final_reason.strip().upper()
-                    })
+            # Aggregate any date in the range that no sync has covered yet
+            if ensure_aggregates(cursor, date_from, date_to):
+                conn.commit()
 
-            # Define rejection categories
-            rejection_categories = {
-                'ASSEMBLY': ['BLACK GLUE', 'ULTRAHUMAN TEXT SMUDGED', 'WHITE PATCH ON BATTERY', 'WHITE PATCH ON BLACK TAPE', 'WHITE PATCH ON PCB', 'WHITE PATCH ON TAPE NEAR BATTERY', 'WRONG RX COIL'],
-                'CASTING': ['MICRO BUBBLES', 'ALIGNMENT ISSUE', 'DENT ON RESIN', 'DUST INSIDE RESIN', 'RESIN CURING ISSUE', 'SHORT FILL OF RESIN', 'SPM REJECTION', 'TIGHT FIT FOR CHARGE', 'LOOSE FITTING ON CHARGER', 'RESIN SHRINKAGE', 'WRONG MOULD', 'GLOB TOP ISSUE'],
-                'FUNCTIONAL': ['100% ISSUE', '3 SENSOR ISSUE', 'BATTERY ISSUE', 'BLUETOOTH HEIGHT ISSUE', 'CE TAPE ISSUE', 'CHARGING CODE ISSUE', 'COIL THICKNESS ISSUE/BATTERY THICKNESS', 'COMPONENT HEIGHT ISSUE', 'CURRENT ISSUE', 'DISCONNECTING ISSUE', 'HRS BUBBLE', 'HRS COATING HEIGHT ISSUE', 'HRS DOUBLE LIGHT ISSUE', 'HRS HEIGHT ISSUE', 'NO NOTIFICATION IN CDT', 'NOT ADVERTISING (WINGLESS PCB)', 'NOT CHARGING', 'SENSOR ISSUE', 'STC ISSUE', 'R & D REJECTION'],
-                'POLISHING': ['IMPROPER RESIN FINISH', 'RESIN DAMAGE', 'RX COIL SCRATCH', 'SCRATCHES ON RESIN', 'SIDE SCRATCH', 'SIDE SCRATCH (EMERY)', 'SHELL COATING REMOVED', 'UNEVEN POLISHING', 'WHITE PATCH ON SHELL AFTER POLISHING', 'SCRATCHES ON SHELL & SIDE SHELL'],
-                'SHELL': ['BLACK MARKS ON SHELL', 'DENT ON SHELL', 'DISCOLORATION', 'IRREGULAR SHELL SHAPE', 'SHELL COATING ISSUE', 'WHITE MARKS ON SHELL']
-            }
+            # Final rejections per (vendor, reason, day) bucket from the pre-aggregated fact table
+            rejection_counts = _load_rejection_counts(
+                cursor, vendors, date_from, date_to, rejection_stage_filter
+            )
+
+            trends_data, summary = _build_trends_matrix(
+                _combine_rejection_counts(rejection_counts), days, date_range
+            )
 
-            trends_data = []
-            for stage, rejection_types in rejection_categories.items():
-                for rejection_type in rejection_types:
-                    row_data = {
-                        'stage': stage,
-                        'rejection': rejection_type,
-                        'dateWiseData': {date: 0 for date in date_range},
-                        'totals': {'total': 0}
-                    }
-                    
-                    for rejection in processed_rejections:
-                        if rejection['reason'] == rejection_type.upper():
-                            rejection_date = rejection['date']
-                            if rejection_date in row_data['dateWiseData']:
-                                row_data['dateWiseData'][rejection_date] += 1
-                                row_data['totals']['total'] += 1
-                    
-                    trends_data.append(row_data)
-
-            # Calculate summary statistics
-            total_rejections = sum(row['totals']['total'] for row in trends_data)
-            stage_wise_totals = {}
-            for row in trends_data:
-                stage = row['stage']
-                stage_wise_totals[stage] = stage_wise_totals.get(stage, 0) + row['totals']['total']
+            counts_by_vendor = {}
+            for (vendor, code, day), count in rejection_counts.items():
+                counts_by_vendor.setdefault(vendor, {})[(code, day)] = count
+            if vendors is None:
+                vendors = sorted(counts_by_vendor, key=lambda vendor: (vendor is None, vendor))
+
+            vendor_data = []
+            for vendor in vendors:
+                vendor_rows, vendor_summary = _build_trends_matrix(
+                    counts_by_vendor.get(vendor, {}), days, date_range
+                )
+                vendor_data.append({'vendor': vendor, 'rejectionData': vendor_rows, 'summary': vendor_summary})
 
             return jsonify({
                 'dateRange': date_range,
@@ -453,11 +577,8 @@ def get_rejection_trends():
                 'dateFrom': date_from,
                 'dateTo': date_to,
                 'rejectionData': trends_data,
-                'summary': {
-                    'totalRejections': total_rejections,
-                    'stageWiseTotals': stage_wise_totals,
-                    'dateRange': len(date_range)
-                }
+                'summary': summary,
+                'vendorData': vendor_data
             })
             
     except (psycopg2.Error, Exception) as e:
@@ -467,178 +588,96 @@ def get_rejection_trends():
         if conn:
             return_db_connection(conn)
 
-@report_bp.route('/reports/rejection-trends/export', methods=['POST'])
-def export_rejection_trends():
-    """Exports rejection trends data as CSV or Excel."""
-    config = request.json
+def parse_rejection_trends_export(config):
+    """Validates a rejection trends export request and returns its normalised spec.
+
+    Raises ValueError with a client-facing message for an invalid request.
+    """
     date_from = config.get('dateFrom')
     date_to = config.get('dateTo')
     selected_vendor = config.get('vendor')
-    export_format = config.get('format', 'csv')
-    rejection_stage = config.get('rejectionStage', 'both')
-    
-    if not all([date_from, date_to, selected_vendor]):
-        return jsonify({'error': 'dateFrom, dateTo, and vendor are required'}), 400
+    export_format = str(config.get('format', 'csv')).lower()
+    vendors = _parse_vendor_selection(selected_vendor)
+
+    if not all([date_from, date_to, selected_vendor]) or vendors == []:
+        raise ValueError('dateFrom, dateTo, and vendor are required')
+    if export_format not in ('csv', 'excel'):
+        raise ValueError('Invalid export format')
+
+    return {
+        'dateFrom': date_from,
+        'dateTo': date_to,
+        'vendors': vendors,
+        'vendorLabel': '_'.join(vendors) if isinstance(selected_vendor, list) else selected_vendor,
+        'format': export_format,
+        'rejectionStage': config.get('rejectionStage', 'both'),
+    }
+
+
+def rejection_trends_export_filename(spec):
+    extension = 'csv' if spec['format'] == 'csv' else 'xlsx'
+    return f"rejection_trends_{spec['dateFrom']}_to_{spec['dateTo']}_{spec['vendorLabel']}.{extension}"
+
+
+def write_rejection_trends_export(conn, spec):
+    """Builds a rejection trends export and returns it as a rewound binary file."""
+    date_from, date_to = spec['dateFrom'], spec['dateTo']
+    with conn.cursor() as cursor:
+        days = [day.date() for day in pd.date_range(date_from, date_to)]
+
+        # Aggregate any date in the range that no sync has covered yet
+        if ensure_aggregates(cursor, date_from, date_to):
+            conn.commit()
+
+        # Final rejections per (reason, day) bucket across the selected vendors,
+        # counted the same way as the trends report
+        rejection_counts = _combine_rejection_counts(_load_rejection_counts(
+            cursor, spec['vendors'], date_from, date_to, spec['rejectionStage']
+        ))
+
+    # Spreadsheet rows are produced lazily as the writer consumes them
+    headers = ['Stage', 'Rejection Type'] + [day.strftime('%d-%b-%Y') for day in days] + ['Total']
+
+    def export_rows():
+        for code, stage, rejection_type in REJECTION_REASONS:
+            counts = [rejection_counts.get((code, day), 0) for day in days]
+            yield [stage, rejection_type] + counts + [sum(counts)]
+
+    if spec['format'] == 'excel':
+        return write_xlsx(
+            'Rejection Trends', headers, export_rows(),
+            row_fill=lambda row: STAGE_FILLS.get(row[0]), styled_columns=2,
+            style_header=True, autosize=True
+        )
+
+    output = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(headers)
+    writer.writerows(export_rows())
+    text.flush()
+    text.detach()
+    output.seek(0)
+    return output
+
+
+@report_bp.route('/reports/rejection-trends/export', methods=['POST'])
+def export_rejection_trends():
+    """Exports rejection trends data as CSV or Excel."""
+    try:
+        spec = parse_rejection_trends_export(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     conn = None
     try:
         conn = get_db_connection()
-        with conn.cursor() as cursor:
-            # Generate date range
-            cursor.execute("""
-                SELECT generate_series(%s::date, %s::date, '1 day'::interval)::date as date_col
-            """, (date_from, date_to))
-            date_range = [row[0].strftime('%Y-%m-%d') for row in cursor.fetchall()]
-
-            # Dynamically build the rejection condition based on the selected stage
-            rejection_condition = ""
-            if rejection_stage == 'vqc':
-                rejection_condition = "AND (vqc_status IS NOT NULL AND UPPER(vqc_status) NOT IN ('ACCEPTED', 'PASS', ''))"
-            elif rejection_stage == 'ft':
-                rejection_condition = "AND (ft_status IS NOT NULL AND UPPER(ft_status) NOT IN ('ACCEPTED', 'PASS', ''))"
-            else: # 'both'
-                rejection_condition = """
-                    AND (
-                        (vqc_status IS NOT NULL AND UPPER(vqc_status) NOT IN ('ACCEPTED', 'PASS', '')) 
-                        OR 
-                        (ft_status IS NOT NULL AND UPPER(ft_status) NOT IN ('ACCEPTED', 'PASS', ''))
-                    )
-                """
-            
-            # Get rejection data using the dynamic condition
-            query = f"""
-                SELECT 
-                    date,
-                    vendor,
-                    vqc_reason,
-                    ft_reason,
-                    vqc_status,
-                    ft_status
-                FROM rings 
-                WHERE date BETWEEN %s AND %s 
-                AND vendor = %s
-                {rejection_condition}
-            """
-            cursor.execute(query, (date_from, date_to, selected_vendor))
-            
-            rejection_records = cursor.fetchall()
-            
-            # Same rejection categories as above
-            rejection_categories = {
-                'ASSEMBLY': ['BLACK GLUE', 'ULTRAHUMAN TEXT SMUDGED', 'WHITE PATCH ON BATTERY', 'WHITE PATCH ON INSERT', 'WHITE PATCH ON PCB', 'WHITE PATCH ON TAPE NEAR BATTERY', 'WRONG RX COIL'],
-                'CASTING': ['MICRO BUBBLES', 'ALIGNMENT ISSUE', 'DENT ON RESIN', 'DUST INSIDE RESIN', 'RESIN CURING ISSUE', 'SHORT FILL OF RESIN', 'SPM REJECTION', 'TIGHT FIT FOR CHARGE', 'LOOSE FITTING ON CHARGER', 'RESIN SHRINKAGE', 'WRONG MOULD', 'GLOP TOP ISSUE'],
-                'FUNCTIONAL': ['100% ISSUE', '3 SENSOR ISSUE', 'BATTERY ISSUE', 'BLUETOOTH HEIGHT ISSUE', 'CE TAPE ISSUE', 'CHARGING CODE ISSUE', 'COIL THICKNESS ISSUE/BATTERY THICKNESS', 'COMPONENT HEIGHT ISSUE', 'CURRENT ISSUE', 'DISCONNECTING ISSUE', 'HRS BUBBLE', 'HRS COATING HEIGHT ISSUE', 'HRS DOUBLE LIGHT ISSUE', 'HRS HEIGHT ISSUE', 'NO NOTIFICATION IN CDT', 'NOT ADVERTISING (WINGLESS PCB)', 'NOT CHARGING', 'SENSOR ISSUE', 'STC ISSUE', 'R&D REJECTION'],
-                'POLISHING': ['IMPROPER RESIN FINISH', 'RESIN DAMAGE', 'RX COIL SCRATCH', 'SCRATCHES ON RESIN', 'SIDE SCRATCH', 'SIDE SCRATCH (EMERY)', 'SHELL COATING REMOVED', 'UNEVEN POLISHING', 'WHITE PATCH ON SHELL AFTER POLISHING', 'SCRATCHES ON SHELL & SIDE SHELL'],
-                'SHELL': ['BLACK MARKS ON SHELL', 'DENT ON SHELL', 'DISCOLORATION', 'IRREGULAR SHELL SHAPE', 'SHELL COATING ISSUE', 'WHITE MARKS ON SHELL']
-            }
-            
-            # Process data into spreadsheet format
-            export_data = []
-            headers = ['Stage', 'Rejection Type'] + [pd.to_datetime(date).strftime('%d-%b-%Y') for date in date_range] + ['Total']
-            
-            for stage, rejection_types in rejection_categories.items():
-                for rejection_type in rejection_types:
-                    row = [stage, rejection_type]
-                    total_count = 0
-                    
-                    for date in date_range:
-                        count = 0
-                        for record in rejection_records:
-                            record_date, vendor, vqc_reason, ft_reason, vqc_status, ft_status = record
-                            record_date_str = record_date.strftime('%Y-%m-%d')
-                            
-                            if record_date_str == date:
-                                reasons_to_check = []
-                                if rejection_stage in ['vqc', 'both'] and vqc_reason and vqc_reason.strip():
-                                    reasons_to_check.append(vqc_reason.strip().upper())
-                                if rejection_stage in ['ft', 'both'] and ft_reason and ft_reason.strip():
-                                    reasons_to_check.append(ft_reason.strip().upper())
-                                
-                                if rejection_type.upper() in reasons_to_check:
-                                    count += 1
-                        
-                        row.append(count)
-                        total_count += count
-                    
-                    row.append(total_count)
-                    export_data.append(row)
-            
-            if export_format.lower() == 'csv':
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(headers)
-                writer.writerows(export_data)
-                output.seek(0)
-                
-                filename = f"rejection_trends_{date_from}_to_{date_to}_{selected_vendor}.csv"
-                return Response(
-                    output.getvalue(),
-                    mimetype="text/csv",
-                    headers={"Content-Disposition": f"attachment;filename={filename}"}
-                )
-            
-            elif export_format.lower() == 'excel':
-                df = pd.DataFrame(export_data, columns=headers)
-                output = io.BytesIO()
-                
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='Rejection Trends', index=False)
-                    
-                    workbook = writer.book
-                    worksheet = writer.sheets['Rejection Trends']
-                    
-                    try:
-                        from openpyxl.styles import PatternFill, Font, Alignment
-                        
-                        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                        header_font = Font(color="FFFFFF", bold=True)
-                        
-                        for col in range(1, len(headers) + 1):
-                            cell = worksheet.cell(row=1, column=col)
-                            cell.fill = header_fill
-                            cell.font = header_font
-                            cell.alignment = Alignment(horizontal="center")
-                        
-                        stage_colors = {
-                            'ASSEMBLY': PatternFill(start_color="E3F2FD", end_color="E3F2FD", fill_type="solid"),
-                            'CASTING': PatternFill(start_color="F3E5F5", end_color="F3E5F5", fill_type="solid"),
-                            'FUNCTIONAL': PatternFill(start_color="FFEBEE", end_color="FFEBEE", fill_type="solid"),
-                            'POLISHING': PatternFill(start_color="E8F5E8", end_color="E8F5E8", fill_type="solid"),
-                            'SHELL': PatternFill(start_color="FFF3E0", end_color="FFF3E0", fill_type="solid")
-                        }
-                        
-                        for row_idx, row_data in enumerate(export_data, start=2):
-                            stage = row_data[0]
-                            if stage in stage_colors:
-                                for col in range(1, 3):
-                                    worksheet.cell(row=row_idx, column=col).fill = stage_colors[stage]
-                        
-                        for column in worksheet.columns:
-                            max_length = 0
-                            column_letter = column[0].column_letter
-                            for cell in column:
-                                try:
-                                    if len(str(cell.value)) > max_length:
-                                        max_length = len(str(cell.value))
-                                except:
-                                    pass
-                            adjusted_width = min(max_length + 2, 30)
-                            worksheet.column_dimensions[column_letter].width = adjusted_width
-                    except ImportError:
-                        # If openpyxl styles are not available, just create basic Excel
-                        pass
-                
-                output.seek(0)
-                filename = f"rejection_trends_{date_from}_to_{date_to}_{selected_vendor}.xlsx"
-                
-                return Response(
-                    output.getvalue(),
-                    mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    headers={"Content-Disposition": f"attachment;filename={filename}"}
-                )
-            
-            else:
-                return jsonify({'error': 'Invalid export format'}), 400
+        output = write_rejection_trends_export(conn, spec)
+        return Response(
+            iter_file(output),
+            mimetype="text/csv" if spec['format'] == 'csv' else XLSX_MIMETYPE,
+            headers={"Content-Disposition": f"attachment;filename={rejection_trends_export_filename(spec)}"}
+        )
                 
     except (psycopg2.Error, Exception) as e:
         current_app.logger.error(f"Error generating rejection trends export: {e}")
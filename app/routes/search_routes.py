@@ -1,100 +1,105 @@
-from flask import Blueprint, request, jsonify, Response, current_app
-import csv
-import io
+from flask import Blueprint, request, jsonify, current_app
 import psycopg2
-import pandas as pd
 from app.database import get_db_connection, return_db_connection
+from app.autocomplete import autocomplete, parse_autocomplete_request
+from app.dictionaries import load_dictionary, load_reason_options
+from app.search_query import (
+    SEARCH_COLUMNS, SEARCH_ORDER_SQL, build_search_conditions, encode_cursor, keyset_condition, parse_page_size,
+    normalize_search_filters, search_export_query,
+)
+from app.search_cache import (
+    get_cached_search, get_data_version, search_cache_stats, search_fingerprint, store_cached_search,
+)
+from app.search_facets import search_facets
+from app.serial_index import (
+    check_serial_index_version, lookup_serial, refresh_serial_index, serial_index_check_due, serial_index_needs_build,
+    serial_index_stats,
+)
+from app.serial_lookup import MAX_LOOKUP_SERIALS, load_lookup_serials, lookup_chunks, parse_serials
+from app.streaming import (
+    NDJSON_MIMETYPE, open_server_cursor, requested_stream_format, stream_csv, stream_records, stream_response,
+)
 
 search_bp = Blueprint('search', __name__)
 
 @search_bp.route('/search', methods=['POST'])
 def search():
-    """Search rings data with various filters."""
-    filters = request.json
+    """Search rings data with various filters, one keyset page at a time.
+
+    The body is a JSON array of at most pageSize rows. When more rows match, the
+    X-Next-Cursor response header carries the token to pass back as cursor for
+    the next page. With ?stream=json or ?stream=ndjson (or Accept:
+    application/x-ndjson) every match from the cursor on is streamed from a
+    server-side cursor instead, without a page limit.
+    """
+    filters = request.json or {}
     current_app.logger.info(f"Received search filters: {filters}")
-    
-    query = "SELECT date, vendor, mo_number, serial_number, vqc_status, ft_status, vqc_reason, ft_reason FROM rings WHERE 1=1"
-    params = []
+    conn = None
 
     try:
-        # Use UPPER for case-insensitive comparison
-        if filters.get('serialNumbers'):
-            serial_numbers = [s.strip().upper() for s in filters['serialNumbers'].split(',') if s.strip()]
-            if serial_numbers:
-                query += " AND UPPER(serial_number) = ANY(%s)"
-                params.append(serial_numbers)
-
-        if filters.get('moNumbers'):
-            mo_numbers = [s.strip().upper() for s in filters['moNumbers'].split(',') if s.strip()]
-            if mo_numbers:
-                query += " AND UPPER(mo_number) = ANY(%s)"
-                params.append(mo_numbers)
-
-        # Improved date filtering with better error handling
-        if filters.get('dateFrom'):
-            date_from_str = filters['dateFrom']
-            current_app.logger.info(f"Processing dateFrom: {date_from_str}")
-            try:
-                if isinstance(date_from_str, str):
-                    from_date = pd.to_datetime(date_from_str).date()
-                    query += " AND date >= %s"
-                    params.append(from_date)
-                    current_app.logger.info(f"Successfully parsed dateFrom: {from_date}")
-                else:
-                    current_app.logger.warning(f"dateFrom is not a string: {type(date_from_str)}")
-            except Exception as e:
-                current_app.logger.error(f"Failed to parse dateFrom '{date_from_str}': {e}")
-                return jsonify({'error': f'Invalid dateFrom format: {date_from_str}'}), 400
-
-        if filters.get('dateTo'):
-            date_to_str = filters['dateTo']
-            current_app.logger.info(f"Processing dateTo: {date_to_str}")
-            try:
-                if isinstance(date_to_str, str):
-                    to_date = pd.to_datetime(date_to_str).date()
-                    query += " AND date <= %s"
-                    params.append(to_date)
-                    current_app.logger.info(f"Successfully parsed dateTo: {to_date}")
-                else:
-                    current_app.logger.warning(f"dateTo is not a string: {type(date_to_str)}")
-            except Exception as e:
-                current_app.logger.error(f"Failed to parse dateTo '{date_to_str}': {e}")
-                return jsonify({'error': f'Invalid dateTo format: {date_to_str}'}), 400
-        
-        # Handle multi-select filters
-        if filters.get('vendor') and len(filters['vendor']) > 0:
-            query += " AND vendor = ANY(%s)"
-            params.append(filters['vendor'])
-            
-        if filters.get('vqcStatus') and len(filters['vqcStatus']) > 0:
-            query += " AND vqc_status = ANY(%s)"
-            params.append(filters['vqcStatus'])
-            
-        if filters.get('ftStatus') and len(filters['ftStatus']) > 0:
-            query += " AND ft_status = ANY(%s)"
-            params.append(filters['ftStatus'])
-            
-        if filters.get('rejectionReason') and len(filters['rejectionReason']) > 0:
-            query += " AND (vqc_reason = ANY(%s) OR ft_reason = ANY(%s))"
-            params.extend([filters['rejectionReason'], filters['rejectionReason']])
-
-        query += " ORDER BY date DESC, id DESC LIMIT 5000;"
-        
+        try:
+            stream_format = requested_stream_format(request)
+            where_clauses, params = build_search_conditions(filters)
+            page_size = parse_page_size(filters.get('pageSize'))
+            if filters.get('cursor'):
+                clause, cursor_params = keyset_condition(filters['cursor'])
+                where_clauses.append(clause)
+                params.extend(cursor_params)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        where_sql = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+
+        if stream_format:
+            conn = get_db_connection()
+            cursor = open_server_cursor(
+                conn, 'search_stream', f"SELECT {', '.join(SEARCH_COLUMNS)} FROM rings{where_sql} {SEARCH_ORDER_SQL}",
+                tuple(params),
+            )
+            response = stream_records(conn, cursor, stream_format, current_app.json.dumps, return_db_connection)
+            # The response now owns the connection
+            conn = None
+            return response
+
+        query = f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM rings{where_sql}"
+        # One extra row tells whether another page follows
+        query += f" {SEARCH_ORDER_SQL} LIMIT %s"
+        params.append(page_size + 1)
+
         current_app.logger.info(f"Final query: {query}")
         current_app.logger.info(f"Query parameters: {params}")
 
+        fingerprint = search_fingerprint(normalize_search_filters(filters), page_size, filters.get('cursor') or None)
+
         conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(query, tuple(params))
-        
-        colnames = [desc[0] for desc in cur.description]
-        data = [dict(zip(colnames, row)) for row in cur.fetchall()]
-        
-        cur.close()
-        return_db_connection(conn)
-        
-        current_app.logger.info(f"Search completed successfully, returning {len(data)} records")
-        return jsonify(data)
+        with conn.cursor() as cur:
+            # Read before the query, so a cached page is never older than the version it is stored under
+            data_version = get_data_version(cur)
+            cached = get_cached_search(data_version, fingerprint)
+            if cached is None:
+                cur.execute(query, tuple(params))
+                rows = cur.fetchall()
+
+        if cached is not None:
+            body, next_cursor = cached
+            current_app.logger.info("Search served from the result cache")
+            response = current_app.response_class(body, mimetype='application/json')
+            response.headers['X-Cache'] = 'HIT'
+        else:
+            next_cursor = None
+            if len(rows) > page_size:
+                rows = rows[:page_size]
+                next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+            data = [dict(zip(SEARCH_COLUMNS, row[1:])) for row in rows]
+
+            current_app.logger.info(f"Search completed successfully, returning {len(data)} records")
+            response = jsonify(data)
+            response.headers['X-Cache'] = 'MISS'
+            store_cached_search(data_version, fingerprint, response.get_data(), next_cursor)
+
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
         
     except psycopg2.Error as db_err:
         current_app.logger.error(f"Database error during search: {db_err}")
@@ -102,35 +107,31 @@ def search():
     except Exception as e:
         current_app.logger.error(f"Unexpected error during search: {e}")
         return jsonify({'error': f'Search failed: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
 
 @search_bp.route('/search/filters', methods=['GET'])
 def get_search_filters():
-    """Gets distinct values for search filters from the database."""
+    """Gets the values for the search filters.
+
+    The options are read from small tables maintained on write, never from rings.
+    The response carries an ETag; a matching If-None-Match returns 304.
+    """
     conn = None
     options = {}
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            cursor.execute("SELECT DISTINCT vendor FROM rings WHERE vendor IS NOT NULL AND vendor != '' ORDER BY vendor;")
-            options['vendors'] = [row[0] for row in cursor.fetchall()]
-            
-            cursor.execute("SELECT DISTINCT vqc_status FROM rings WHERE vqc_status IS NOT NULL AND vqc_status != '' ORDER BY vqc_status;")
-            options['vqc_statuses'] = [row[0] for row in cursor.fetchall()]
-            
-            cursor.execute("SELECT DISTINCT ft_status FROM rings WHERE ft_status IS NOT NULL AND ft_status != '' ORDER BY ft_status;")
-            options['ft_statuses'] = [row[0] for row in cursor.fetchall()]
-            
-            reason_query = """
-            SELECT DISTINCT reason FROM (
-                SELECT vqc_reason AS reason FROM rings WHERE vqc_reason IS NOT NULL AND vqc_reason != '' 
-                UNION ALL 
-                SELECT ft_reason FROM rings WHERE ft_reason IS NOT NULL AND ft_reason != ''
-            ) AS reasons ORDER BY 1;
-            """
-            cursor.execute(reason_query)
-            options['reasons'] = [row[0] for row in cursor.fetchall()]
-            
-        return jsonify(options)
+            options['vendors'] = load_dictionary(cursor, 'vendor')
+            options['vqc_statuses'] = load_dictionary(cursor, 'vqc_status')
+            options['ft_statuses'] = load_dictionary(cursor, 'ft_status')
+            options['reasons'] = load_reason_options(cursor)
+
+        response = jsonify(options)
+        response.add_etag()
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except psycopg2.Error as db_err:
         current_app.logger.error(f"Database error loading filters: {db_err}")
         return jsonify(status="error", message=f"Database error loading filters: {db_err}"), 500
@@ -138,82 +139,183 @@ def get_search_filters():
         if conn:
             return_db_connection(conn)
 
+@search_bp.route('/search/facets', methods=['POST'])
+def get_search_facets():
+    """Counts the rings each vendor, status and reason would match under the current filters."""
+    filters = request.json or {}
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            try:
+                result = search_facets(cursor, filters)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        # Backfilled aggregates are worth keeping
+        conn.commit()
+        return jsonify(result)
+    except (psycopg2.Error, Exception) as e:
+        current_app.logger.error(f"Error computing search facets: {e}")
+        return jsonify({'error': f'Failed to compute facets: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+@search_bp.route('/search/serials', methods=['POST'])
+def lookup_serials():
+    """Looks up a large list of serial numbers and streams the matches and the serials not found.
+
+    Serials come from an uploaded file (form field 'file'), a JSON body
+    {"serials": [...] or "..."} or a plain-text body, separated by commas,
+    semicolons, whitespace or newlines. ?stream=ndjson returns one line per
+    result instead of a single JSON object.
+    """
+    try:
+        stream_format = requested_stream_format(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    upload = request.files.get('file')
+    if upload:
+        values = upload.read().decode('utf-8-sig', errors='replace')
+    elif request.is_json:
+        values = (request.json or {}).get('serials') or []
+    else:
+        values = request.get_data(as_text=True)
+    serials = parse_serials(values)
+
+    if not serials:
+        return jsonify({'error': 'No serial numbers provided'}), 400
+    if len(serials) > MAX_LOOKUP_SERIALS:
+        return jsonify({'error': f'Too many serial numbers: {len(serials)} (at most {MAX_LOOKUP_SERIALS})'}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            load_lookup_serials(cursor, serials)
+        current_app.logger.info(f"Looking up {len(serials)} serial numbers")
+
+        ndjson = stream_format == 'ndjson'
+        owned_conn = conn
+        response = stream_response(
+            lookup_chunks(conn, len(serials), current_app.json.dumps, ndjson=ndjson),
+            lambda: return_db_connection(owned_conn),
+            NDJSON_MIMETYPE if ndjson else 'application/json',
+        )
+        # The response now owns the connection
+        conn = None
+        return response
+    except (psycopg2.Error, Exception) as e:
+        current_app.logger.error(f"Serial lookup failed: {e}")
+        return jsonify({'error': f'Serial lookup failed: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+@search_bp.route('/search/serials/<serial>', methods=['GET'])
+def serial_status(serial):
+    """Returns whether a serial number is known and its date, vendor and statuses.
+
+    Answered from the in-process serial index, which is checked against the
+    data version every SERIAL_INDEX_VERSION_TTL seconds; while the index is
+    being built, the lookup goes to the database instead.
+    """
+    conn = None
+    try:
+        if serial_index_check_due():
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                check_serial_index_version(get_data_version(cursor))
+
+        result = lookup_serial(serial)
+        source = 'index'
+        if result is None:
+            # Only an index that was never built or was dropped as stale gets here, not
+            # an unknown serial; a build already running is left to finish
+            if serial_index_needs_build():
+                refresh_serial_index(get_db_connection, return_db_connection, current_app.logger)
+            conn = conn or get_db_connection()
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT date, vendor, vqc_status, ft_status FROM rings WHERE UPPER(serial_number) = %s LIMIT 1",
+                    (serial.strip().upper(),),
+                )
+                row = cursor.fetchone()
+            result = (True, dict(zip(('date', 'vendor', 'vqcStatus', 'ftStatus'), row))) if row else (False, None)
+            source = 'database'
+    except (psycopg2.Error, Exception) as e:
+        return jsonify({'error': f'Serial lookup failed: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+    known, status = result
+    response = {'serial': serial.strip().upper(), 'known': known, 'source': source}
+    if known:
+        response.update(status, date=status['date'].isoformat() if status['date'] else None)
+    return jsonify(response)
+
+
+@search_bp.route('/search/serial-index/stats', methods=['GET'])
+def serial_index_stats_endpoint():
+    """Returns the size and data version of this process's serial index."""
+    return jsonify(serial_index_stats())
+
+
+@search_bp.route('/search/autocomplete', methods=['GET'])
+def autocomplete_numbers():
+    """Suggests serial or MO numbers for partially typed input.
+
+    ?field=serial|mo&q=<text>&limit=<n>&match=prefix|contains. Returns
+    {"suggestions": [...], "complete": bool}; complete is false when the time
+    budget ran out and only part of the suggestions were found.
+    """
+    try:
+        field, text, limit, match = parse_autocomplete_request(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        suggestions, complete = autocomplete(conn, field, text, limit, match)
+        return jsonify({'field': field, 'query': text, 'suggestions': suggestions, 'complete': complete})
+    except (psycopg2.Error, Exception) as e:
+        current_app.logger.error(f"Autocomplete failed: {e}")
+        return jsonify({'error': f'Autocomplete failed: {str(e)}'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+
 @search_bp.route('/search/export', methods=['POST'])
 def export_search_results():
-    """Exports search results to a CSV file."""
+    """Exports search results to a CSV file, streamed from a server-side cursor."""
     filters = request.json
     conn = None
     try:
-        base_query = "SELECT date, vendor, mo_number, serial_number, vqc_status, ft_status, vqc_reason, ft_reason FROM rings"
-        where_clauses, params = [], []
-
-        if filters.get('serialNumbers'):
-            serial_numbers = [s.strip().upper() for s in filters['serialNumbers'].split(',') if s.strip()]
-            if serial_numbers:
-                where_clauses.append("UPPER(serial_number) = ANY(%s)")
-                params.append(serial_numbers)
-                
-        if filters.get('moNumbers'):
-            mo_numbers = [s.strip().upper() for s in filters['moNumbers'].split(',') if s.strip()]
-            if mo_numbers:
-                where_clauses.append("UPPER(mo_number) = ANY(%s)")
-                params.append(mo_numbers)
-                
-        if filters.get('dateFrom'):
-            where_clauses.append("date >= %s")
-            params.append(filters['dateFrom'])
-            
-        if filters.get('dateTo'):
-            where_clauses.append("date <= %s")
-            params.append(filters['dateTo'])
-            
-        if filters.get('vendor'):
-            where_clauses.append("vendor = ANY(%s)")
-            params.append(filters['vendor'])
-            
-        if filters.get('vqcStatus'):
-            where_clauses.append("vqc_status = ANY(%s)")
-            params.append(filters['vqcStatus'])
-            
-        if filters.get('ftStatus'):
-            where_clauses.append("ft_status = ANY(%s)")
-            params.append(filters['ftStatus'])
-            
-        if filters.get('rejectionReason'):
-            where_clauses.append("(vqc_reason = ANY(%s) OR ft_reason = ANY(%s))")
-            params.extend([filters['rejectionReason'], filters['rejectionReason']])
-
-        if where_clauses:
-            base_query += " WHERE " + " AND ".join(where_clauses)
-        
-        base_query += " ORDER BY date DESC, id DESC;"
+        try:
+            base_query, params = search_export_query(filters)
+        except ValueError as e:
+            return jsonify(status="error", message=str(e)), 400
 
         conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(base_query, tuple(params))
-            results = cursor.fetchall()
-            
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            # Write headers
-            headers = [desc[0] for desc in cursor.description]
-            writer.writerow(headers)
-            
-            # Write data
-            for row in results:
-                writer.writerow(row)
-            
-            output.seek(0)
-            return Response(
-                output.getvalue(),
-                mimetype="text/csv",
-                headers={"Content-Disposition": "attachment;filename=search_results.csv"}
-            )
+        # Rows go from a server-side cursor to the client in batches
+        cursor = open_server_cursor(conn, 'export_search_results', base_query, tuple(params))
+        response = stream_csv(conn, cursor, SEARCH_COLUMNS, 'search_results.csv', return_db_connection)
+        # The response now owns the connection
+        conn = None
+        return response
 
     except (psycopg2.Error, Exception) as e:
         current_app.logger.error(f"Export failed: {e}")
         return jsonify(status="error", message=f"Export failed: {e}"), 500
     finally:
         if conn:
-            return_db_connection(conn)
\ No newline at end of file
+            return_db_connection(conn)
+
+@search_bp.route('/search/cache/stats', methods=['GET'])
+def get_search_cache_stats():
+    """Returns the search result cache metrics of this process."""
+    return jsonify(search_cache_stats())
@@ -0,0 +1,465 @@
+"""Versioned, non-destructive schema migrations for the rings database.
+
+Each entry in SCHEMA_MIGRATIONS is applied once, in order, and recorded in the
+``schema_migrations`` table. Plain statements, followed by any Python
+``functions`` (called with a cursor), run inside a transaction; indexes listed
+under ``concurrent_indexes`` are built with CREATE INDEX CONCURRENTLY so they can
+be rolled out on a live, loaded table.
+"""
+import psycopg2
+
+from app.aggregates import FINAL_REASON_SQL, FINAL_STAGE_SQL, FINAL_STATUS_SQL, apply_taxonomy_changes
+from app.dictionaries import (
+    FILTER_OPTION_TABLES, REASON_OPTIONS_TABLE, REASON_OPTIONS_TABLE_SQL, backfill_dictionaries,
+    backfill_reason_options, create_dictionaries_sql, dictionary_trigger_function_sql, reason_options_trigger_function_sql,
+)
+from app.partitions import is_partitioned, list_partition_tables
+from app.taxonomy import (
+    REASON_LOOKUP_TABLE_SQL, backfill_reason_codes, reason_codes_trigger_function_sql, seed_rejection_reasons_sql,
+)
+
+# Arbitrary key for the advisory lock that serialises migration runners
+SCHEMA_LOCK_KEY = 7_241_001
+
+SCHEMA_MIGRATIONS = [
+    {
+        'version': 1,
+        'description': "Create the 'rings' table, base indexes and full-text search trigger",
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS rings (
+                id SERIAL PRIMARY KEY, date DATE, mo_number VARCHAR(50), vendor VARCHAR(50),
+                serial_number VARCHAR(100) UNIQUE, ring_size VARCHAR(100), sku VARCHAR(50),
+                vqc_status VARCHAR(100), vqc_reason TEXT, ft_status VARCHAR(100), ft_reason TEXT,
+                reason_tsvector TSVECTOR, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_serial_number ON rings(serial_number);
+            CREATE INDEX IF NOT EXISTS idx_vendor ON rings(vendor);
+            CREATE INDEX IF NOT EXISTS idx_date_desc ON rings(date DESC);
+            CREATE INDEX IF NOT EXISTS idx_rings_composite ON rings(vendor, vqc_status, ft_status);
+            CREATE INDEX IF NOT EXISTS idx_rings_text_search ON rings USING GIN(reason_tsvector);
+            """,
+            """
+            CREATE OR REPLACE FUNCTION update_rings_tsvector_trigger() RETURNS trigger AS $$
+            BEGIN
+                NEW.reason_tsvector :=
+                    to_tsvector('english', COALESCE(NEW.vqc_reason, '') || ' ' || COALESCE(NEW.ft_reason, ''));
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS tsvectorupdate ON rings;
+            CREATE TRIGGER tsvectorupdate BEFORE INSERT OR UPDATE
+            ON rings FOR EACH ROW EXECUTE PROCEDURE update_rings_tsvector_trigger();
+            """,
+        ],
+    },
+    {
+        'version': 2,
+        'description': 'Expression, covering and partial indexes for search and report queries',
+        'concurrent_indexes': [
+            ('idx_rings_serial_upper', 'rings', '(UPPER(serial_number))'),
+            ('idx_rings_mo_upper', 'rings', '(UPPER(mo_number))'),
+            # A btree entry is capped at about 2.7 KB, so the free-text reasons stay out of INCLUDE
+            ('idx_rings_date_vendor', 'rings', '(date, vendor) INCLUDE (vqc_status, ft_status, created_at)'),
+            ('idx_rings_vqc_rejected', 'rings',
+             "(vendor, date) WHERE vqc_status IS NOT NULL AND UPPER(vqc_status) NOT IN ('ACCEPTED', 'PASS', '')"),
+            ('idx_rings_ft_rejected', 'rings',
+             "(vendor, date) WHERE ft_status IS NOT NULL AND UPPER(ft_status) NOT IN ('ACCEPTED', 'PASS', '')"),
+        ],
+        # The UNIQUE constraint on serial_number already provides this index
+        'drop_indexes': ['idx_serial_number'],
+    },
+    {
+        'version': 3,
+        'description': 'Pre-aggregated daily report table maintained by the data migration',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS rings_daily_stats (
+                date DATE NOT NULL, vendor VARCHAR(50), hour SMALLINT NOT NULL,
+                vqc_status VARCHAR(100) NOT NULL, ft_status VARCHAR(100) NOT NULL,
+                final_status VARCHAR(10) NOT NULL, final_stage VARCHAR(10) NOT NULL,
+                final_reason TEXT NOT NULL, ring_count INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_rings_daily_stats_date_vendor ON rings_daily_stats(date, vendor);
+
+            CREATE TABLE IF NOT EXISTS rings_aggregate_dates (
+                date DATE PRIMARY KEY,
+                refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+        ],
+    },
+    {
+        'version': 4,
+        'description': 'Rejection fact table for the rejection trends reports',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS rings_rejection_facts (
+                date DATE NOT NULL, vendor VARCHAR(50), stage VARCHAR(10) NOT NULL,
+                reason TEXT NOT NULL, rejection_count INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_rings_rejection_facts_vendor_date
+                ON rings_rejection_facts(vendor, date) INCLUDE (stage, reason, rejection_count);
+            """,
+            # Dates aggregated before this table existed have no facts yet
+            "TRUNCATE TABLE rings_aggregate_dates;",
+        ],
+    },
+    {
+        'version': 5,
+        'description': 'Final status, stage and reason columns maintained at write time',
+        'statements': [
+            """
+            ALTER TABLE rings
+                ADD COLUMN IF NOT EXISTS final_status VARCHAR(10),
+                ADD COLUMN IF NOT EXISTS final_stage VARCHAR(10),
+                ADD COLUMN IF NOT EXISTS final_reason TEXT;
+            """,
+            f"""
+            CREATE OR REPLACE FUNCTION update_rings_final_status_trigger() RETURNS trigger AS $$
+            BEGIN
+                SELECT {FINAL_STATUS_SQL}, {FINAL_STAGE_SQL}, {FINAL_REASON_SQL}
+                INTO NEW.final_status, NEW.final_stage, NEW.final_reason
+                FROM (SELECT NEW.vqc_status, NEW.vqc_reason, NEW.ft_status, NEW.ft_reason)
+                    AS r(vqc_status, vqc_reason, ft_status, ft_reason);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS finalstatusupdate ON rings;
+            CREATE TRIGGER finalstatusupdate BEFORE INSERT OR UPDATE
+            ON rings FOR EACH ROW EXECUTE PROCEDURE update_rings_final_status_trigger();
+            """,
+            f"""
+            UPDATE rings SET
+                final_status = {FINAL_STATUS_SQL},
+                final_stage = {FINAL_STAGE_SQL},
+                final_reason = {FINAL_REASON_SQL}
+            WHERE final_status IS NULL;
+            """,
+        ],
+        'concurrent_indexes': [
+            ('idx_rings_final_status', 'rings', '(date, vendor, final_status) INCLUDE (final_stage)'),
+            # final_reason is free text, too long for a btree entry, so it stays out of INCLUDE
+            ('idx_rings_final_rejected', 'rings',
+             "(date, vendor) INCLUDE (final_stage) WHERE final_status = 'Rejected'"),
+        ],
+    },
+    {
+        'version': 6,
+        'description': 'Rejection reason taxonomy, reason codes on rings and code-keyed rejection facts',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS rejection_reasons (
+                code SMALLINT PRIMARY KEY, category VARCHAR(20) NOT NULL, reason TEXT NOT NULL
+            );
+            """ + REASON_LOOKUP_TABLE_SQL,
+            seed_rejection_reasons_sql(),
+            """
+            ALTER TABLE rings
+                ADD COLUMN IF NOT EXISTS vqc_reason_code SMALLINT,
+                ADD COLUMN IF NOT EXISTS ft_reason_code SMALLINT;
+            """,
+            # Reasons missing from the lookup leave the code NULL; the data migration
+            # classifies new reasons before writing and the aggregate refresh heals the rest.
+            reason_codes_trigger_function_sql() + """
+            DROP TRIGGER IF EXISTS reasoncodeupdate ON rings;
+            CREATE TRIGGER reasoncodeupdate BEFORE INSERT OR UPDATE
+            ON rings FOR EACH ROW EXECUTE PROCEDURE update_rings_reason_codes_trigger();
+            """,
+            """
+            DROP TABLE IF EXISTS rings_rejection_facts;
+            CREATE TABLE rings_rejection_facts (
+                date DATE NOT NULL, vendor VARCHAR(50), stage VARCHAR(10) NOT NULL,
+                reason_code SMALLINT NOT NULL, rejection_count INTEGER NOT NULL
+            );
+            CREATE INDEX idx_rings_rejection_facts_vendor_date
+                ON rings_rejection_facts(vendor, date) INCLUDE (stage, reason_code, rejection_count);
+            """,
+            # Facts are rebuilt per date on demand from the new codes
+            "TRUNCATE TABLE rings_aggregate_dates;",
+        ],
+        'functions': [backfill_reason_codes],
+    },
+    {
+        'version': 7,
+        'description': 'Vendor and status filter option dictionaries maintained at write time',
+        'statements': [
+            create_dictionaries_sql(),
+            dictionary_trigger_function_sql() + """
+            DROP TRIGGER IF EXISTS dictionaryupdate ON rings;
+            CREATE TRIGGER dictionaryupdate BEFORE INSERT OR UPDATE OF vendor, vqc_status, ft_status
+            ON rings FOR EACH ROW EXECUTE PROCEDURE update_rings_dictionaries_trigger();
+            """,
+        ],
+        'functions': [backfill_dictionaries],
+    },
+    {
+        'version': 8,
+        'description': 'Persistent daily report cache for closed days',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS rings_report_cache (
+                date DATE NOT NULL, vendor VARCHAR(50) NOT NULL, report_version SMALLINT NOT NULL,
+                payload JSONB NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (date, vendor, report_version)
+            );
+            """,
+        ],
+    },
+    {
+        'version': 9,
+        'description': 'Keyset pagination index for search ordered by (date DESC, id DESC)',
+        'concurrent_indexes': [
+            ('idx_rings_date_id', 'rings', '(date DESC, id DESC)'),
+        ],
+        # Its leading column already serves every date DESC scan
+        'drop_indexes': ['idx_date_desc'],
+    },
+    {
+        'version': 10,
+        'description': 'Data version counter behind the search result cache',
+        'statements': [
+            # Seeded from the clock so a recreated table never repeats a version
+            """
+            CREATE TABLE IF NOT EXISTS rings_data_version (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                version BIGINT NOT NULL
+            );
+            INSERT INTO rings_data_version (version)
+            VALUES ((EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::BIGINT)
+            ON CONFLICT (id) DO NOTHING;
+            """,
+        ],
+    },
+    {
+        'version': 11,
+        'description': 'Rejection reason filter options maintained on write',
+        'statements': [
+            REASON_OPTIONS_TABLE_SQL,
+            reason_options_trigger_function_sql() + """
+            DROP TRIGGER IF EXISTS reasonoptionsupdate ON rings;
+            CREATE TRIGGER reasonoptionsupdate BEFORE INSERT OR UPDATE OF vqc_reason, ft_reason
+            ON rings FOR EACH ROW EXECUTE PROCEDURE update_rings_reason_options_trigger();
+            """,
+        ],
+        'functions': [backfill_reason_options],
+    },
+    {
+        'version': 12,
+        'description': 'Pattern indexes for serial and MO number autocomplete',
+        # text_pattern_ops serves prefix LIKE in any collation as well as equality
+        'concurrent_indexes': [
+            ('idx_rings_serial_upper_pattern', 'rings', '(UPPER(serial_number) text_pattern_ops)'),
+            ('idx_rings_mo_upper_pattern', 'rings', '(UPPER(mo_number) text_pattern_ops)'),
+        ],
+        'drop_indexes': ['idx_rings_serial_upper', 'idx_rings_mo_upper'],
+    },
+    {
+        'version': 13,
+        'description': 'Reason filter options unique on md5(name), so long reasons can be stored',
+        'statements': [
+            f"""
+            ALTER TABLE {REASON_OPTIONS_TABLE} DROP CONSTRAINT IF EXISTS {REASON_OPTIONS_TABLE}_pkey;
+            """ + REASON_OPTIONS_TABLE_SQL,
+            reason_options_trigger_function_sql(),
+        ],
+    },
+    {
+        'version': 14,
+        'description': 'Taxonomy fingerprint, so stored reasons are reclassified when the taxonomy changes',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS rejection_taxonomy_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                fingerprint TEXT NOT NULL
+            );
+            """,
+        ],
+        # The first run reclassifies every stored reason, including those left UNCLASSIFIED
+        'functions': [apply_taxonomy_changes],
+    },
+]
+
+LATEST_SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1]['version']
+
+RESET_STATEMENTS = [
+    "DROP TABLE IF EXISTS rings CASCADE;",
+    "DROP FUNCTION IF EXISTS update_rings_tsvector_trigger CASCADE;",
+    "DROP FUNCTION IF EXISTS update_rings_final_status_trigger CASCADE;",
+    "DROP FUNCTION IF EXISTS update_rings_reason_codes_trigger CASCADE;",
+    "DROP FUNCTION IF EXISTS update_rings_dictionaries_trigger CASCADE;",
+    "DROP FUNCTION IF EXISTS update_rings_reason_options_trigger CASCADE;",
+    "DROP TABLE IF EXISTS rings_daily_stats;",
+    "DROP TABLE IF EXISTS rings_rejection_facts;",
+    "DROP TABLE IF EXISTS rings_aggregate_dates;",
+    "DROP TABLE IF EXISTS rings_report_cache;",
+    "DROP TABLE IF EXISTS rings_data_version;",
+    "DROP TABLE IF EXISTS rejection_taxonomy_state;",
+    "DROP TABLE IF EXISTS rejection_reason_lookup;",
+    "DROP TABLE IF EXISTS rejection_reasons;",
+    *[f"DROP TABLE IF EXISTS {table};" for table in FILTER_OPTION_TABLES],
+    "DROP TABLE IF EXISTS schema_migrations;",
+]
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+def get_schema_version(conn):
+    """Returns the highest applied schema version, or 0 for an unversioned database."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cursor.fetchone()[0]
+
+
+def get_applied_migrations(conn):
+    """Returns (version, description, applied_at) rows for every applied migration."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return []
+        cursor.execute("SELECT version, description, applied_at FROM schema_migrations ORDER BY version")
+        return cursor.fetchall()
+
+
+def _drop_invalid_index(cursor, index_name):
+    """Drops an index left INVALID by an interrupted concurrent build so it can be rebuilt."""
+    cursor.execute("""
+        SELECT NOT i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)
+    """, (index_name,))
+    row = cursor.fetchone()
+    if row and row[0]:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+        return True
+    return False
+
+
+def _build_index_concurrently(cursor, index_name, table, definition, log):
+    if not is_partitioned(cursor, table):
+        if _drop_invalid_index(cursor, index_name):
+            log.append(f"Dropped invalid index {index_name} left by an earlier failed build.")
+        log.append(f"Building index {index_name} concurrently...")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table} {definition};")
+        return
+
+    # Partitioned tables cannot build an index concurrently. Create the parent index on
+    # the table only, build each partition's index concurrently and attach it.
+    log.append(f"Building index {index_name} concurrently on each partition of {table}...")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON ONLY {table} {definition};")
+    for partition in list_partition_tables(cursor, table):
+        cursor.execute("""
+            SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+            WHERE i.inhparent = %s::regclass AND x.indrelid = %s::regclass
+        """, (index_name, partition))
+        if cursor.fetchone():
+            continue
+        partition_index = f"{partition}_{index_name}"[:63]
+        _drop_invalid_index(cursor, partition_index)
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {definition};")
+        cursor.execute(f"ALTER INDEX {index_name} ATTACH PARTITION {partition_index};")
+
+
+def _drop_index_concurrently(cursor, index_name, log):
+    log.append(f"Dropping index {index_name} concurrently...")
+    cursor.execute("SELECT relkind = 'I' FROM pg_class WHERE oid = to_regclass(%s)", (index_name,))
+    row = cursor.fetchone()
+    if row and row[0]:
+        # Indexes on partitioned tables cannot be dropped concurrently
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name};")
+    else:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+
+
+def _apply_migration(conn, migration, log):
+    version = migration['version']
+    log.append(f"Applying schema migration {version}: {migration['description']}...")
+
+    with conn.cursor() as cursor:
+        for statement in migration.get('statements', []):
+            cursor.execute(statement)
+        for function in migration.get('functions', []):
+            function(cursor)
+    conn.commit()
+
+    # CONCURRENTLY cannot run inside a transaction block
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for index_name, table, definition in migration.get('concurrent_indexes', []):
+                _build_index_concurrently(cursor, index_name, table, definition, log)
+            for index_name in migration.get('drop_indexes', []):
+                _drop_index_concurrently(cursor, index_name, log)
+    finally:
+        conn.autocommit = False
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s) ON CONFLICT (version) DO NOTHING",
+            (version, migration['description'])
+        )
+    conn.commit()
+
+
+def apply_migrations(conn, log=None, target_version=None):
+    """Applies every pending schema migration up to target_version and returns the applied versions.
+
+    Already-applied migrations are skipped, so this is safe to call on a populated
+    database. A session advisory lock keeps concurrent callers from racing each other.
+    """
+    if log is None:
+        log = []
+    target_version = target_version or LATEST_SCHEMA_VERSION
+    applied = []
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+    try:
+        with conn.cursor() as cursor:
+            _ensure_migrations_table(cursor)
+        conn.commit()
+
+        applied_versions = {row[0] for row in get_applied_migrations(conn)}
+        log.append(f"Current schema version: {max(applied_versions, default=0)}.")
+        for migration in SCHEMA_MIGRATIONS:
+            if migration['version'] not in applied_versions and migration['version'] <= target_version:
+                _apply_migration(conn, migration, log)
+                applied.append(migration['version'])
+
+        if applied:
+            log.append(f"Schema is now at version {applied[-1]}.")
+        else:
+            log.append("Schema is already up to date.")
+        return applied
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+        conn.commit()
+
+
+def reset_schema(conn, log=None):
+    """Drops every schema object so the next apply_migrations() starts from scratch. Destroys all data."""
+    if log is None:
+        log = []
+    log.append("Dropping existing schema objects if they exist...")
+    with conn.cursor() as cursor:
+        for statement in RESET_STATEMENTS:
+            cursor.execute(statement)
+    conn.commit()
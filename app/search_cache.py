@@ -0,0 +1,110 @@
+"""In-process cache of search result pages.
+
+Entries hold the serialised JSON body of one /api/search page, keyed by the
+data version and a fingerprint of the normalised filters, page size and
+cursor. The cache is an LRU bounded by the total size of the cached bodies
+(SEARCH_CACHE_MAX_BYTES).
+
+``rings_data_version`` holds a counter that every write path bumps in the same
+transaction as its change to rings (the data migration, /api/db/clear and
+partition detaching). A search reads the counter before its query, so an
+entry can never be stored under a version older than its rows, and entries of
+superseded versions are dropped as soon as a newer version is seen. Writes
+made outside those paths are not seen until the next bump; call
+clear_search_cache() after them.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+SEARCH_CACHE_MAX_BYTES = int(os.getenv('SEARCH_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Larger pages would evict too much of the cache to be worth keeping
+SEARCH_CACHE_MAX_ENTRY_FRACTION = 4
+
+# (data version, fingerprint) -> (body, next cursor), least recently used first
+_entries = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0, 'dataVersion': None}
+
+
+def get_data_version(cursor):
+    cursor.execute("SELECT version FROM rings_data_version")
+    return cursor.fetchone()[0]
+
+
+def bump_data_version(cursor):
+    """Marks every cached search result as stale once the current transaction commits."""
+    cursor.execute("UPDATE rings_data_version SET version = version + 1 RETURNING version")
+    return cursor.fetchone()[0]
+
+
+def search_fingerprint(normalized_filters, page_size, cursor_token):
+    """Returns the cache key of one search page."""
+    key = json.dumps([normalized_filters, page_size, cursor_token], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _drop_older_versions(data_version):
+    if _stats['dataVersion'] is not None and data_version <= _stats['dataVersion']:
+        return
+    _stats['dataVersion'] = data_version
+    for key in [key for key in _entries if key[0] != data_version]:
+        body, _ = _entries.pop(key)
+        _stats['bytes'] -= len(body)
+
+
+def get_cached_search(data_version, fingerprint):
+    """Returns (body, next cursor) for a cached page, or None."""
+    with _cache_lock:
+        _drop_older_versions(data_version)
+        entry = _entries.get((data_version, fingerprint))
+        if entry is None:
+            _stats['misses'] += 1
+            return None
+        _entries.move_to_end((data_version, fingerprint))
+        _stats['hits'] += 1
+        return entry
+
+
+def store_cached_search(data_version, fingerprint, body, next_cursor):
+    if len(body) > SEARCH_CACHE_MAX_BYTES // SEARCH_CACHE_MAX_ENTRY_FRACTION:
+        return
+    key = (data_version, fingerprint)
+    with _cache_lock:
+        _drop_older_versions(data_version)
+        if data_version != _stats['dataVersion']:
+            # A newer version was seen while this page was being built
+            return
+        if key in _entries:
+            _stats['bytes'] -= len(_entries.pop(key)[0])
+        _entries[key] = (body, next_cursor)
+        _stats['bytes'] += len(body)
+        while _stats['bytes'] > SEARCH_CACHE_MAX_BYTES:
+            evicted, _ = _entries.popitem(last=False)[1]
+            _stats['bytes'] -= len(evicted)
+            _stats['evictions'] += 1
+
+
+def clear_search_cache():
+    with _cache_lock:
+        _entries.clear()
+        _stats.update(hits=0, misses=0, evictions=0, bytes=0, dataVersion=None)
+
+
+def search_cache_stats():
+    """Returns the cache metrics: entry count, memory use, hits, misses and hit ratio."""
+    with _cache_lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {
+            'entries': len(_entries),
+            'bytes': _stats['bytes'],
+            'maxBytes': SEARCH_CACHE_MAX_BYTES,
+            'hits': _stats['hits'],
+            'misses': _stats['misses'],
+            'hitRatio': _stats['hits'] / lookups if lookups else 0.0,
+            'evictions': _stats['evictions'],
+            'dataVersion': _stats['dataVersion'],
+        }
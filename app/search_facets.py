@@ -0,0 +1,152 @@
+"""Faceted counts for the search filters.
+
+For each multi-select filter (vendor, VQC status, FT status and rejection
+reason) a facet counts how many rings each value would match. Each facet
+applies every filter except its own, so picking a vendor still shows how many
+rings the other vendors have, and the total applies all of them. A ring counts
+once per distinct reason in vqc_reason/ft_reason, matching the
+rejectionReason filter.
+
+The vendor and status facets and the total come from one GROUPING SETS query
+over the matching rings, using aggregate FILTERs to leave out each facet's own
+condition. When only the date range and vendor filters are set, those facets
+are read from ``rings_daily_stats`` instead; reasons are always counted on
+rings, because the aggregates only keep the final reason.
+"""
+from app.aggregates import ensure_aggregates
+from app.search_query import normalize_search_filters, search_conditions
+
+# Facet name -> rings column; the names are the search filter keys
+FACET_COLUMNS = {
+    'vendor': 'vendor',
+    'vqcStatus': 'vqc_status',
+    'ftStatus': 'ft_status',
+}
+REASON_FACET = 'rejectionReason'
+FACETS = list(FACET_COLUMNS) + [REASON_FACET]
+
+# Filters the daily aggregates can answer
+AGGREGATE_FILTERS = {'dateFrom', 'dateTo', 'vendor'}
+
+
+def _flag_sql(conditions, facet):
+    clause, params = conditions.get(facet, ('TRUE', []))
+    return f"({clause}) AS {facet.lower()}_ok", params
+
+
+def _all_ok(excluded=None):
+    return " AND ".join(f"{facet.lower()}_ok" for facet in FACETS if facet != excluded)
+
+
+def _reason_counts_sql(source):
+    return f"""
+        SELECT '{REASON_FACET}', reasons.reason, COUNT(*)
+        FROM {source} m
+        CROSS JOIN LATERAL (
+            SELECT DISTINCT r FROM unnest(ARRAY[m.vqc_reason, m.ft_reason]) AS r
+        ) AS reasons(reason)
+        WHERE {_all_ok(REASON_FACET)} AND reasons.reason <> ''
+        GROUP BY reasons.reason
+    """
+
+
+def _collect(rows):
+    result = {'total': 0, 'facets': {facet: [] for facet in FACETS}}
+    for facet, value, count in rows:
+        if facet == 'total':
+            result['total'] = int(count or 0)
+        elif value not in (None, '') and count:
+            result['facets'][facet].append({'value': value, 'count': int(count)})
+    for values in result['facets'].values():
+        values.sort(key=lambda item: (-item['count'], item['value']))
+    return result
+
+
+def _rings_facets(cursor, conditions):
+    flags, params = [], []
+    for facet in FACETS:
+        flag, flag_params = _flag_sql(conditions, facet)
+        flags.append(flag)
+        params.extend(flag_params)
+
+    where_clauses = []
+    for key, (clause, clause_params) in conditions.items():
+        if key not in FACETS:
+            where_clauses.append(clause)
+            params.extend(clause_params)
+    where_sql = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+
+    grouping_facets = " ".join(
+        f"WHEN GROUPING({column}) = 0 THEN '{facet}'" for facet, column in FACET_COLUMNS.items()
+    )
+    grouping_counts = " ".join(
+        f"WHEN GROUPING({column}) = 0 THEN COUNT(*) FILTER (WHERE {_all_ok(facet)})"
+        for facet, column in FACET_COLUMNS.items()
+    )
+    cursor.execute(f"""
+        WITH matched AS (
+            SELECT vendor, vqc_status, ft_status, vqc_reason, ft_reason, {', '.join(flags)}
+            FROM rings{where_sql}
+        )
+        SELECT
+            CASE {grouping_facets} ELSE 'total' END,
+            COALESCE({', '.join(FACET_COLUMNS.values())}),
+            CASE {grouping_counts} ELSE COUNT(*) FILTER (WHERE {_all_ok()}) END
+        FROM matched
+        GROUP BY GROUPING SETS ({', '.join(f'({column})' for column in FACET_COLUMNS.values())}, ())
+        UNION ALL
+        {_reason_counts_sql('matched')}
+    """, params)
+    return _collect(cursor.fetchall())
+
+
+def _aggregate_facets(cursor, conditions, filters):
+    ensure_aggregates(cursor, filters['dateFrom'], filters['dateTo'])
+
+    vendors = filters.get('vendor')
+    vendor_ok = "vendor = ANY(%(vendors)s)" if vendors else "TRUE"
+    params = {'date_from': filters['dateFrom'], 'date_to': filters['dateTo'], 'vendors': vendors}
+    cursor.execute(f"""
+        SELECT
+            CASE WHEN GROUPING(vendor) = 0 THEN 'vendor' WHEN GROUPING(vqc_status) = 0 THEN 'vqcStatus'
+                 WHEN GROUPING(ft_status) = 0 THEN 'ftStatus' ELSE 'total' END,
+            COALESCE(vendor, vqc_status, ft_status),
+            CASE WHEN GROUPING(vendor) = 0 THEN SUM(ring_count)
+                 ELSE SUM(ring_count) FILTER (WHERE {vendor_ok}) END
+        FROM rings_daily_stats
+        WHERE date BETWEEN %(date_from)s AND %(date_to)s
+        GROUP BY GROUPING SETS ((vendor), (vqc_status), (ft_status), ())
+    """, params)
+    rows = cursor.fetchall()
+
+    vendor_clause, vendor_params = conditions.get('vendor', ('TRUE', []))
+    cursor.execute(f"""
+        WITH matched AS (
+            SELECT vqc_reason, ft_reason, TRUE AS vendor_ok, TRUE AS vqcstatus_ok, TRUE AS ftstatus_ok
+            FROM rings
+            WHERE date BETWEEN %s AND %s AND {vendor_clause}
+        )
+        {_reason_counts_sql('matched')}
+    """, [filters['dateFrom'], filters['dateTo'], *vendor_params])
+    return _collect(rows + cursor.fetchall())
+
+
+def uses_aggregates(filters):
+    """Whether the vendor and status facets of the normalised filters can come from the daily aggregates."""
+    return 'dateFrom' in filters and 'dateTo' in filters and set(filters) <= AGGREGATE_FILTERS
+
+
+def search_facets(cursor, filters):
+    """Returns {'total', 'facets': {facet: [{'value', 'count'}]}, 'source'} for a search request body.
+
+    Raises ValueError for a date that cannot be parsed.
+    """
+    normalized = normalize_search_filters(filters)
+    conditions = search_conditions(filters)
+    if uses_aggregates(normalized):
+        result = _aggregate_facets(cursor, conditions, normalized)
+        result['source'] = 'aggregates'
+    else:
+        result = _rings_facets(cursor, conditions)
+        result['source'] = 'rings'
+    return result
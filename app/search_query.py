@@ -0,0 +1,169 @@
+"""Filter parsing and keyset pagination shared by the search endpoints.
+
+Search results are ordered by ``(date DESC, id DESC)`` (undated rows first, as
+PostgreSQL sorts NULLs first in descending order), which the
+``idx_rings_date_id`` index serves directly. A page is continued from the last
+row it returned rather than with OFFSET, so every page costs the same no matter
+how deep it is. The continuation token handed to clients is that last row's
+(date, id), base64-encoded; clients should treat it as opaque.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import date
+
+import pandas as pd
+
+
+SEARCH_COLUMNS = ['date', 'vendor', 'mo_number', 'serial_number', 'vqc_status', 'ft_status', 'vqc_reason', 'ft_reason']
+
+SEARCH_ORDER_SQL = "ORDER BY date DESC, id DESC"
+
+# Rows per page when the request does not ask for a page size
+DEFAULT_SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '5000'))
+MAX_SEARCH_PAGE_SIZE = 50000
+
+
+def _split_numbers(value):
+    return [s.strip().upper() for s in value.split(',') if s.strip()]
+
+
+def _parse_date(filters, key):
+    value = filters[key]
+    try:
+        return pd.to_datetime(value).date()
+    except Exception:
+        raise ValueError(f'Invalid {key} format: {value}')
+
+
+def _sorted_values(values):
+    if isinstance(values, str):
+        values = [values]
+    return sorted({str(value) for value in values})
+
+
+def normalize_search_filters(filters):
+    """Returns the canonical form of a request's search filters.
+
+    Serial and MO numbers are upper-cased, de-duplicated and sorted, dates are
+    parsed and multi-select values sorted, and empty filters are dropped, so
+    requests that select the same rows normalise to the same dict. Raises
+    ValueError for a date that cannot be parsed.
+    """
+    normalized = {}
+    for key in ('serialNumbers', 'moNumbers'):
+        if filters.get(key):
+            numbers = sorted(set(_split_numbers(filters[key])))
+            if numbers:
+                normalized[key] = numbers
+    for key in ('dateFrom', 'dateTo'):
+        if filters.get(key):
+            normalized[key] = _parse_date(filters, key)
+    for key in ('vendor', 'vqcStatus', 'ftStatus', 'rejectionReason'):
+        if filters.get(key):
+            normalized[key] = _sorted_values(filters[key])
+    return normalized
+
+
+def search_conditions(filters):
+    """Returns {filter key: (clause, params)} for every filter a request body sets.
+
+    Raises ValueError for a date that cannot be parsed.
+    """
+    filters = normalize_search_filters(filters)
+    conditions = {}
+
+    # Use UPPER for case-insensitive comparison
+    if 'serialNumbers' in filters:
+        conditions['serialNumbers'] = ("UPPER(serial_number) = ANY(%s)", [filters['serialNumbers']])
+
+    if 'moNumbers' in filters:
+        conditions['moNumbers'] = ("UPPER(mo_number) = ANY(%s)", [filters['moNumbers']])
+
+    if 'dateFrom' in filters:
+        conditions['dateFrom'] = ("date >= %s", [filters['dateFrom']])
+
+    if 'dateTo' in filters:
+        conditions['dateTo'] = ("date <= %s", [filters['dateTo']])
+
+    if 'vendor' in filters:
+        conditions['vendor'] = ("vendor = ANY(%s)", [filters['vendor']])
+
+    if 'vqcStatus' in filters:
+        conditions['vqcStatus'] = ("vqc_status = ANY(%s)", [filters['vqcStatus']])
+
+    if 'ftStatus' in filters:
+        conditions['ftStatus'] = ("ft_status = ANY(%s)", [filters['ftStatus']])
+
+    if 'rejectionReason' in filters:
+        conditions['rejectionReason'] = (
+            "(vqc_reason = ANY(%s) OR ft_reason = ANY(%s))",
+            [filters['rejectionReason'], filters['rejectionReason']],
+        )
+
+    return conditions
+
+
+def build_search_conditions(filters):
+    """Returns (where_clauses, params) for the search filters of a request body.
+
+    Raises ValueError for a date that cannot be parsed.
+    """
+    where_clauses, params = [], []
+    for clause, clause_params in search_conditions(filters).values():
+        where_clauses.append(clause)
+        params.extend(clause_params)
+    return where_clauses, params
+
+
+def search_export_query(filters):
+    """Returns (query, params) selecting every match of the filters in search order.
+
+    Raises ValueError for a date that cannot be parsed.
+    """
+    where_clauses, params = build_search_conditions(filters)
+    query = f"SELECT {', '.join(SEARCH_COLUMNS)} FROM rings"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    return f"{query} {SEARCH_ORDER_SQL}", params
+
+
+def encode_cursor(row_date, row_id):
+    """Returns the continuation token for a page whose last row is (row_date, row_id)."""
+    payload = json.dumps([row_date.isoformat() if row_date else None, row_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns (date or None, id) from a continuation token; raises ValueError if it is malformed."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        row_date, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise ValueError
+        return (date.fromisoformat(row_date) if row_date is not None else None), row_id
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def keyset_condition(token):
+    """Returns (clause, params) selecting the rows that come after the token's row."""
+    row_date, row_id = decode_cursor(token)
+    if row_date is None:
+        # Undated rows sort first, so everything dated still follows
+        return "((date IS NULL AND id < %s) OR date IS NOT NULL)", [row_id]
+    return "(date, id) < (%s, %s)", [row_date, row_id]
+
+
+def parse_page_size(value):
+    """Returns the page size for a request value, bounded by MAX_SEARCH_PAGE_SIZE."""
+    if value is None:
+        return DEFAULT_SEARCH_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid pageSize: {value}')
+    if page_size < 1:
+        raise ValueError(f'Invalid pageSize: {value}')
+    return min(page_size, MAX_SEARCH_PAGE_SIZE)
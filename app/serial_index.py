@@ -0,0 +1,230 @@
+"""In-process index of every serial number and its status.
+
+Scanner lookups ("is this serial known, and what is its status?") are answered
+from a dict keyed by the normalised (upper-cased) serial. Each value is one
+packed int holding the ring's date and the interned ids of its vendor, VQC
+status and FT status, so millions of serials fit in a modest amount of memory.
+
+The index is built in the background at startup, reading rings in one
+repeatable-read snapshot together with the data version (see
+app.search_cache). A migration applies the rows it actually inserted or changed
+once it commits, which is only valid on top of the version it started from; any other
+gap in versions (a clear, a partition detach, a migration that raced a
+rebuild) triggers a full rebuild instead. Until the index is ready, lookups
+fall back to the database.
+
+Writes made by other processes (other workers, a schema reset) are noticed by
+comparing the index's data version with ``rings_data_version``, at most once
+every SERIAL_INDEX_VERSION_TTL seconds; a mismatch drops and rebuilds the index.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from app.search_cache import get_data_version
+from app.streaming import open_server_cursor
+
+# Bits per interned value in a packed record; the date ordinal takes the high bits
+VALUE_BITS = 16
+VALUE_MASK = (1 << VALUE_BITS) - 1
+
+# Seconds a lookup trusts the index before checking the data version again
+SERIAL_INDEX_VERSION_TTL = float(os.getenv('SERIAL_INDEX_VERSION_TTL', '1'))
+
+INDEX_SQL = "SELECT UPPER(serial_number), date, vendor, vqc_status, ft_status FROM rings"
+
+# normalised serial -> packed record
+_index = {}
+# Interned vendor and status values; id 0 stands for NULL
+_values = [None]
+_value_ids = {}
+_state = {'ready': False, 'dataVersion': None, 'checkedAt': 0.0, 'building': False, 'stale': False}
+_index_lock = threading.Lock()
+# Held while packing records, so concurrent writers intern each value once
+_intern_lock = threading.Lock()
+_executor = None
+
+
+def _intern(value):
+    if value is None:
+        return 0
+    value_id = _value_ids.get(value)
+    if value_id is None:
+        value_id = len(_values)
+        if value_id > VALUE_MASK:
+            raise ValueError(f'Too many distinct vendor and status values to index: {value_id}')
+        _values.append(value)
+        _value_ids[value] = value_id
+    return value_id
+
+
+def pack_record(row_date, vendor, vqc_status, ft_status):
+    """Packs one ring's status into an int, interning its values; call with _intern_lock held."""
+    record = row_date.toordinal() if row_date else 0
+    for value in (vendor, vqc_status, ft_status):
+        record = (record << VALUE_BITS) | _intern(value)
+    return record
+
+
+def unpack_record(record):
+    """Returns {'date', 'vendor', 'vqcStatus', 'ftStatus'} for a packed record."""
+    ft_status = _values[record & VALUE_MASK]
+    vqc_status = _values[(record >> VALUE_BITS) & VALUE_MASK]
+    vendor = _values[(record >> 2 * VALUE_BITS) & VALUE_MASK]
+    ordinal = record >> 3 * VALUE_BITS
+    return {
+        'date': date.fromordinal(ordinal) if ordinal else None,
+        'vendor': vendor,
+        'vqcStatus': vqc_status,
+        'ftStatus': ft_status,
+    }
+
+
+def lookup_serial(serial):
+    """Returns (known, status) for a serial, or None while the index is not ready."""
+    key = serial.strip().upper()
+    with _index_lock:
+        if not _state['ready']:
+            return None
+        record = _index.get(key)
+        if record is None:
+            return False, None
+        return True, unpack_record(record)
+
+
+def serial_index_check_due():
+    """Whether a ready index should be checked against the data version before it is trusted."""
+    with _index_lock:
+        return _state['ready'] and time.monotonic() - _state['checkedAt'] >= SERIAL_INDEX_VERSION_TTL
+
+
+def check_serial_index_version(data_version):
+    """Drops the index unless it holds data_version; returns whether it is still current."""
+    with _index_lock:
+        if not _state['ready']:
+            return False
+        if _state['dataVersion'] == data_version:
+            _state['checkedAt'] = time.monotonic()
+            return True
+        _index.clear()
+        _state.update(ready=False, dataVersion=None, stale=_state['building'])
+        return False
+
+
+def build_serial_index(conn):
+    """Rebuilds the whole index from rings and returns the number of serials indexed."""
+    global _index
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    try:
+        with conn.cursor() as cursor:
+            data_version = get_data_version(cursor)
+        index = {}
+        cursor = open_server_cursor(conn, 'serial_index', INDEX_SQL)
+        try:
+            with _intern_lock:
+                for serial, *status in cursor:
+                    index[serial] = pack_record(*status)
+        finally:
+            cursor.close()
+        conn.rollback()
+    finally:
+        conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+
+    with _index_lock:
+        if _state['dataVersion'] is None or data_version >= _state['dataVersion']:
+            _index = index
+            _state.update(ready=True, dataVersion=data_version, checkedAt=time.monotonic())
+        return len(index)
+
+
+def apply_serial_index_changes(rows, data_version):
+    """Applies a committed migration's changed rows, which moved the data to data_version.
+
+    rows are (upper-cased serial, date, vendor, vqc_status, ft_status) tuples, as
+    the migration's UPDATE and INSERT return them.
+
+    Returns False, and drops the index, if it does not hold the version before
+    that; the caller should then rebuild it with refresh_serial_index.
+    """
+    with _intern_lock:
+        records = [(serial, pack_record(*status)) for serial, *status in rows]
+    with _index_lock:
+        if _state['building']:
+            # The running build may have missed these rows
+            _state['stale'] = True
+            return True
+        if not _state['ready'] or _state['dataVersion'] != data_version - 1:
+            _index.clear()
+            _state.update(ready=False, dataVersion=None)
+            return False
+        _index.update(records)
+        _state['dataVersion'] = data_version
+        return True
+
+
+def serial_index_needs_build():
+    """Whether the index is neither ready nor being built, so a lookup should start a rebuild."""
+    with _index_lock:
+        return not _state['ready'] and not _state['building']
+
+
+def invalidate_serial_index():
+    """Forgets the index, so lookups go to the database until it is rebuilt."""
+    with _index_lock:
+        _index.clear()
+        _state.update(ready=False, dataVersion=None, stale=_state['building'])
+
+
+def _get_executor():
+    global _executor
+    with _index_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='serial-index')
+        return _executor
+
+
+def refresh_serial_index(get_connection, release_connection, logger=None):
+    """Starts a background rebuild of the index unless one is already running.
+
+    After a write, call invalidate_serial_index first so a build already
+    running is repeated.
+    """
+    with _index_lock:
+        if _state['building']:
+            return
+        _state.update(building=True, stale=False)
+    _get_executor().submit(_rebuild, get_connection, release_connection, logger)
+
+
+def _rebuild(get_connection, release_connection, logger):
+    while True:
+        conn = None
+        try:
+            conn = get_connection()
+            indexed = build_serial_index(conn)
+            if logger:
+                logger.info(f"Serial index built with {indexed} serial(s).")
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not build the serial index: {e}")
+        finally:
+            if conn:
+                release_connection(conn)
+        with _index_lock:
+            if not _state['stale']:
+                _state['building'] = False
+                return
+            _state['stale'] = False
+
+
+def serial_index_stats():
+    with _index_lock:
+        return {
+            'ready': _state['ready'],
+            'serials': len(_index),
+            'values': len(_values) - 1,
+            'dataVersion': _state['dataVersion'],
+            'building': _state['building'],
+        }
@@ -0,0 +1,101 @@
+"""Bulk serial-number lookup for reconciliation.
+
+The requested serials are normalised the way search normalises them (trimmed
+and upper-cased), de-duplicated in request order and COPYed into a temporary
+table, which is then joined to rings on UPPER(serial_number), the expression
+behind ``idx_rings_serial_upper_pattern``. The matches, and then the serials that
+matched nothing, are read through server-side cursors and streamed back, so
+only the parsed request is ever held in memory.
+"""
+import io
+import os
+import re
+
+from app.search_query import SEARCH_COLUMNS
+from app.streaming import STREAM_ITERSIZE, chunk_text
+
+MAX_LOOKUP_SERIALS = int(os.getenv('MAX_LOOKUP_SERIALS', '500000'))
+
+_SERIAL_SEPARATORS_RE = re.compile(r'[\s,;]+')
+
+LOOKUP_TABLE = 'lookup_serials'
+
+MATCHES_SQL = f"""
+    SELECT l.serial AS requested_serial, {', '.join(f'r.{column}' for column in SEARCH_COLUMNS)}
+    FROM {LOOKUP_TABLE} l
+    JOIN rings r ON UPPER(r.serial_number) = l.serial
+    ORDER BY l.position, r.id
+"""
+
+NOT_FOUND_SQL = f"""
+    SELECT l.serial FROM {LOOKUP_TABLE} l
+    WHERE NOT EXISTS (SELECT 1 FROM rings r WHERE UPPER(r.serial_number) = l.serial)
+    ORDER BY l.position
+"""
+
+
+def parse_serials(values):
+    """Returns the normalised, de-duplicated serials of a string or list, in request order.
+
+    Serials may be separated by commas, semicolons, whitespace or newlines.
+    """
+    if isinstance(values, str):
+        values = [values]
+    serials = {}
+    for value in values:
+        for serial in _SERIAL_SEPARATORS_RE.split(str(value).upper()):
+            if serial:
+                serials.setdefault(serial, None)
+    return list(serials)
+
+
+def load_lookup_serials(cursor, serials):
+    """COPYs serials into a temporary lookup table that lives until the transaction ends."""
+    cursor.execute(f"""
+        CREATE TEMP TABLE {LOOKUP_TABLE} (position INTEGER NOT NULL, serial TEXT NOT NULL) ON COMMIT DROP
+    """)
+    buffer = io.StringIO()
+    for position, serial in enumerate(serials):
+        buffer.write(f"{position}\t{serial.replace(chr(92), chr(92) * 2)}\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {LOOKUP_TABLE} (position, serial) FROM STDIN", buffer)
+    # Let the planner see how many serials it is joining
+    cursor.execute(f"ANALYZE {LOOKUP_TABLE}")
+
+
+def _server_rows(conn, name, query):
+    with conn.cursor(name=name) as cursor:
+        cursor.itersize = STREAM_ITERSIZE
+        cursor.execute(query)
+        yield from cursor
+
+
+def lookup_chunks(conn, requested, dumps, ndjson=False):
+    """Yields the lookup result for the serials loaded on conn.
+
+    As JSON: {"matches": [...], "notFound": [...], "summary": {...}}. As NDJSON:
+    one {"match": {...}} or {"notFound": serial} line per result and a final
+    {"summary": {...}} line.
+    """
+    columns = ['requestedSerial'] + SEARCH_COLUMNS
+
+    def pieces():
+        matched, not_found = set(), 0
+        yield '' if ndjson else '{"matches":['
+        for index, row in enumerate(_server_rows(conn, 'lookup_matches', MATCHES_SQL)):
+            matched.add(row[0])
+            record = dumps(dict(zip(columns, row)))
+            if ndjson:
+                yield '{"match":' + record + '}\n'
+            else:
+                yield (',' if index else '') + record
+        yield '' if ndjson else '],"notFound":['
+        for index, (serial,) in enumerate(_server_rows(conn, 'lookup_not_found', NOT_FOUND_SQL)):
+            not_found += 1
+            if ndjson:
+                yield '{"notFound":' + dumps(serial) + '}\n'
+            else:
+                yield (',' if index else '') + dumps(serial)
+        summary = dumps({'requested': requested, 'matched': len(matched), 'notFound': not_found})
+        yield '{"summary":' + summary + '}\n' if ndjson else '],"summary":' + summary + '}'
+    return chunk_text(pieces())
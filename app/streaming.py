@@ -0,0 +1,166 @@
+"""Streaming large query results straight out of server-side cursors.
+
+A named (server-side) cursor fetches ``itersize`` rows per round trip, each
+row is serialised as soon as it arrives, and the text is handed to Flask in
+chunks of roughly STREAM_CHUNK_SIZE characters. Only one batch of rows and one
+chunk are ever held in memory, so time-to-first-byte and peak memory do not
+depend on how many rows match. The pooled connection belongs to the response
+and goes back to the pool when the stream ends or the client goes away.
+"""
+import csv
+import io
+
+import psycopg2
+from flask import Response, stream_with_context
+
+STREAM_ITERSIZE = 2000
+STREAM_CHUNK_SIZE = 64 * 1024
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_FORMATS = ('json', 'ndjson')
+
+
+def requested_stream_format(request):
+    """Returns 'json', 'ndjson' or None (no streaming) for a request.
+
+    Streaming is asked for with ?stream=json|ndjson, or with an Accept header
+    of application/x-ndjson. Raises ValueError for an unknown stream format.
+    """
+    stream = request.args.get('stream')
+    if stream:
+        stream = stream.lower()
+        if stream not in STREAM_FORMATS:
+            raise ValueError(f"Invalid stream format: {stream} (expected 'json' or 'ndjson')")
+        return stream
+    if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    return None
+
+
+def open_server_cursor(conn, name, query, params=None, itersize=STREAM_ITERSIZE):
+    """Declares query on a named cursor of conn and returns the cursor."""
+    cursor = conn.cursor(name=name)
+    cursor.itersize = itersize
+    try:
+        cursor.execute(query, params)
+    except Exception:
+        cursor.close()
+        raise
+    return cursor
+
+
+def iter_records(cursor):
+    """Yields the rows of a cursor as dicts keyed by column name."""
+    columns = None
+    for row in cursor:
+        if columns is None:
+            # A named cursor only knows its columns once the first batch is fetched
+            columns = [desc[0] for desc in cursor.description]
+        yield dict(zip(columns, row))
+
+
+def chunk_text(pieces, chunk_size=STREAM_CHUNK_SIZE):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def json_array_chunks(records, dumps):
+    """Yields records as one JSON array, in chunks."""
+    def pieces():
+        yield '['
+        for index, record in enumerate(records):
+            yield (',' if index else '') + dumps(record)
+        yield ']'
+    return chunk_text(pieces())
+
+
+def ndjson_chunks(records, dumps):
+    """Yields records as newline-delimited JSON, in chunks."""
+    return chunk_text(dumps(record) + '\n' for record in records)
+
+
+def stream_response(chunks, on_close, mimetype, headers=None):
+    """Returns a streaming Response of chunks.
+
+    on_close runs exactly once: when the stream is exhausted, fails, or the
+    response is closed before (or without) being read.
+    """
+    closed = []
+
+    def close():
+        if not closed:
+            closed.append(True)
+            on_close()
+
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            close()
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+    response.call_on_close(close)
+    return response
+
+
+def csv_chunks(headers, rows):
+    """Yields headers and rows as CSV text, in chunks."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    def pieces():
+        writer.writerow(headers)
+        yield take()
+        for row in rows:
+            writer.writerow(row)
+            yield take()
+    return chunk_text(pieces())
+
+
+def _cursor_closer(conn, cursor, release):
+    """Returns a callback closing cursor and then handing conn to release."""
+    def on_close():
+        try:
+            cursor.close()
+        except psycopg2.Error:
+            # The transaction already failed; returning the connection rolls it back
+            pass
+        finally:
+            release(conn)
+    return on_close
+
+
+def stream_records(conn, cursor, stream_format, dumps, release, headers=None):
+    """Streams the rows of a named cursor as a JSON array or NDJSON.
+
+    release(conn) returns the connection to the pool once the cursor is closed.
+    """
+    on_close = _cursor_closer(conn, cursor, release)
+    records = iter_records(cursor)
+    if stream_format == 'ndjson':
+        return stream_response(ndjson_chunks(records, dumps), on_close, NDJSON_MIMETYPE, headers)
+    return stream_response(json_array_chunks(records, dumps), on_close, 'application/json', headers)
+
+
+def stream_csv(conn, cursor, headers, filename, release):
+    """Streams the rows of a named cursor as a CSV attachment.
+
+    release(conn) returns the connection to the pool once the cursor is closed.
+    """
+    return stream_response(
+        csv_chunks(headers, cursor), _cursor_closer(conn, cursor, release), 'text/csv',
+        {"Content-Disposition": f"attachment;filename={filename}"},
+    )
@@ -0,0 +1,260 @@
+"""Canonical rejection-reason taxonomy and classifier.
+
+Every known rejection reason has a stable small-integer code, a category (the
+production stage it belongs to) and a canonical spelling. ``classify_reason``
+maps free-text ``vqc_reason``/``ft_reason`` values onto that taxonomy regardless
+of case, spacing, punctuation or known misspellings.
+
+The codes are stored in the database, so never renumber an existing entry; add
+new reasons with new codes instead. Adding reasons or aliases is picked up by
+``reclassify_reasons``, which re-applies the taxonomy to every stored reason the
+next time the schema is applied or data is migrated.
+"""
+import hashlib
+import json
+import re
+from functools import lru_cache
+
+# Code for a non-empty reason that is not in the taxonomy
+UNCLASSIFIED_REASON_CODE = 0
+
+# (code, category, canonical reason)
+REJECTION_REASONS = [
+    (101, 'ASSEMBLY', 'BLACK GLUE'),
+    (102, 'ASSEMBLY', 'ULTRAHUMAN TEXT SMUDGED'),
+    (103, 'ASSEMBLY', 'WHITE PATCH ON BATTERY'),
+    (104, 'ASSEMBLY', 'WHITE PATCH ON BLACK TAPE'),
+    (105, 'ASSEMBLY', 'WHITE PATCH ON INSERT'),
+    (106, 'ASSEMBLY', 'WHITE PATCH ON PCB'),
+    (107, 'ASSEMBLY', 'WHITE PATCH ON TAPE NEAR BATTERY'),
+    (108, 'ASSEMBLY', 'WRONG RX COIL'),
+    (201, 'CASTING', 'MICRO BUBBLES'),
+    (202, 'CASTING', 'ALIGNMENT ISSUE'),
+    (203, 'CASTING', 'DENT ON RESIN'),
+    (204, 'CASTING', 'DUST INSIDE RESIN'),
+    (205, 'CASTING', 'RESIN CURING ISSUE'),
+    (206, 'CASTING', 'SHORT FILL OF RESIN'),
+    (207, 'CASTING', 'SPM REJECTION'),
+    (208, 'CASTING', 'TIGHT FIT FOR CHARGE'),
+    (209, 'CASTING', 'LOOSE FITTING ON CHARGER'),
+    (210, 'CASTING', 'RESIN SHRINKAGE'),
+    (211, 'CASTING', 'WRONG MOULD'),
+    (212, 'CASTING', 'GLOB TOP ISSUE'),
+    (301, 'FUNCTIONAL', '100% ISSUE'),
+    (302, 'FUNCTIONAL', '3 SENSOR ISSUE'),
+    (303, 'FUNCTIONAL', 'BATTERY ISSUE'),
+    (304, 'FUNCTIONAL', 'BLUETOOTH HEIGHT ISSUE'),
+    (305, 'FUNCTIONAL', 'CE TAPE ISSUE'),
+    (306, 'FUNCTIONAL', 'CHARGING CODE ISSUE'),
+    (307, 'FUNCTIONAL', 'COIL THICKNESS ISSUE/BATTERY THICKNESS'),
+    (308, 'FUNCTIONAL', 'COMPONENT HEIGHT ISSUE'),
+    (309, 'FUNCTIONAL', 'CURRENT ISSUE'),
+    (310, 'FUNCTIONAL', 'DISCONNECTING ISSUE'),
+    (311, 'FUNCTIONAL', 'HRS BUBBLE'),
+    (312, 'FUNCTIONAL', 'HRS COATING HEIGHT ISSUE'),
+    (313, 'FUNCTIONAL', 'HRS DOUBLE LIGHT ISSUE'),
+    (314, 'FUNCTIONAL', 'HRS HEIGHT ISSUE'),
+    (315, 'FUNCTIONAL', 'NO NOTIFICATION IN CDT'),
+    (316, 'FUNCTIONAL', 'NOT ADVERTISING (WINGLESS PCB)'),
+    (317, 'FUNCTIONAL', 'NOT CHARGING'),
+    (318, 'FUNCTIONAL', 'SENSOR ISSUE'),
+    (319, 'FUNCTIONAL', 'STC ISSUE'),
+    (320, 'FUNCTIONAL', 'R&D REJECTION'),
+    (401, 'POLISHING', 'IMPROPER RESIN FINISH'),
+    (402, 'POLISHING', 'RESIN DAMAGE'),
+    (403, 'POLISHING', 'RX COIL SCRATCH'),
+    (404, 'POLISHING', 'SCRATCHES ON RESIN'),
+    (405, 'POLISHING', 'SIDE SCRATCH'),
+    (406, 'POLISHING', 'SIDE SCRATCH (EMERY)'),
+    (407, 'POLISHING', 'SHELL COATING REMOVED'),
+    (408, 'POLISHING', 'UNEVEN POLISHING'),
+    (409, 'POLISHING', 'WHITE PATCH ON SHELL AFTER POLISHING'),
+    (410, 'POLISHING', 'SCRATCHES ON SHELL & SIDE SHELL'),
+    (501, 'SHELL', 'BLACK MARKS ON SHELL'),
+    (502, 'SHELL', 'DENT ON SHELL'),
+    (503, 'SHELL', 'DISCOLORATION'),
+    (504, 'SHELL', 'IRREGULAR SHELL SHAPE'),
+    (505, 'SHELL', 'SHELL COATING ISSUE'),
+    (506, 'SHELL', 'WHITE MARKS ON SHELL'),
+]
+
+# Known misspellings and variants, mapped to the canonical reason
+REASON_ALIASES = {
+    'GLOP TOP ISSUE': 'GLOB TOP ISSUE',
+}
+
+REJECTION_CATEGORIES = list(dict.fromkeys(category for _, category, _ in REJECTION_REASONS))
+REASONS_BY_CODE = {code: (category, reason) for code, category, reason in REJECTION_REASONS}
+
+_PUNCTUATION_RE = re.compile(r'[^A-Z0-9%&]+')
+_SYMBOL_SPACING_RE = re.compile(r' ?([&%]) ?')
+
+
+def normalize_reason(text):
+    """Returns the lookup key for a free-text reason: upper-cased, punctuation and spacing collapsed."""
+    if text is None:
+        return ''
+    key = _PUNCTUATION_RE.sub(' ', str(text).upper()).strip()
+    return _SYMBOL_SPACING_RE.sub(r'\1', key)
+
+
+_CODES_BY_KEY = {normalize_reason(reason): code for code, _, reason in REJECTION_REASONS}
+_CODES_BY_KEY.update({
+    normalize_reason(alias): _CODES_BY_KEY[normalize_reason(reason)] for alias, reason in REASON_ALIASES.items()
+})
+
+
+@lru_cache(maxsize=4096)
+def reason_code(text):
+    """Returns the taxonomy code for a free-text reason.
+
+    Empty reasons return None and reasons outside the taxonomy return
+    UNCLASSIFIED_REASON_CODE.
+    """
+    key = normalize_reason(text)
+    if not key:
+        return None
+    return _CODES_BY_KEY.get(key, UNCLASSIFIED_REASON_CODE)
+
+
+def classify_reason(text):
+    """Returns (category, canonical reason) for a free-text reason, or None if it is empty or unknown."""
+    return REASONS_BY_CODE.get(reason_code(text))
+
+
+def seed_rejection_reasons_sql():
+    """SQL that upserts the taxonomy into the rejection_reasons table."""
+    values = ",\n".join(
+        "({}, '{}', '{}')".format(code, category, reason.replace("'", "''"))
+        for code, category, reason in REJECTION_REASONS
+    )
+    return f"""
+        INSERT INTO rejection_reasons (code, category, reason) VALUES
+        {values}
+        ON CONFLICT (code) DO UPDATE SET category = EXCLUDED.category, reason = EXCLUDED.reason;
+    """
+
+
+# Unique on md5(raw_reason): free-text reasons can be longer than a btree entry allows
+REASON_LOOKUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS rejection_reason_lookup (raw_reason TEXT NOT NULL, code SMALLINT NOT NULL);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_rejection_reason_lookup_md5 ON rejection_reason_lookup (md5(raw_reason));
+"""
+
+
+def reason_codes_trigger_function_sql():
+    """SQL for the rings trigger function that copies each reason's code from rejection_reason_lookup."""
+    return """
+        CREATE OR REPLACE FUNCTION update_rings_reason_codes_trigger() RETURNS trigger AS $$
+        BEGIN
+            NEW.vqc_reason_code := (
+                SELECT code FROM rejection_reason_lookup WHERE md5(raw_reason) = md5(NEW.vqc_reason)
+            );
+            NEW.ft_reason_code := (
+                SELECT code FROM rejection_reason_lookup WHERE md5(raw_reason) = md5(NEW.ft_reason)
+            );
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+def taxonomy_fingerprint():
+    """Returns a hash of the taxonomy, which changes whenever a reason or alias does."""
+    key = json.dumps([REJECTION_REASONS, sorted(REASON_ALIASES.items())])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def reclassify_reasons(cursor):
+    """Re-applies the taxonomy to every classified reason if it changed since it was last applied.
+
+    Re-seeds rejection_reasons, updates the lookup entries whose code changed
+    (including reasons that were UNCLASSIFIED) and the reason codes of the rings
+    that use them. Returns the dates of those rings, or None when the taxonomy
+    is unchanged.
+    """
+    fingerprint = taxonomy_fingerprint()
+    cursor.execute("SELECT fingerprint FROM rejection_taxonomy_state FOR UPDATE")
+    row = cursor.fetchone()
+    if row and row[0] == fingerprint:
+        return None
+
+    cursor.execute(seed_rejection_reasons_sql())
+    cursor.execute("SELECT raw_reason, code FROM rejection_reason_lookup")
+    changed = []
+    for raw_reason, code in cursor.fetchall():
+        new_code = reason_code(raw_reason)
+        if new_code is not None and new_code != code:
+            changed.append((raw_reason, new_code))
+
+    dates = set()
+    if changed:
+        params = ([reason for reason, _ in changed], [code for _, code in changed])
+        cursor.execute("""
+            UPDATE rejection_reason_lookup l SET code = c.code
+            FROM unnest(%s::text[], %s::smallint[]) AS c(raw_reason, code)
+            WHERE md5(l.raw_reason) = md5(c.raw_reason)
+        """, params)
+        for column in ('vqc_reason', 'ft_reason'):
+            cursor.execute(f"""
+                UPDATE rings r SET {column}_code = c.code
+                FROM unnest(%s::text[], %s::smallint[]) AS c(raw_reason, code)
+                WHERE r.{column} = c.raw_reason
+                RETURNING r.date
+            """, params)
+            dates.update(row_date for (row_date,) in cursor.fetchall() if row_date is not None)
+
+    cursor.execute("""
+        INSERT INTO rejection_taxonomy_state (fingerprint) VALUES (%s)
+        ON CONFLICT (id) DO UPDATE SET fingerprint = EXCLUDED.fingerprint
+    """, (fingerprint,))
+    return sorted(dates)
+
+
+def sync_reason_lookup(cursor, reasons_sql, params=None):
+    """Classifies every raw reason returned by reasons_sql that is not in rejection_reason_lookup yet.
+
+    Returns the number of new lookup entries.
+    """
+    cursor.execute(f"""
+        SELECT DISTINCT raw.reason FROM ({reasons_sql}) AS raw(reason)
+        WHERE raw.reason IS NOT NULL AND BTRIM(raw.reason) <> ''
+          AND NOT EXISTS (SELECT 1 FROM rejection_reason_lookup l WHERE md5(l.raw_reason) = md5(raw.reason))
+    """, params)
+    entries = [(reason, reason_code(reason)) for (reason,) in cursor.fetchall()]
+    if entries:
+        cursor.execute("""
+            INSERT INTO rejection_reason_lookup (raw_reason, code)
+            SELECT * FROM unnest(%s::text[], %s::smallint[])
+            ON CONFLICT ((md5(raw_reason))) DO NOTHING
+        """, ([reason for reason, _ in entries], [code for _, code in entries]))
+    return len(entries)
+
+
+def backfill_reason_codes(cursor, dates=None):
+    """Classifies and stores reason codes for rings rows that do not have them yet.
+
+    Restricted to the given dates when provided. Returns the number of rows updated.
+    """
+    date_condition = "" if dates is None else " AND date = ANY(%(dates)s)"
+    params = {'dates': sorted(set(dates))} if dates is not None else {}
+    pending = """
+        (vqc_reason_code IS NULL AND BTRIM(COALESCE(vqc_reason, '')) <> '')
+        OR (ft_reason_code IS NULL AND BTRIM(COALESCE(ft_reason, '')) <> '')
+    """
+    sync_reason_lookup(cursor, f"""
+        SELECT vqc_reason FROM rings WHERE ({pending}){date_condition}
+        UNION
+        SELECT ft_reason FROM rings WHERE ({pending}){date_condition}
+    """, params)
+    cursor.execute(f"""
+        UPDATE rings SET
+            vqc_reason_code = (
+                SELECT code FROM rejection_reason_lookup WHERE md5(raw_reason) = md5(rings.vqc_reason)
+            ),
+            ft_reason_code = (
+                SELECT code FROM rejection_reason_lookup WHERE md5(raw_reason) = md5(rings.ft_reason)
+            )
+        WHERE ({pending}){date_condition}
+    """, params)
+    return cursor.rowcount
@@ -7,7 +7,12 @@ from unittest.mock import Mock, patch, MagicMock
 from app import create_app
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from app.aggregates import AGGREGATE_TABLES
+from app.dictionaries import FILTER_OPTION_TABLES
 from app.database import get_db_connection, return_db_connection
+from app.schema import apply_migrations
+from app.search_cache import clear_search_cache
+from app.serial_index import invalidate_serial_index
 
 @pytest.fixture(scope='session')
 def db_setup(postgresql_proc):
@@ -35,43 +40,9 @@ def db_setup(postgresql_proc):
     os.environ['DB_PASSWORD'] = password or ''
     os.environ['DB_NAME'] = 'test_rings_db'
 
-    # Now connect to the created database to create the schema
+    # Now connect to the created database and bring the schema up to date
     conn = psycopg2.connect(dbname='test_rings_db', user=user, password=password, host=host, port=port)
-    with conn.cursor() as cursor:
-        create_table_sql = """
-        CREATE TABLE rings (
-            id SERIAL PRIMARY KEY, date DATE, mo_number VARCHAR(50), vendor VARCHAR(50),
-            serial_number VARCHAR(100) UNIQUE, ring_size VARCHAR(100), sku VARCHAR(50),
-            vqc_status VARCHAR(100), vqc_reason TEXT, ft_status VARCHAR(100), ft_reason TEXT,
-            reason_tsvector TSVECTOR, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        CREATE INDEX idx_serial_number ON rings(serial_number);
-        CREATE INDEX idx_vendor ON rings(vendor);
-        CREATE INDEX idx_date_desc ON rings(date DESC);
-        """
-        cursor.execute(create_table_sql)
-
-        optimized_indexes_sql = """
-        CREATE INDEX idx_rings_composite ON rings(vendor, vqc_status, ft_status);
-        CREATE INDEX idx_rings_text_search ON rings USING GIN(reason_tsvector);
-        """
-        cursor.execute(optimized_indexes_sql)
-
-        tsvector_trigger_sql = """
-        CREATE OR REPLACE FUNCTION update_rings_tsvector_trigger() RETURNS trigger AS $$
-        BEGIN
-            NEW.reason_tsvector :=
-                to_tsvector('english', COALESCE(NEW.vqc_reason, '') || ' ' || COALESCE(NEW.ft_reason, ''));
-            RETURN NEW;
-        END;
-        $$ LANGUAGE plpgsql;
-
-        CREATE TRIGGER tsvectorupdate BEFORE INSERT OR UPDATE
-        ON rings FOR EACH ROW EXECUTE PROCEDURE update_rings_tsvector_trigger();
-        """
-        cursor.execute(tsvector_trigger_sql)
-    conn.commit()
+    apply_migrations(conn)
     conn.close()
 
     yield
@@ -111,7 +82,7 @@ def seed_db(app):
         try:
             with conn.cursor() as cursor:
                 # Clear the table first to ensure a clean state
-                cursor.execute("TRUNCATE TABLE rings RESTART IDENTITY")
+                cursor.execute(f"TRUNCATE TABLE rings, {', '.join(AGGREGATE_TABLES + FILTER_OPTION_TABLES)} RESTART IDENTITY")
                 
                 # Insert sample data
                 insert_query = """
@@ -124,6 +95,9 @@ def seed_db(app):
             conn.commit()
         finally:
             return_db_connection(conn)
+    # Rows written directly do not bump the data version
+    clear_search_cache()
+    invalidate_serial_index()
     
     yield # Test runs here
 
@@ -132,10 +106,63 @@ def seed_db(app):
         conn = get_db_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("TRUNCATE TABLE rings RESTART IDENTITY")
+                cursor.execute(f"TRUNCATE TABLE rings, {', '.join(AGGREGATE_TABLES + FILTER_OPTION_TABLES)} RESTART IDENTITY")
             conn.commit()
         finally:
             return_db_connection(conn)
+    clear_search_cache()
+    invalidate_serial_index()
+
+
+@pytest.fixture
+def db_execute(app):
+    """Returns execute(sql, params=None, autocommit=False), which runs SQL on its own pooled connection.
+
+    The statements are committed; the rows of the last one are returned, or None
+    when it returns no rows. autocommit=True runs statements that cannot run in a
+    transaction, such as VACUUM.
+    """
+    def execute(sql, params=None, autocommit=False):
+        with app.app_context():
+            conn = get_db_connection()
+            try:
+                conn.autocommit = autocommit
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall() if cursor.description else None
+                conn.commit()
+                return rows
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = False
+                return_db_connection(conn)
+    return execute
+
+
+@pytest.fixture
+def db_explain(app):
+    """Returns explain(query, params=None, setup_sql=None), the EXPLAIN output of a query as one string.
+
+    Sequential scans are disabled, since the test tables are tiny; setup_sql runs
+    first in the same transaction, and everything is rolled back.
+    """
+    def explain(query, params=None, setup_sql=None):
+        with app.app_context():
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    if setup_sql:
+                        cursor.execute(setup_sql)
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                    cursor.execute("EXPLAIN " + query, params)
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                conn.rollback()
+                return plan
+            finally:
+                return_db_connection(conn)
+    return explain
 
 
 @pytest.fixture
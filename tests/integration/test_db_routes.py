@@ -2,10 +2,12 @@
 Integration tests for database routes.
 """
 import json
+import os
 import pytest
 from unittest.mock import patch, Mock, MagicMock
 import psycopg2
 
+
 @pytest.mark.integration
 class TestDatabaseRoutes:
     """Test database route endpoints."""
@@ -107,4 +109,409 @@ class TestDatabaseRoutes:
             
             assert response.status_code == 500
             data = json.loads(response.data)
-            assert data['status'] == 'error'
\ No newline at end of file
+            assert data['status'] == 'error'
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSchemaIndexes:
+    """Test that the planner picks the query-shaped indexes."""
+
+    def test_schema_drops_duplicate_serial_index(self, client, db_execute):
+        """The plain serial index duplicated the UNIQUE constraint's index."""
+        response = client.post('/api/db/schema')
+        assert response.status_code == 200
+
+        indexes = {row[0] for row in db_execute("SELECT indexname FROM pg_indexes WHERE tablename = 'rings'")}
+
+        assert 'idx_serial_number' not in indexes
+        assert 'rings_serial_number_key' in indexes
+
+    def test_serial_search_uses_expression_index(self, client, db_explain):
+        client.post('/api/db/schema')
+        plan = db_explain("SELECT * FROM rings WHERE UPPER(serial_number) = ANY(%s)", (['ABC123'],))
+        assert 'idx_rings_serial_upper_pattern' in plan
+
+    def test_mo_search_uses_expression_index(self, client, db_explain):
+        client.post('/api/db/schema')
+        plan = db_explain("SELECT * FROM rings WHERE UPPER(mo_number) = ANY(%s)", (['MO001'],))
+        assert 'idx_rings_mo_upper_pattern' in plan
+
+    def test_prefix_search_uses_pattern_index(self, client, db_explain):
+        client.post('/api/db/schema')
+        plan = db_explain("SELECT * FROM rings WHERE UPPER(serial_number) LIKE %s", ('ABC%',))
+        assert 'idx_rings_serial_upper_pattern' in plan
+
+    @pytest.mark.parametrize('field, index', [
+        ('serial', 'idx_rings_serial_upper_pattern'), ('mo', 'idx_rings_mo_upper_pattern'),
+    ])
+    def test_autocomplete_reads_pattern_index_in_order(self, client, field, index, db_explain):
+        from app.autocomplete import prefix_suggestions_sql
+        client.post('/api/db/schema')
+        plan = db_explain(prefix_suggestions_sql(field), ('ABC%', 10))
+        assert index in plan
+        # Matches come back in index order, so nothing has to be sorted
+        assert 'Sort' not in plan
+
+    def test_daily_report_uses_covering_index(self, client, seed_db, db_execute, db_explain):
+        client.post('/api/db/schema')
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, ft_status)
+            SELECT DATE '2024-01-01' + (i % 31), 'IHC', 'SN' || i, 'ACCEPTED', 'PASS'
+            FROM generate_series(1, 5000) AS i
+        """)
+        # Index-only scans need an up to date visibility map
+        db_execute("VACUUM ANALYZE rings", autocommit=True)
+
+        plan = db_explain(
+            "SELECT vendor, vqc_status, ft_status FROM rings WHERE date = %s AND vendor = %s",
+            ('2024-01-15', 'IHC')
+        )
+        assert 'Index Only Scan using idx_rings_date_vendor' in plan
+
+    def test_covering_index_leaves_out_reasons(self, client, db_execute):
+        client.post('/api/db/schema')
+        indexes = dict(db_execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'rings'"))
+
+        assert 'reason' not in indexes['idx_rings_date_vendor']
+
+    def test_long_reasons_can_be_stored(self, client, seed_db, db_execute):
+        client.post('/api/db/schema')
+        # Random text, so it stays too long for a btree entry after compression
+        reason = os.urandom(4000).hex().upper()
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_status, ft_reason)
+            VALUES ('2024-01-15', 'IHC', 'LONG1', 'REJECTED', %s, 'FAIL', %s)
+        """, (reason, reason))
+
+        response = client.post('/api/search', json={'serialNumbers': 'LONG1'})
+        assert json.loads(response.data)[0]['vqc_reason'] == reason
+
+    def test_rejection_trends_use_partial_indexes(self, client, db_explain):
+        client.post('/api/db/schema')
+        plan = db_explain("""
+            SELECT date, vqc_status, vqc_reason, ft_status, ft_reason
+            FROM rings
+            WHERE date BETWEEN %s AND %s AND vendor = %s
+            AND (
+                (vqc_status IS NOT NULL AND UPPER(vqc_status) NOT IN ('ACCEPTED', 'PASS', '')) OR
+                (ft_status IS NOT NULL AND UPPER(ft_status) NOT IN ('ACCEPTED', 'PASS', ''))
+            )
+        """, ('2024-01-01', '2024-01-31', 'IHC'), setup_sql="""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, ft_status)
+            SELECT DATE '2024-01-01' + (i % 31), 'IHC', 'SN' || i,
+                   CASE WHEN i % 100 = 0 THEN 'REJECTED' ELSE 'ACCEPTED' END,
+                   CASE WHEN i % 150 = 0 THEN 'FAIL' ELSE 'PASS' END
+            FROM generate_series(1, 5000) AS i;
+            ANALYZE rings;
+        """)
+        assert 'BitmapOr' in plan
+        assert 'idx_rings_vqc_rejected' in plan
+        assert 'idx_rings_ft_rejected' in plan
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSchemaMigrations:
+    """Test versioned, non-destructive schema migrations."""
+
+    def test_schema_keeps_existing_data(self, client, seed_db):
+        """Applying migrations on a populated table must not wipe it."""
+        response = client.post('/api/db/schema')
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['status'] == 'success'
+        assert data['applied'] == []
+        assert len(json.loads(client.get('/api/data').data)) == 2
+
+    def test_schema_status_reports_latest_version(self, client):
+        from app.schema import LATEST_SCHEMA_VERSION
+        client.post('/api/db/schema')
+
+        response = client.get('/api/db/schema')
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['version'] == LATEST_SCHEMA_VERSION
+        assert data['latestVersion'] == LATEST_SCHEMA_VERSION
+        assert data['pending'] == []
+        assert [m['version'] for m in data['applied']] == list(range(1, LATEST_SCHEMA_VERSION + 1))
+
+    def test_schema_reset_recreates_empty_schema(self, client, seed_db):
+        from app.schema import LATEST_SCHEMA_VERSION
+        response = client.post('/api/db/schema', json={'reset': True})
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['version'] == LATEST_SCHEMA_VERSION
+        assert len(json.loads(client.get('/api/data').data)) == 0
+
+    def test_pending_migration_applies_incrementally(self, client, seed_db, db_execute):
+        """Rolling back the recorded version re-runs only that migration, keeping the rows."""
+        db_execute("DELETE FROM schema_migrations WHERE version = 2")
+        db_execute("DROP INDEX idx_rings_ft_rejected")
+
+        response = client.post('/api/db/schema')
+
+        data = json.loads(response.data)
+        assert data['applied'] == [2]
+        assert any('concurrently' in line for line in data['logs'])
+        assert db_execute("SELECT COUNT(*) FROM rings")[0][0] == 2
+        assert db_execute("SELECT to_regclass('idx_rings_ft_rejected') IS NOT NULL")[0][0]
+
+    def test_index_migrations_run_over_long_reasons(self, client, seed_db, db_execute):
+        # Random text, so it stays too long for a btree entry after compression
+        reason = os.urandom(4000).hex().upper()
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason)
+            VALUES ('2024-01-15', 'IHC', 'LONG1', 'REJECTED', %s)
+        """, (reason,))
+        db_execute("""
+            DROP INDEX idx_rings_date_vendor;
+            DROP INDEX idx_rings_final_rejected;
+            DELETE FROM schema_migrations WHERE version IN (2, 5);
+        """)
+
+        response = client.post('/api/db/schema')
+
+        assert json.loads(response.data)['applied'] == [2, 5]
+        assert db_execute("""
+            SELECT to_regclass('idx_rings_date_vendor') IS NOT NULL AND to_regclass('idx_rings_final_rejected') IS NOT NULL
+        """)[0][0]
+
+    def test_invalid_index_is_rebuilt(self, client, db_execute):
+        """An index left INVALID by an interrupted concurrent build is dropped and rebuilt."""
+        db_execute("""
+            UPDATE pg_index SET indisvalid = false
+            WHERE indexrelid = 'idx_rings_vqc_rejected'::regclass
+        """)
+        db_execute("DELETE FROM schema_migrations WHERE version = 2")
+
+        response = client.post('/api/db/schema')
+
+        data = json.loads(response.data)
+        assert any('invalid index idx_rings_vqc_rejected' in line for line in data['logs'])
+        assert db_execute("""
+            SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_rings_vqc_rejected'::regclass
+        """)[0][0] is True
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestPartitioning:
+    """Test the monthly range-partitioned layout of the rings table."""
+
+    @pytest.fixture
+    def partitioned(self, client, seed_db):
+        response = client.post('/api/db/schema', json={'partitioned': True})
+        assert response.status_code == 200
+        yield json.loads(response.data)
+        # Put the shared test database back to the ordinary layout
+        client.post('/api/db/schema', json={'reset': True})
+
+    def test_conversion_keeps_rows(self, client, partitioned, db_execute):
+        assert partitioned['partitioned'] is True
+        assert db_execute("SELECT tableoid::regclass::text, serial_number FROM rings ORDER BY id") == [
+            ('rings_y2024m01', 'ABC123'), ('rings_y2024m01', 'IHC001')
+        ]
+
+        response = client.post('/api/reports/daily', json={'date': '2024-01-15', 'vendor': 'all'})
+        assert json.loads(response.data)['totalReceived'] == 2
+
+    def test_conversion_carries_over_indexes_and_triggers(self, client, partitioned, db_execute):
+        indexes = {row[0] for row in db_execute("SELECT indexname FROM pg_indexes WHERE tablename = 'rings'")}
+        assert {'idx_rings_serial_number', 'idx_rings_serial_upper_pattern', 'idx_rings_date_vendor'} <= indexes
+
+        db_execute("UPDATE rings SET vqc_reason = 'BLACK GLUE' WHERE serial_number = 'ABC123' RETURNING id")
+        assert db_execute("SELECT reason_tsvector::text FROM rings WHERE serial_number = 'ABC123'") == [
+            ("'black':1 'glue':2",)
+        ]
+
+    def test_concurrent_index_migration_on_partitioned_table(self, client, partitioned, db_execute):
+        """Index migrations build per-partition indexes concurrently and attach them to the parent."""
+        db_execute("DROP INDEX idx_rings_ft_rejected; DELETE FROM schema_migrations WHERE version = 2; SELECT 1")
+
+        response = client.post('/api/db/schema')
+
+        assert json.loads(response.data)['applied'] == [2]
+        assert db_execute("""
+            SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_rings_vqc_rejected'::regclass
+        """) == [(True,)]
+        assert db_execute("SELECT to_regclass('rings_y2024m01_idx_rings_ft_rejected') IS NOT NULL") == [(True,)]
+
+    def test_upcoming_partitions_are_created(self, client, partitioned):
+        from datetime import date
+        from app.partitions import next_month, partition_name
+        upcoming = partition_name(next_month(date.today()))
+
+        response = client.get('/api/db/partitions')
+
+        names = [p['name'] for p in json.loads(response.data)['partitions']]
+        assert 'rings_default' in names
+        assert upcoming in names
+
+    def test_date_filter_prunes_partitions(self, client, partitioned, db_execute):
+        plan = "\n".join(row[0] for row in db_execute(
+            "EXPLAIN SELECT * FROM rings WHERE date BETWEEN %s AND %s", ('2024-01-01', '2024-01-31')
+        ))
+        assert 'rings_y2024m01' in plan
+        assert 'rings_y2024m02' not in plan
+        assert 'rings_default' not in plan
+
+    def test_migration_upsert_moves_rows_between_partitions(
+            self, client, partitioned, google_config, mock_gspread, db_execute):
+        mock_gc, _, _ = mock_gspread
+        with patch('app.routes.data_routes.Credentials.from_service_account_info'), \
+             patch('app.routes.data_routes.gspread.authorize', return_value=mock_gc), \
+             patch('app.routes.data_routes.load_sheets_data_parallel') as mock_load, \
+             patch('app.routes.data_routes.merge_ring_data_fast') as mock_merge:
+            mock_load.return_value = ([], {}, [], [])
+            mock_merge.return_value = ([
+                {'date': '2024-03-10', 'serial_number': 'ABC123', 'vendor': '3DE TECH', 'vqc_status': 'ACCEPTED'},
+                {'date': '2024-03-10', 'serial_number': 'NEW001', 'vendor': 'IHC', 'vqc_status': 'ACCEPTED'},
+            ], [])
+
+            response = client.post('/api/migrate', json=google_config)
+            response_text = response.data.decode('utf-8')
+
+        assert 'Migration completed successfully' in response_text
+        assert db_execute("SELECT tableoid::regclass::text, serial_number FROM rings ORDER BY serial_number") == [
+            ('rings_y2024m03', 'ABC123'), ('rings_y2024m01', 'IHC001'), ('rings_y2024m03', 'NEW001')
+        ]
+
+    def test_detach_old_partitions(self, client, partitioned, db_execute):
+        response = client.post('/api/db/partitions/detach', json={'before': '2024-02-01'})
+
+        assert response.status_code == 200
+        assert json.loads(response.data)['detached'] == ['rings_y2024m01']
+        assert db_execute("SELECT COUNT(*) FROM rings") == [(0,)]
+        assert db_execute("SELECT COUNT(*) FROM rings_y2024m01") == [(2,)]
+        # Only the detached month held these values
+        assert json.loads(client.get('/api/search/filters').data)['vendors'] == []
+        db_execute("DROP TABLE rings_y2024m01; SELECT 1")
+
+    def test_detach_drops_aggregates_of_detached_months(self, client, partitioned, db_execute):
+        response = client.post('/api/reports/daily', json={'date': '2024-01-15', 'vendor': 'all'})
+        assert json.loads(response.data)['totalReceived'] == 2
+        assert db_execute("SELECT COUNT(*) FROM rings_report_cache") == [(1,)]
+
+        client.post('/api/db/partitions/detach', json={'before': '2024-02-01', 'drop': True})
+
+        for table in ('rings_daily_stats', 'rings_rejection_facts', 'rings_aggregate_dates', 'rings_report_cache'):
+            assert db_execute(f"SELECT COUNT(*) FROM {table}") == [(0,)]
+        response = client.post('/api/reports/daily', json={'date': '2024-01-15', 'vendor': 'all'})
+        assert json.loads(response.data)['totalReceived'] == 0
+
+    def test_detach_requires_partitioned_table(self, client):
+        response = client.post('/api/db/partitions/detach', json={'before': '2024-02-01'})
+
+        assert response.status_code == 400
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestFinalStatusColumns:
+    """Test the final_status, final_stage and final_reason columns kept by the rings trigger."""
+
+    def test_final_columns_set_on_insert(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_status, ft_reason)
+            VALUES
+                ('2024-01-16', 'IHC', 'F1', '', '', '', ''),
+                ('2024-01-16', 'IHC', 'F2', 'REJECTED', ' BLACK GLUE ', '', ''),
+                ('2024-01-16', 'IHC', 'F3', 'ACCEPTED', '', 'FAIL', 'SENSOR ISSUE'),
+                ('2024-01-16', 'IHC', 'F4', 'REJECTED', 'BLACK GLUE', 'pass', ''),
+                ('2024-01-16', 'IHC', 'F5', NULL, NULL, 'FAIL', 'NOT CHARGING')
+        """)
+
+        assert db_execute("""
+            SELECT serial_number, final_status, final_stage, final_reason
+            FROM rings WHERE date = '2024-01-16' ORDER BY serial_number
+        """) == [
+            ('F1', 'Pending', 'VQC', ''),
+            ('F2', 'Rejected', 'VQC', 'BLACK GLUE'),
+            ('F3', 'Rejected', 'FT', 'SENSOR ISSUE'),
+            ('F4', 'Accepted', 'FT', ''),
+            ('F5', 'Rejected', 'FT', 'NOT CHARGING'),
+        ]
+
+    def test_final_columns_follow_updates(self, seed_db, db_execute):
+        db_execute("UPDATE rings SET ft_status = 'FAIL', ft_reason = 'BATTERY ISSUE' WHERE serial_number = 'ABC123'")
+
+        assert db_execute("""
+            SELECT final_status, final_stage, final_reason FROM rings WHERE serial_number = 'ABC123'
+        """) == [('Rejected', 'FT', 'BATTERY ISSUE')]
+
+    def test_migration_backfills_existing_rows(self, client, seed_db, db_execute):
+        db_execute("""
+            ALTER TABLE rings DISABLE TRIGGER finalstatusupdate;
+            UPDATE rings SET final_status = NULL, final_stage = NULL, final_reason = NULL;
+            ALTER TABLE rings ENABLE TRIGGER finalstatusupdate;
+            DELETE FROM schema_migrations WHERE version = 5;
+        """)
+
+        response = client.post('/api/db/schema')
+
+        assert json.loads(response.data)['applied'] == [5]
+        assert db_execute("SELECT serial_number, final_status FROM rings ORDER BY serial_number") == [
+            ('ABC123', 'Accepted'), ('IHC001', 'Rejected')
+        ]
+
+    def test_daily_export_uses_final_status(self, client, seed_db, db_execute):
+        db_execute("INSERT INTO rings (date, vendor, serial_number) VALUES ('2024-01-15', 'IHC', 'PEND01')")
+
+        response = client.post('/api/reports/export', json={'date': '2024-01-15', 'vendor': 'all', 'format': 'csv'})
+
+        rows = {line.split(',')[2]: line.split(',')[10] for line in response.data.decode('utf-8').splitlines()[1:]}
+        assert rows == {'ABC123': 'Accepted', 'IHC001': 'Rejected', 'PEND01': 'Pending'}
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestDictionaryEncoding:
+    """Test the vendor and status filter option dictionaries kept by the rings trigger."""
+
+    def test_values_added_on_insert(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, ft_status)
+            VALUES ('2024-01-16', 'IHC', 'D1', 'REJECTED', NULL), ('2024-01-16', 'NEW VENDOR', 'D2', 'ACCEPTED', 'PASS')
+        """)
+
+        assert db_execute("SELECT name FROM ring_vendors ORDER BY name") == [('3DE TECH',), ('IHC',), ('NEW VENDOR',)]
+        assert db_execute("SELECT name FROM ring_ft_statuses ORDER BY name") == [('FAIL',), ('PASS',)]
+
+    def test_values_added_on_update(self, seed_db, db_execute):
+        db_execute("UPDATE rings SET vendor = 'MAKENICA' WHERE serial_number = 'ABC123'")
+
+        assert db_execute("SELECT name FROM ring_vendors WHERE name = 'MAKENICA'") == [('MAKENICA',)]
+
+    def test_migration_backfills_existing_rows(self, client, seed_db, db_execute):
+        db_execute("""
+            TRUNCATE ring_vendors, ring_vqc_statuses, ring_ft_statuses;
+            DELETE FROM schema_migrations WHERE version = 7;
+        """)
+
+        response = client.post('/api/db/schema')
+
+        assert json.loads(response.data)['applied'] == [7]
+        assert db_execute("SELECT name FROM ring_vendors ORDER BY name") == [('3DE TECH',), ('IHC',)]
+        assert db_execute("SELECT name FROM ring_vqc_statuses ORDER BY name") == [('ACCEPTED',), ('REJECTED',)]
+        assert db_execute("SELECT to_regclass('idx_rings_composite') IS NOT NULL")[0][0]
+
+    def test_search_filters_come_from_dictionaries(self, client, seed_db):
+        data = json.loads(client.get('/api/search/filters').data)
+
+        assert data['vendors'] == ['3DE TECH', 'IHC']
+        assert data['vqc_statuses'] == ['ACCEPTED', 'REJECTED']
+        assert data['ft_statuses'] == ['FAIL', 'PASS']
+
+    def test_search_by_vendor_and_status_strings(self, client, seed_db):
+        response = client.post('/api/search', json={'vendor': ['IHC'], 'ftStatus': ['FAIL']})
+
+        assert [row['serial_number'] for row in json.loads(response.data)] == ['IHC001']
+
+    def test_clear_empties_dictionaries(self, app, client, seed_db):
+        client.delete('/api/db/clear')
+
+        assert json.loads(client.get('/api/search/filters').data)['vendors'] == []
@@ -0,0 +1,123 @@
+"""
+Integration tests for asynchronous export jobs.
+"""
+import csv
+import io
+import json
+import time
+import pytest
+from openpyxl import load_workbook
+
+
+@pytest.fixture
+def artifact_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr('app.export_jobs.EXPORT_ARTIFACT_DIR', str(tmp_path))
+    return tmp_path
+
+
+def _wait_for_job(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = json.loads(client.get(f'/api/exports/{job_id}').data)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'Export job {job_id} did not finish')
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestExportJobs:
+    """Test the export job submit, poll and download cycle."""
+
+    def test_search_export_job(self, client, seed_db, artifact_dir):
+        response = client.post('/api/exports', json={'type': 'search', 'filters': {'vendor': ['IHC']}})
+
+        assert response.status_code == 202
+        job = json.loads(response.data)
+        assert job['status'] in ('pending', 'running', 'done')
+        assert response.headers['Location'].endswith(f"/api/exports/{job['jobId']}")
+
+        job = _wait_for_job(client, job['jobId'])
+        assert job['status'] == 'done'
+        assert job['downloadUrl'] == f"/api/exports/{job['jobId']}/download"
+
+        download = client.get(job['downloadUrl'])
+        assert download.status_code == 200
+        assert 'search_results.csv' in download.headers['Content-Disposition']
+        rows = list(csv.reader(io.StringIO(download.data.decode('utf-8'))))
+        download.close()
+        assert rows[0][3] == 'serial_number'
+        assert [row[3] for row in rows[1:]] == ['IHC001']
+        assert job['size'] == len(download.data)
+
+    def test_rejection_trends_export_job(self, client, seed_db, artifact_dir):
+        response = client.post('/api/exports', json={
+            'type': 'rejection-trends', 'format': 'excel',
+            'filters': {'dateFrom': '2024-01-15', 'dateTo': '2024-01-16', 'vendor': 'all'},
+        })
+        job = _wait_for_job(client, json.loads(response.data)['jobId'])
+
+        assert job['status'] == 'done'
+        assert job['filename'] == 'rejection_trends_2024-01-15_to_2024-01-16_all.xlsx'
+        download = client.get(job['downloadUrl'])
+        worksheet = load_workbook(io.BytesIO(download.data)).active
+        download.close()
+        assert worksheet['A1'].value == 'Stage'
+        assert worksheet['C1'].value == '15-Jan-2024'
+
+    def test_identical_requests_share_a_job(self, client, seed_db, artifact_dir):
+        filters = {'serialNumbers': 'abc123, ihc001', 'dateFrom': '2024-01-01'}
+        first = json.loads(client.post('/api/exports', json={'type': 'search', 'filters': filters}).data)
+        # Same export spelled differently
+        same = {'serialNumbers': 'ABC123,IHC001', 'dateFrom': '2024-01-01T00:00:00'}
+        second = json.loads(client.post('/api/exports', json={'type': 'search', 'filters': same}).data)
+        other = json.loads(client.post('/api/exports', json={'type': 'search', 'filters': {}}).data)
+
+        assert first['jobId'] == second['jobId']
+        assert other['jobId'] != first['jobId']
+        _wait_for_job(client, first['jobId'])
+        _wait_for_job(client, other['jobId'])
+        assert len(list(artifact_dir.glob('*.artifact'))) == 2
+
+    def test_expired_jobs_are_removed(self, client, seed_db, artifact_dir, monkeypatch):
+        job = json.loads(client.post('/api/exports', json={'type': 'search', 'filters': {}}).data)
+        _wait_for_job(client, job['jobId'])
+
+        monkeypatch.setattr('app.export_jobs.time.time', lambda: time.monotonic() + 10 ** 10)
+
+        assert client.get(f"/api/exports/{job['jobId']}").status_code == 404
+        assert list(artifact_dir.iterdir()) == []
+
+    def test_failed_job_reports_error(self, client, seed_db, artifact_dir, monkeypatch):
+        import psycopg2
+        from app.routes import export_routes
+
+        def broken_cursor(*args, **kwargs):
+            raise psycopg2.OperationalError('database went away')
+        monkeypatch.setattr(export_routes, 'open_server_cursor', broken_cursor)
+
+        job = json.loads(client.post('/api/exports', json={'type': 'search', 'filters': {}}).data)
+        job = _wait_for_job(client, job['jobId'])
+
+        assert job['status'] == 'failed'
+        assert 'database went away' in job['error']
+        assert client.get(f"/api/exports/{job['jobId']}/download").status_code == 409
+
+    def test_invalid_requests(self, client, artifact_dir):
+        assert client.post('/api/exports', json={'type': 'pdf'}).status_code == 400
+        assert client.post('/api/exports', json={'type': 'search', 'format': 'excel'}).status_code == 400
+        assert client.post('/api/exports', json={'type': 'search', 'filters': {'dateFrom': 'soon'}}).status_code == 400
+        response = client.post('/api/exports', json={'type': 'rejection-trends', 'filters': {'vendor': 'all'}})
+        assert response.status_code == 400
+        assert client.get('/api/exports/unknown').status_code == 404
+
+    def test_data_change_starts_a_new_job(self, client, seed_db, artifact_dir):
+        first = json.loads(client.post('/api/exports', json={'type': 'search', 'filters': {}}).data)
+        _wait_for_job(client, first['jobId'])
+
+        client.delete('/api/db/clear')
+        second = json.loads(client.post('/api/exports', json={'type': 'search', 'filters': {}}).data)
+
+        assert second['jobId'] != first['jobId']
+        _wait_for_job(client, second['jobId'])
@@ -1,12 +1,18 @@
 """
 Integration tests for report routes.
 """
+import csv
+import io
 import json
+import os
+import re
+import time
 import pytest
 from unittest.mock import patch, Mock
 from datetime import datetime
 import psycopg2
 
+
 @pytest.mark.integration
 class TestDailyReport:
     """Test daily report functionality."""
@@ -96,6 +102,7 @@ class TestDailyReport:
             data = json.loads(response.data)
             assert 'error' in data
 
+
 @pytest.mark.integration
 class TestDailyReportExport:
     """Test daily report export functionality."""
@@ -115,6 +122,32 @@ class TestDailyReportExport:
         assert response.status_code == 200
         assert 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' in response.headers['Content-Type']
     
+    def test_export_daily_report_excel_rows(self, client, seed_db):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        response = client.post('/api/reports/export', json={'date': '2024-01-15', 'vendor': 'all', 'format': 'excel'})
+
+        worksheet = load_workbook(BytesIO(response.data))['Daily Report']
+        rows = list(worksheet.iter_rows(values_only=True))
+        assert rows[0][:3] == ('Date', 'Vendor', 'Serial Number')
+        assert sorted(row[2] for row in rows[1:]) == ['ABC123', 'IHC001']
+        assert worksheet.column_dimensions['C'].width == len('Serial Number') + 2
+
+    def test_export_daily_report_csv_is_streamed(self, client, seed_db):
+        """Test the CSV export streams every row and returns its connection."""
+        from app import database
+        used = len(database.db_pool._used)
+
+        response = client.post('/api/reports/export', json={'date': '2024-01-15', 'vendor': 'all', 'format': 'csv'})
+
+        assert response.status_code == 200
+        assert response.is_streamed
+        rows = list(csv.reader(io.StringIO(response.data.decode('utf-8'))))
+        assert rows[0][:3] == ['Date', 'Vendor', 'Serial Number']
+        assert sorted(row[2] for row in rows[1:]) == ['ABC123', 'IHC001']
+        response.close()
+        assert len(database.db_pool._used) == used
+
     def test_export_daily_report_invalid_format(self, client):
         """Test export with invalid format."""
         export_config = {
@@ -131,6 +164,7 @@ class TestDailyReportExport:
         data = json.loads(response.data)
         assert 'Invalid export format' in data['error']
 
+
 @pytest.mark.integration
 class TestRejectionTrends:
     """Test rejection trends report functionality."""
@@ -220,6 +254,7 @@ class TestRejectionTrends:
             data = json.loads(response.data)
             assert 'error' in data
 
+
 @pytest.mark.integration
 class TestRejectionTrendsExport:
     """Test rejection trends export functionality."""
@@ -258,6 +293,7 @@ class TestRejectionTrendsExport:
         assert response.status_code == 200
         assert 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' in response.headers['Content-Type']
 
+
 @pytest.mark.integration
 class TestReportBusinessLogic:
     """Test business logic in reports."""
@@ -312,4 +348,568 @@ class TestReportBusinessLogic:
         assert response.headers['Content-Type'] == 'text/csv; charset=utf-8'
         
         csv_content = response.data.decode('utf-8')
-        assert 'ABC123' in csv_content
\ No newline at end of file
+        assert 'ABC123' in csv_content
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestDailyStatsAggregate:
+    """Test the pre-aggregated rings_daily_stats table behind the daily report."""
+
+    @pytest.fixture
+    def mixed_day(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_status, ft_reason, created_at)
+            VALUES
+                ('2024-02-01', 'IHC', 'S1', 'ACCEPTED', '', 'PASS', '', '2024-02-01 09:10'),
+                ('2024-02-01', 'IHC', 'S2', 'REJECTED', 'BLACK GLUE', '', '', '2024-02-01 09:20'),
+                ('2024-02-01', 'IHC', 'S3', 'ACCEPTED', '', 'FAIL', 'SENSOR ISSUE', '2024-02-01 10:05'),
+                ('2024-02-01', 'MAKENICA', 'S4', '', '', '', '', '2024-02-01 10:30'),
+                ('2024-02-01', 'MAKENICA', 'S5', 'REJECTED', 'BLACK GLUE', '', '', '2024-02-01 11:00'),
+                ('2024-02-02', 'IHC', 'S6', 'ACCEPTED', '', '', '', '2024-02-02 08:00')
+        """)
+
+    def test_daily_report_from_aggregates(self, client, mixed_day):
+        response = client.post('/api/reports/daily', json={'date': '2024-02-01', 'vendor': 'all'})
+
+        data = json.loads(response.data)
+        assert data['totalReceived'] == 5
+        assert data['totalAccepted'] == 1
+        assert data['totalRejected'] == 3
+        assert data['totalPending'] == 1
+        assert data['yield'] == 25.0
+        assert data['vqcBreakdown'] == {
+            'accepted': 2, 'rejected': 2, 'pending': 1,
+            'rejectionReasons': [{'reason': 'BLACK GLUE', 'count': 2, 'percentage': 100.0}]
+        }
+        assert data['ftBreakdown'] == {
+            'accepted': 1, 'rejected': 1, 'pending': 3,
+            'rejectionReasons': [{'reason': 'SENSOR ISSUE', 'count': 1, 'percentage': 100.0}]
+        }
+        assert data['hourlyData'] == [
+            {'hour': '09:00', 'received': 2, 'accepted': 1, 'rejected': 1, 'pending': 0},
+            {'hour': '10:00', 'received': 2, 'accepted': 0, 'rejected': 1, 'pending': 1},
+            {'hour': '11:00', 'received': 1, 'accepted': 0, 'rejected': 1, 'pending': 0},
+        ]
+        assert {v['vendor']: v['totalReceived'] for v in data['vendorBreakdown']} == {'IHC': 3, 'MAKENICA': 2}
+
+    def test_report_backfills_missing_dates_once(self, client, mixed_day, db_execute):
+        client.post('/api/reports/daily', json={'date': '2024-02-01', 'vendor': 'IHC'})
+
+        assert db_execute("SELECT date::text FROM rings_aggregate_dates") == [('2024-02-01',)]
+        assert db_execute("""
+            SELECT SUM(ring_count) FROM rings_daily_stats WHERE date = '2024-02-01'
+        """) == [(5,)]
+
+    def _sync(self, client, google_config, mock_gspread, records):
+        mock_gc, _, _ = mock_gspread
+        with patch('app.routes.data_routes.Credentials.from_service_account_info'), \
+             patch('app.routes.data_routes.gspread.authorize', return_value=mock_gc), \
+             patch('app.routes.data_routes.load_sheets_data_parallel') as mock_load, \
+             patch('app.routes.data_routes.merge_ring_data_fast') as mock_merge:
+            mock_load.return_value = ([], {}, [], [])
+            mock_merge.return_value = ([dict(record) for record in records], [])
+            response = client.post('/api/migrate', json=google_config)
+            assert 'Migration completed successfully' in response.data.decode('utf-8')
+
+    def test_migration_refreshes_only_touched_dates(self, client, mixed_day, google_config, mock_gspread, db_execute):
+        sheet = [
+            {'date': '2024-02-01', 'serial_number': 'S4', 'vendor': 'MAKENICA', 'vqc_status': 'ACCEPTED'},
+            {'date': '2024-02-02', 'serial_number': 'S6', 'vendor': 'IHC', 'vqc_status': 'ACCEPTED'},
+            {'date': '2024-02-03', 'serial_number': 'S7', 'vendor': 'IHC', 'vqc_status': 'ACCEPTED'},
+        ]
+        self._sync(client, google_config, mock_gspread, sheet)
+        db_execute("UPDATE rings_aggregate_dates SET refreshed_at = '2000-01-01'")
+        version = db_execute("SELECT version FROM rings_data_version")
+
+        # An unchanged sheet leaves the aggregates and the data version alone
+        self._sync(client, google_config, mock_gspread, sheet)
+        assert db_execute("SELECT COUNT(*) FROM rings_aggregate_dates WHERE refreshed_at > '2000-01-01'") == [(0,)]
+        assert db_execute("SELECT version FROM rings_data_version") == version
+
+        sheet[0]['ft_status'] = 'PASS'
+        sheet[2]['date'] = '2024-02-04'
+        self._sync(client, google_config, mock_gspread, sheet)
+
+        # S6's date is not refreshed; S7 moved from 02-03 to 02-04
+        assert db_execute("""
+            SELECT date::text FROM rings_aggregate_dates WHERE refreshed_at > '2000-01-01' ORDER BY date
+        """) == [('2024-02-01',), ('2024-02-03',), ('2024-02-04',)]
+        data = json.loads(client.post('/api/reports/daily', json={'date': '2024-02-01', 'vendor': 'MAKENICA'}).data)
+        assert data['totalPending'] == 0
+        assert data['totalAccepted'] == 1
+
+    def test_clear_empties_aggregates(self, client, mixed_day, db_execute):
+        client.post('/api/reports/daily', json={'date': '2024-02-01', 'vendor': 'all'})
+
+        client.delete('/api/db/clear')
+
+        assert db_execute("SELECT COUNT(*) FROM rings_daily_stats") == [(0,)]
+        assert db_execute("SELECT COUNT(*) FROM rings_aggregate_dates") == [(0,)]
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestDailyRangeReport:
+    """Test the /reports/daily-range endpoint."""
+
+    @pytest.fixture
+    def week(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_status, ft_reason)
+            VALUES
+                ('2024-04-01', 'IHC', 'W1', 'ACCEPTED', '', 'PASS', ''),
+                ('2024-04-01', 'IHC', 'W2', 'REJECTED', 'BLACK GLUE', '', ''),
+                ('2024-04-01', 'MAKENICA', 'W3', 'ACCEPTED', '', 'FAIL', 'SENSOR ISSUE'),
+                ('2024-04-01', 'MAKENICA', 'W4', 'REJECTED', 'BLACK GLUE', '', ''),
+                ('2024-04-03', 'IHC', 'W5', '', '', '', ''),
+                ('2024-04-03', 'IHC', 'W6', 'ACCEPTED', '', '', '')
+        """)
+
+    def test_range_report_per_day_and_vendor(self, client, week):
+        response = client.post('/api/reports/daily-range', json={'dateFrom': '2024-04-01', 'dateTo': '2024-04-03'})
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert (data['totalReceived'], data['totalAccepted'], data['totalRejected'], data['totalPending']) == (6, 2, 3, 1)
+        assert [day['date'] for day in data['days']] == ['2024-04-01', '2024-04-02', '2024-04-03']
+
+        first, empty, third = data['days']
+        assert first['totalReceived'] == 4
+        assert first['yield'] == 25.0
+        assert [(v['vendor'], v['totalRejected']) for v in first['vendorBreakdown']] == [('IHC', 1), ('MAKENICA', 2)]
+        assert first['topReasons'] == [
+            {'stage': 'VQC', 'reason': 'BLACK GLUE', 'count': 2},
+            {'stage': 'FT', 'reason': 'SENSOR ISSUE', 'count': 1},
+        ]
+        assert empty['totalReceived'] == 0 and empty['vendorBreakdown'] == []
+        assert (third['totalPending'], third['yield']) == (1, 100.0)
+
+    def test_range_report_single_vendor(self, client, week):
+        response = client.post('/api/reports/daily-range', json={
+            'dateFrom': '2024-04-01', 'dateTo': '2024-04-03', 'vendor': 'MAKENICA', 'topReasons': 1
+        })
+
+        data = json.loads(response.data)
+        assert data['totalReceived'] == 2
+        # Ties are broken by reason, and only the requested number is kept
+        assert data['days'][0]['topReasons'] == [{'stage': 'VQC', 'reason': 'BLACK GLUE', 'count': 1}]
+
+    def test_range_report_validation(self, client):
+        assert client.post('/api/reports/daily-range', json={'dateFrom': '2024-04-01'}).status_code == 400
+        assert client.post('/api/reports/daily-range', json={
+            'dateFrom': '2020-01-01', 'dateTo': '2024-01-01'
+        }).status_code == 400
+
+    @pytest.mark.parametrize('top_reasons', [0, -1, 51, 'many', '5', 2.5, True, None])
+    def test_range_report_rejects_invalid_top_reasons(self, client, top_reasons):
+        response = client.post('/api/reports/daily-range', json={
+            'dateFrom': '2024-04-01', 'dateTo': '2024-04-03', 'topReasons': top_reasons
+        })
+
+        assert response.status_code == 400
+        assert 'topReasons' in json.loads(response.data)['error']
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestReportCache:
+    """Test the persistent daily report cache for closed days."""
+
+    def _report(self, client, day, vendor='all'):
+        return json.loads(client.post('/api/reports/daily', json={'date': day, 'vendor': vendor}).data)
+
+    def test_closed_day_served_from_cache(self, client, seed_db, db_execute):
+        first = self._report(client, '2024-01-15')
+        # Tamper with the aggregates: a cached report must not be recomputed
+        db_execute("UPDATE rings_daily_stats SET ring_count = 100")
+
+        assert self._report(client, '2024-01-15') == first
+        assert db_execute("SELECT vendor FROM rings_report_cache WHERE date = '2024-01-15'") == [('all',)]
+
+    def test_refresh_of_the_date_invalidates_cache(self, client, seed_db, db_execute):
+        self._report(client, '2024-01-15', 'IHC')
+        db_execute("UPDATE rings SET ft_status = 'PASS' WHERE serial_number = 'IHC001'")
+
+        client.post('/api/db/aggregates/refresh', json={'dateFrom': '2024-01-15', 'dateTo': '2024-01-15'})
+
+        assert db_execute("SELECT COUNT(*) FROM rings_report_cache") == [(0,)]
+        assert self._report(client, '2024-01-15', 'IHC')['totalAccepted'] == 1
+
+    def test_open_day_not_cached(self, client, seed_db, db_execute):
+        today = datetime.now().date().isoformat()
+        db_execute("INSERT INTO rings (date, vendor, serial_number) VALUES (%s, 'IHC', 'TODAY1')", (today,))
+
+        assert self._report(client, today)['totalPending'] == 1
+        assert db_execute("SELECT COUNT(*) FROM rings_report_cache") == [(0,)]
+
+    def test_warm_builds_every_vendor(self, app, seed_db, db_execute):
+        from datetime import date
+        from app.database import get_db_connection, return_db_connection
+        from app.report_cache import warm_report_cache
+        from app.routes.report_routes import build_daily_report
+        with app.test_request_context():
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    assert warm_report_cache(cursor, build_daily_report, date(2024, 1, 15)) == 3
+                    assert warm_report_cache(cursor, build_daily_report, date(2024, 1, 15)) == 0
+                conn.commit()
+            finally:
+                return_db_connection(conn)
+
+        assert db_execute("SELECT vendor FROM rings_report_cache ORDER BY vendor") == [
+            ('3DE TECH',), ('IHC',), ('all',)
+        ]
+
+    def test_migration_warms_yesterdays_reports(self, app, client, seed_db, google_config, mock_gspread, db_execute):
+        import threading
+        from datetime import date, timedelta
+        yesterday = date.today() - timedelta(days=1)
+
+        mock_gc, _, _ = mock_gspread
+        with patch('app.routes.data_routes.Credentials.from_service_account_info'), \
+             patch('app.routes.data_routes.gspread.authorize', return_value=mock_gc), \
+             patch('app.routes.data_routes.load_sheets_data_parallel') as mock_load, \
+             patch('app.routes.data_routes.merge_ring_data_fast') as mock_merge:
+            mock_load.return_value = ([], {}, [], [])
+            mock_merge.return_value = ([
+                {'date': yesterday.isoformat(), 'serial_number': 'Y1', 'vendor': 'IHC',
+                 'vqc_status': 'ACCEPTED', 'ft_status': 'PASS'},
+            ], [])
+            response = client.post('/api/migrate', json=google_config, buffered=False)
+            # Read the stream outside any app context, as a server would
+            chunks = []
+            reader = threading.Thread(target=lambda: chunks.append(response.get_data(as_text=True)))
+            reader.start()
+            reader.join()
+
+        assert 'ERROR' not in chunks[0]
+        assert 'Pre-computed 2 report(s) for the previous day.' in chunks[0]
+        assert db_execute("SELECT vendor FROM rings_report_cache WHERE date = %s ORDER BY vendor",
+                             (yesterday,)) == [('IHC',), ('all',)]
+
+
+@pytest.mark.integration
+@pytest.mark.database
+@pytest.mark.slow
+class TestDailyReportBenchmark:
+    """Benchmark the grouped daily report against the old per-ring Python loop."""
+
+    RING_COUNT = 50_000
+
+    def _legacy_report(self, rows):
+        """The per-ring status logic the daily report used before it moved into SQL."""
+        totals = {'received': 0, 'accepted': 0, 'rejected': 0, 'pending': 0}
+        vendors, hours, vqc_reasons, ft_reasons = {}, {}, {}, {}
+        for vendor, vqc_status, vqc_reason, ft_status, ft_reason, created_at in rows:
+            has_vqc = vqc_status is not None and vqc_status.strip() != ''
+            has_ft = ft_status is not None and ft_status.strip() != ''
+            status, reason, stage = 'pending', '', 'VQC'
+            if has_ft:
+                status = 'accepted' if ft_status.upper() in ['ACCEPTED', 'PASS'] else 'rejected'
+                reason, stage = (ft_reason or '').strip() if status == 'rejected' else '', 'FT'
+            elif has_vqc:
+                status = 'accepted' if vqc_status.upper() in ['ACCEPTED', 'PASS'] else 'rejected'
+                reason = (vqc_reason or '').strip() if status == 'rejected' else ''
+            for bucket in (totals, vendors.setdefault(vendor, dict.fromkeys(totals, 0)),
+                           hours.setdefault(created_at.hour, dict.fromkeys(totals, 0))):
+                bucket['received'] += 1
+                bucket[status] += 1
+            if reason:
+                reasons = vqc_reasons if stage == 'VQC' else ft_reasons
+                reasons[reason] = reasons.get(reason, 0) + 1
+        return totals, vendors, hours, vqc_reasons, ft_reasons
+
+    def test_grouped_report_matches_per_ring_loop(self, app, seed_db):
+        from app.database import get_db_connection, return_db_connection
+        from app.routes.report_routes import build_daily_report
+
+        queries = []
+
+        class RecordingCursor(psycopg2.extensions.cursor):
+            def execute(self, query, params=None):
+                queries.append(query)
+                return super().execute(query, params)
+
+        with app.app_context():
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_status, ft_reason, created_at)
+                        SELECT '2024-05-01', (ARRAY['IHC', 'MAKENICA', '3DE TECH'])[1 + mod(i, 3)], 'BENCH' || i,
+                               (ARRAY['ACCEPTED', 'REJECTED', '', 'ACCEPTED'])[1 + mod(i, 4)],
+                               (ARRAY['BLACK GLUE', 'MICRO BUBBLES', 'DENT ON SHELL'])[1 + mod(i, 3)],
+                               (ARRAY['PASS', 'FAIL', '', 'PASS', ''])[1 + mod(i, 5)],
+                               (ARRAY['SENSOR ISSUE', 'NOT CHARGING'])[1 + mod(i, 2)],
+                               '2024-05-01'::timestamp + mod(i, 86400) * interval '1 second'
+                        FROM generate_series(1, %s) AS i
+                    """, (self.RING_COUNT,))
+                    # Aggregate the date first so only the report itself is measured
+                    build_daily_report(cursor, '2024-05-01', 'all')
+                conn.commit()
+
+                started = time.perf_counter()
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT vendor, vqc_status, vqc_reason, ft_status, ft_reason, created_at
+                        FROM rings WHERE date = '2024-05-01'
+                    """)
+                    totals, vendors, hours, vqc_reasons, ft_reasons = self._legacy_report(cursor.fetchall())
+                legacy_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                with conn.cursor(cursor_factory=RecordingCursor) as cursor:
+                    data = build_daily_report(cursor, '2024-05-01', 'all')
+                grouped_seconds = time.perf_counter() - started
+                conn.rollback()
+            finally:
+                return_db_connection(conn)
+
+        print(f"\ndaily report, {self.RING_COUNT} rings: per-ring loop {legacy_seconds:.3f}s, "
+              f"grouped SQL {grouped_seconds:.3f}s")
+
+        # One grouped query over the aggregates, and rings itself is never read
+        assert len([query for query in queries if 'rings_daily_stats' in query]) == 1
+        assert not any(re.search(r'\bFROM rings\b', query) for query in queries)
+        assert data['totalReceived'] == totals['received'] == self.RING_COUNT
+        assert (data['totalAccepted'], data['totalRejected'], data['totalPending']) == \
+            (totals['accepted'], totals['rejected'], totals['pending'])
+        assert {v['vendor']: v['totalRejected'] for v in data['vendorBreakdown']} == \
+            {vendor: stats['rejected'] for vendor, stats in vendors.items()}
+        assert {int(h['hour'][:2]): h['received'] for h in data['hourlyData']} == \
+            {hour: stats['received'] for hour, stats in hours.items()}
+        assert {r['reason']: r['count'] for r in data['vqcBreakdown']['rejectionReasons']} == vqc_reasons
+        assert {r['reason']: r['count'] for r in data['ftBreakdown']['rejectionReasons']} == ft_reasons
+        assert grouped_seconds < legacy_seconds
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestRejectionFacts:
+    """Test the rings_rejection_facts table behind the rejection trends reports."""
+
+    @pytest.fixture
+    def rejections(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_status, ft_reason)
+            VALUES
+                ('2024-03-01', 'IHC', 'R1', 'REJECTED', ' black glue ', '', ''),
+                ('2024-03-01', 'IHC', 'R2', 'REJECTED', 'BLACK GLUE', 'FAIL', 'SENSOR ISSUE'),
+                ('2024-03-02', 'IHC', 'R3', 'ACCEPTED', '', 'FAIL', 'SENSOR ISSUE'),
+                ('2024-03-02', 'IHC', 'R4', 'ACCEPTED', '', 'PASS', ''),
+                ('2024-03-02', 'MAKENICA', 'R5', 'REJECTED', 'BLACK GLUE', '', '')
+        """)
+
+    def _row(self, data, rejection):
+        return next(row for row in data['rejectionData'] if row['rejection'] == rejection)
+
+    def test_trends_count_final_rejections(self, client, rejections):
+        response = client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC', 'rejectionStage': 'both'
+        })
+
+        data = json.loads(response.data)
+        assert self._row(data, 'BLACK GLUE')['dateWiseData'] == {'2024-03-01': 2, '2024-03-02': 0}
+        assert self._row(data, 'SENSOR ISSUE')['dateWiseData'] == {'2024-03-01': 0, '2024-03-02': 1}
+        assert data['summary']['totalRejections'] == 3
+        assert data['summary']['stageWiseTotals']['ASSEMBLY'] == 2
+
+    def test_trends_stage_filter(self, client, rejections):
+        response = client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC', 'rejectionStage': 'ft'
+        })
+
+        data = json.loads(response.data)
+        assert data['summary']['totalRejections'] == 1
+        assert self._row(data, 'SENSOR ISSUE')['totals']['total'] == 1
+
+    def test_window_assembled_from_cached_days(self, client, rejections, db_execute):
+        request = {'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC'}
+        first = json.loads(client.post('/api/reports/rejection-trends', json=request).data)
+        # Written behind the cache's back: clean days must not be re-read
+        db_execute("UPDATE rings_rejection_facts SET rejection_count = 50")
+
+        assert json.loads(client.post('/api/reports/rejection-trends', json=request).data) == first
+
+        # Refreshing a day marks it dirty, and only that day is re-read
+        client.post('/api/db/aggregates/refresh', json={'dateFrom': '2024-03-01', 'dateTo': '2024-03-01'})
+        data = json.loads(client.post('/api/reports/rejection-trends', json=request).data)
+        assert self._row(data, 'BLACK GLUE')['dateWiseData'] == {'2024-03-01': 2, '2024-03-02': 0}
+        assert self._row(data, 'SENSOR ISSUE')['dateWiseData'] == {'2024-03-01': 0, '2024-03-02': 1}
+
+    def test_trends_for_vendor_list(self, client, rejections):
+        response = client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': ['IHC', 'MAKENICA', 'NOBODY']
+        })
+
+        data = json.loads(response.data)
+        assert self._row(data, 'BLACK GLUE')['dateWiseData'] == {'2024-03-01': 2, '2024-03-02': 1}
+        assert data['summary']['totalRejections'] == 4
+        assert [v['vendor'] for v in data['vendorData']] == ['IHC', 'MAKENICA', 'NOBODY']
+        by_vendor = {v['vendor']: v for v in data['vendorData']}
+        assert by_vendor['IHC']['summary']['totalRejections'] == 3
+        assert self._row(by_vendor['MAKENICA'], 'BLACK GLUE')['dateWiseData'] == {'2024-03-01': 0, '2024-03-02': 1}
+        assert by_vendor['NOBODY']['summary']['totalRejections'] == 0
+
+    def test_trends_for_all_vendors(self, client, rejections):
+        response = client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'all', 'rejectionStage': 'vqc'
+        })
+
+        data = json.loads(response.data)
+        assert data['vendor'] == 'all'
+        assert [v['vendor'] for v in data['vendorData']] == ['IHC', 'MAKENICA']
+        assert data['summary']['totalRejections'] == 3
+
+    def test_trends_reject_empty_vendor_list(self, client):
+        response = client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': []
+        })
+
+        assert response.status_code == 400
+
+    def test_export_combines_vendor_list(self, client, rejections):
+        response = client.post('/api/reports/rejection-trends/export', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': ['IHC', 'MAKENICA'], 'format': 'csv'
+        })
+
+        assert 'ASSEMBLY,BLACK GLUE,2,1,3' in response.data.decode('utf-8').splitlines()
+        assert 'IHC_MAKENICA' in response.headers['Content-Disposition']
+
+    def test_export_matches_trends(self, client, rejections):
+        response = client.post('/api/reports/rejection-trends/export', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC',
+            'format': 'csv', 'rejectionStage': 'both'
+        })
+
+        lines = response.data.decode('utf-8').splitlines()
+        assert lines[0] == 'Stage,Rejection Type,01-Mar-2024,02-Mar-2024,Total'
+        assert 'ASSEMBLY,BLACK GLUE,2,0,2' in lines
+        assert 'FUNCTIONAL,SENSOR ISSUE,0,1,1' in lines
+
+    def test_excel_export_styles_rows(self, client, rejections):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        response = client.post('/api/reports/rejection-trends/export', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC', 'format': 'excel'
+        })
+
+        worksheet = load_workbook(BytesIO(response.data))['Rejection Trends']
+        rows = list(worksheet.iter_rows(values_only=True))
+        assert rows[0] == ('Stage', 'Rejection Type', '01-Mar-2024', '02-Mar-2024', 'Total')
+        assert ('ASSEMBLY', 'BLACK GLUE', 2, 0, 2) in rows
+        assert worksheet['A1'].font.bold
+        assert worksheet['A2'].fill.start_color.rgb.endswith('E3F2FD')
+        assert worksheet.column_dimensions['B'].width == 30
+
+    def test_backfill_endpoint_recomputes_stale_facts(self, client, rejections, db_execute):
+        client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC'
+        })
+        # Written behind the aggregates' back, so the facts are stale until refreshed
+        db_execute("UPDATE rings SET vqc_status = 'ACCEPTED' WHERE serial_number = 'R1'")
+
+        response = client.post('/api/db/aggregates/refresh', json={'dateFrom': '2024-03-01', 'dateTo': '2024-03-01'})
+
+        assert response.status_code == 200
+        assert db_execute("""
+            SELECT stage, reason_code, rejection_count FROM rings_rejection_facts
+            WHERE date = '2024-03-01' ORDER BY stage
+        """) == [('vqc', 101, 1)]
+
+    def test_reason_variants_share_a_row(self, client, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason)
+            VALUES
+                ('2024-03-01', 'IHC', 'V1', 'REJECTED', 'GLOB TOP ISSUE'),
+                ('2024-03-01', 'IHC', 'V2', 'REJECTED', 'Glop Top Issue'),
+                ('2024-03-01', 'IHC', 'V3', 'REJECTED', 'R & D REJECTION'),
+                ('2024-03-01', 'IHC', 'V4', 'REJECTED', 'R&D rejection'),
+                ('2024-03-01', 'IHC', 'V5', 'REJECTED', 'NOT A KNOWN REASON')
+        """)
+
+        response = client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-01', 'vendor': 'IHC'
+        })
+
+        data = json.loads(response.data)
+        assert self._row(data, 'GLOB TOP ISSUE')['totals']['total'] == 2
+        assert self._row(data, 'R&D REJECTION')['totals']['total'] == 2
+        assert data['summary']['totalRejections'] == 4
+        assert db_execute("""
+            SELECT serial_number, vqc_reason_code FROM rings
+            WHERE serial_number LIKE 'V%' ORDER BY serial_number
+        """) == [('V1', 212), ('V2', 212), ('V3', 320), ('V4', 320), ('V5', 0)]
+
+    def test_schema_migration_classifies_existing_reasons(self, client, rejections, db_execute):
+        db_execute("""
+            ALTER TABLE rings DISABLE TRIGGER reasoncodeupdate;
+            UPDATE rings SET vqc_reason_code = NULL, ft_reason_code = NULL;
+            ALTER TABLE rings ENABLE TRIGGER reasoncodeupdate;
+            TRUNCATE rejection_reason_lookup;
+            DELETE FROM schema_migrations WHERE version = 6;
+        """)
+
+        response = client.post('/api/db/schema')
+
+        assert json.loads(response.data)['applied'] == [6]
+        assert db_execute("""
+            SELECT serial_number, vqc_reason_code, ft_reason_code FROM rings
+            WHERE serial_number IN ('R1', 'R2', 'R3') ORDER BY serial_number
+        """) == [('R1', 101, None), ('R2', 101, 318), ('R3', None, 318)]
+
+    def test_taxonomy_change_reclassifies_stored_reasons(self, app, client, monkeypatch, rejections, db_execute):
+        from app import taxonomy
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason)
+            VALUES ('2024-03-01', 'IHC', 'R6', 'REJECTED', 'GLUE BLACKENED')
+        """)
+        client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-01', 'vendor': 'IHC'
+        })
+        assert db_execute("SELECT vqc_reason_code FROM rings WHERE serial_number = 'R6'") == [(0,)]
+
+        monkeypatch.setitem(taxonomy.REASON_ALIASES, 'GLUE BLACKENED', 'BLACK GLUE')
+        monkeypatch.setitem(taxonomy._CODES_BY_KEY, taxonomy.normalize_reason('GLUE BLACKENED'), 101)
+        taxonomy.reason_code.cache_clear()
+        try:
+            response = client.post('/api/db/schema')
+        finally:
+            taxonomy.reason_code.cache_clear()
+
+        assert response.status_code == 200
+        assert db_execute("""
+            SELECT code FROM rejection_reason_lookup WHERE raw_reason = 'GLUE BLACKENED'
+        """) == [(101,)]
+        assert db_execute("SELECT vqc_reason_code FROM rings WHERE serial_number = 'R6'") == [(101,)]
+        assert db_execute("""
+            SELECT reason_code, SUM(rejection_count) FROM rings_rejection_facts
+            WHERE date = '2024-03-01' AND vendor = 'IHC' AND stage = 'vqc'
+            GROUP BY reason_code
+        """) == [(101, 3)]
+
+    def test_long_reasons_are_classified(self, client, rejections, db_execute):
+        # Random text, so it stays too long for a btree entry after compression
+        reason = os.urandom(4000).hex().upper()
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason)
+            VALUES ('2024-03-01', 'IHC', 'R6', 'REJECTED', %s)
+        """, (reason,))
+        response = client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-01', 'vendor': 'IHC'
+        })
+
+        assert response.status_code == 200
+        assert db_execute("SELECT vqc_reason_code FROM rings WHERE serial_number = 'R6'") == [(0,)]
+
+    def test_trends_and_export_share_the_taxonomy(self, client, rejections):
+        trends = json.loads(client.post('/api/reports/rejection-trends', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC'
+        }).data)
+        export = client.post('/api/reports/rejection-trends/export', json={
+            'dateFrom': '2024-03-01', 'dateTo': '2024-03-02', 'vendor': 'IHC', 'format': 'csv'
+        }).data.decode('utf-8').splitlines()
+
+        assert [line.split(',')[1] for line in export[1:]] == [row['rejection'] for row in trends['rejectionData']]
@@ -6,6 +6,7 @@ import pytest
 from unittest.mock import patch, Mock
 import psycopg2
 
+
 @pytest.mark.integration
 class TestSearchRoutes:
     """Test search route endpoints."""
@@ -167,6 +168,7 @@ class TestSearchRoutes:
             data = json.loads(response.data)
             assert data['status'] == 'error'
 
+
 @pytest.mark.integration
 class TestSearchValidation:
     """Test search input validation."""
@@ -189,4 +191,682 @@ class TestSearchValidation:
                              data=json.dumps({}),
                              content_type='application/json')
         
-        assert response.status_code == 200
\ No newline at end of file
+        assert response.status_code == 200
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSearchPagination:
+    """Test keyset pagination of search results."""
+
+    @pytest.fixture
+    def many_rings(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status)
+            SELECT DATE '2024-02-01' + (i / 4), 'IHC', 'PAGE' || i, 'ACCEPTED'
+            FROM generate_series(1, 20) AS i
+        """)
+        db_execute("INSERT INTO rings (vendor, serial_number) VALUES ('IHC', 'UNDATED1'), ('IHC', 'UNDATED2')")
+
+    def _search(self, client, filters):
+        return client.post('/api/search', data=json.dumps(filters), content_type='application/json')
+
+    def test_pages_cover_every_match_once_in_order(self, client, many_rings, db_execute):
+        expected = [row[0] for row in db_execute("SELECT serial_number FROM rings ORDER BY date DESC, id DESC")]
+
+        serials, cursor, pages = [], None, 0
+        while True:
+            filters = {'pageSize': 5}
+            if cursor:
+                filters['cursor'] = cursor
+            response = self._search(client, filters)
+            assert response.status_code == 200
+            page = json.loads(response.data)
+            assert len(page) <= 5
+            serials.extend(row['serial_number'] for row in page)
+            pages += 1
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+
+        assert serials == expected
+        assert serials[:2] == ['UNDATED2', 'UNDATED1']
+        assert pages == 5
+
+    def test_last_page_has_no_cursor(self, client, many_rings):
+        response = self._search(client, {'vendor': ['3DE TECH'], 'pageSize': 5})
+
+        assert response.status_code == 200
+        assert len(json.loads(response.data)) == 1
+        assert 'X-Next-Cursor' not in response.headers
+
+    def test_cursor_combines_with_filters(self, client, many_rings):
+        first = self._search(client, {'dateFrom': '2024-02-02', 'pageSize': 3})
+        second = self._search(client, {'dateFrom': '2024-02-02', 'pageSize': 100,
+                                       'cursor': first.headers['X-Next-Cursor']})
+
+        dates = [row['date'] for row in json.loads(first.data) + json.loads(second.data)]
+        assert len(dates) == 17
+        assert 'X-Next-Cursor' not in second.headers
+
+    def test_invalid_cursor_and_page_size(self, client, seed_db):
+        assert self._search(client, {'cursor': 'not-a-cursor'}).status_code == 400
+        assert self._search(client, {'pageSize': 0}).status_code == 400
+        assert self._search(client, {'pageSize': 'many'}).status_code == 400
+
+    def test_page_size_is_capped(self, client, seed_db):
+        from app.search_query import MAX_SEARCH_PAGE_SIZE
+        response = self._search(client, {'pageSize': MAX_SEARCH_PAGE_SIZE * 10})
+
+        assert response.status_code == 200
+        assert len(json.loads(response.data)) == 2
+
+    def test_keyset_index_serves_search_order(self, seed_db, db_execute):
+        rows = db_execute("""
+            SELECT indexdef FROM pg_indexes WHERE indexname = 'idx_rings_date_id'
+        """)
+        assert rows and 'date DESC, id DESC' in rows[0][0]
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSearchStreaming:
+    """Test streamed search and data responses."""
+
+    def _used_connections(self):
+        from app import database
+        return len(database.db_pool._used)
+
+    def test_streamed_json_matches_buffered_search(self, client, seed_db):
+        buffered = client.post('/api/search', data=json.dumps({}), content_type='application/json')
+        streamed = client.post('/api/search?stream=json', data=json.dumps({}), content_type='application/json')
+
+        assert streamed.status_code == 200
+        assert streamed.is_streamed
+        assert json.loads(streamed.data) == json.loads(buffered.data)
+
+    def test_ndjson_search(self, client, seed_db):
+        response = client.post('/api/search', data=json.dumps({'vendor': ['IHC']}),
+                               content_type='application/json', headers={'Accept': 'application/x-ndjson'})
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.data.decode().splitlines()
+        assert [json.loads(line)['serial_number'] for line in lines] == ['IHC001']
+
+    def test_streamed_search_without_matches(self, client, seed_db):
+        response = client.post('/api/search?stream=json', data=json.dumps({'serialNumbers': 'NOPE'}),
+                               content_type='application/json')
+
+        assert json.loads(response.data) == []
+
+    def test_stream_returns_connection_to_pool(self, client, seed_db):
+        before = self._used_connections()
+        response = client.get('/api/data?stream=ndjson')
+        assert len(response.data.decode().splitlines()) == 2
+        response.close()
+
+        assert self._used_connections() == before
+
+    def test_unread_stream_returns_connection_to_pool(self, client, seed_db):
+        before = self._used_connections()
+        response = client.get('/api/data?stream=json', buffered=False)
+        response.close()
+
+        assert self._used_connections() == before
+
+    def test_streamed_data_matches_buffered_data(self, client, seed_db):
+        buffered = json.loads(client.get('/api/data').data)
+        streamed = json.loads(client.get('/api/data?stream=json').data)
+
+        assert streamed == buffered
+
+    def test_export_is_streamed_in_search_order(self, app, client, seed_db):
+        before = self._used_connections()
+        response = client.post('/api/search/export', data=json.dumps({}), content_type='application/json')
+
+        assert response.is_streamed
+        lines = response.data.decode('utf-8').splitlines()
+        assert lines[0] == 'date,vendor,mo_number,serial_number,vqc_status,ft_status,vqc_reason,ft_reason'
+        assert [line.split(',')[3] for line in lines[1:]] == ['IHC001', 'ABC123']
+        response.close()
+        assert self._used_connections() == before
+
+    def test_invalid_stream_format(self, client):
+        assert client.get('/api/data?stream=xml').status_code == 400
+        response = client.post('/api/search?stream=xml', data=json.dumps({}), content_type='application/json')
+        assert response.status_code == 400
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSearchCache:
+    """Test the search result cache and its invalidation."""
+
+    def _search(self, client, filters):
+        return client.post('/api/search', data=json.dumps(filters), content_type='application/json')
+
+    def _stats(self, client):
+        return json.loads(client.get('/api/search/cache/stats').data)
+
+    def test_repeated_search_is_served_from_cache(self, client, seed_db):
+        first = self._search(client, {'vendor': ['IHC', '3DE TECH']})
+        second = self._search(client, {'vendor': ['3DE TECH', 'IHC']})
+
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.data == first.data
+        stats = self._stats(client)
+        assert stats['hits'] == 1 and stats['misses'] == 1
+        assert stats['hitRatio'] == 0.5
+        assert stats['entries'] == 1 and stats['bytes'] == len(first.data)
+
+    def test_equivalent_filters_share_an_entry(self, client, seed_db):
+        self._search(client, {'serialNumbers': 'abc123, ihc001', 'dateFrom': '2024-01-15', 'moNumbers': ''})
+        response = self._search(client, {'serialNumbers': 'IHC001,ABC123,abc123', 'dateFrom': '2024-01-15T00:00:00'})
+
+        assert response.headers['X-Cache'] == 'HIT'
+        assert len(json.loads(response.data)) == 2
+
+    def test_pages_are_cached_with_their_cursor(self, client, seed_db):
+        self._search(client, {'pageSize': 1})
+        response = self._search(client, {'pageSize': 1})
+
+        assert response.headers['X-Cache'] == 'HIT'
+        assert 'X-Next-Cursor' in response.headers
+        second_page = self._search(client, {'pageSize': 1, 'cursor': response.headers['X-Next-Cursor']})
+        assert second_page.headers['X-Cache'] == 'MISS'
+
+    def test_clear_invalidates_cached_results(self, client, seed_db):
+        assert len(json.loads(self._search(client, {}).data)) == 2
+        version = self._stats(client)['dataVersion']
+
+        client.delete('/api/db/clear')
+        response = self._search(client, {})
+
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data) == []
+        stats = self._stats(client)
+        assert stats['dataVersion'] == version + 1
+        assert stats['entries'] == 1
+
+    def test_migration_invalidates_cached_results(self, client, seed_db, google_config, mock_gspread):
+        assert len(json.loads(self._search(client, {}).data)) == 2
+
+        mock_gc, _, _ = mock_gspread
+        with patch('app.routes.data_routes.Credentials.from_service_account_info'), \
+             patch('app.routes.data_routes.gspread.authorize', return_value=mock_gc), \
+             patch('app.routes.data_routes.load_sheets_data_parallel') as mock_load, \
+             patch('app.routes.data_routes.merge_ring_data_fast') as mock_merge:
+            mock_load.return_value = ([], {}, [], [])
+            mock_merge.return_value = ([
+                {'date': '2024-01-16', 'serial_number': 'NEW1', 'vendor': 'IHC',
+                 'vqc_status': 'ACCEPTED', 'ft_status': 'PASS'},
+            ], [])
+            response = client.post('/api/migrate', json=google_config)
+            assert 'Migration completed successfully' in response.data.decode('utf-8')
+
+        response = self._search(client, {})
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data)[0]['serial_number'] == 'NEW1'
+
+    def test_streamed_search_bypasses_cache(self, client, seed_db):
+        self._search(client, {})
+        client.post('/api/search?stream=json', data=json.dumps({}), content_type='application/json')
+
+        assert self._stats(client)['hits'] == 0
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestFilterOptions:
+    """Test the filter options maintained on write."""
+
+    @pytest.fixture
+    def reasons(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_reason) VALUES
+                ('2024-01-16', 'IHC', 'R1', 'REJECTED', 'BLACK GLUE', NULL),
+                ('2024-01-16', 'IHC', 'R2', 'REJECTED', 'DENT ON SHELL', ''),
+                ('2024-01-16', 'IHC', 'R3', 'ACCEPTED', NULL, 'NOT CHARGING'),
+                ('2024-01-16', 'IHC', 'R4', 'REJECTED', 'BLACK GLUE', 'BLACK GLUE')
+        """)
+
+    def test_reasons_come_from_the_options_table(self, client, reasons):
+        data = json.loads(client.get('/api/search/filters').data)
+
+        assert data['reasons'] == ['BLACK GLUE', 'DENT ON SHELL', 'NOT CHARGING']
+
+    def test_long_reasons_are_options(self, client, reasons, db_execute):
+        import os
+        # Random text, so it stays too long for a btree entry after compression
+        reason = os.urandom(4000).hex().upper()
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason) VALUES
+                ('2024-01-16', 'IHC', 'R5', 'ACCEPTED', %s), ('2024-01-16', 'IHC', 'R6', 'ACCEPTED', %s)
+        """, (reason, reason))
+
+        data = json.loads(client.get('/api/search/filters').data)
+        assert data['reasons'].count(reason) == 1
+
+    def test_options_table_is_upgraded_from_a_name_key(self, client, reasons, db_execute):
+        db_execute("""
+            DROP INDEX idx_ring_reason_options_name_md5;
+            ALTER TABLE ring_reason_options ADD PRIMARY KEY (name);
+            DELETE FROM schema_migrations WHERE version = 13;
+        """)
+
+        assert json.loads(client.post('/api/db/schema').data)['applied'] == [13]
+        assert db_execute("""
+            SELECT indexname FROM pg_indexes WHERE tablename = 'ring_reason_options'
+        """) == [('idx_ring_reason_options_name_md5',)]
+
+    def test_updated_reasons_are_added(self, client, reasons, db_execute):
+        db_execute("UPDATE rings SET ft_reason = 'SENSOR ISSUE' WHERE serial_number = 'R1'")
+
+        assert 'SENSOR ISSUE' in json.loads(client.get('/api/search/filters').data)['reasons']
+
+    def test_values_no_row_holds_are_pruned_after_a_sync(
+            self, client, reasons, google_config, mock_gspread, db_execute):
+        mock_gc, _, _ = mock_gspread
+        sheet = [
+            # The only 3DE TECH ring moves to IHC and the only DENT ON SHELL reason is corrected
+            {'date': '2024-01-15', 'serial_number': 'ABC123', 'vendor': 'IHC',
+             'vqc_status': 'ACCEPTED', 'ft_status': 'PASS'},
+            {'date': '2024-01-16', 'serial_number': 'R2', 'vendor': 'IHC',
+             'vqc_status': 'REJECTED', 'vqc_reason': 'BLACK GLUE', 'ft_reason': ''},
+        ]
+        with patch('app.routes.data_routes.Credentials.from_service_account_info'), \
+             patch('app.routes.data_routes.gspread.authorize', return_value=mock_gc), \
+             patch('app.routes.data_routes.load_sheets_data_parallel') as mock_load, \
+             patch('app.routes.data_routes.merge_ring_data_fast') as mock_merge:
+            mock_load.return_value = ([], {}, [], [])
+            mock_merge.return_value = (sheet, [])
+            response = client.post('/api/migrate', json=google_config)
+            assert 'Removed 2 filter option(s)' in response.data.decode('utf-8')
+
+        data = json.loads(client.get('/api/search/filters').data)
+        assert data['vendors'] == ['IHC']
+        assert data['reasons'] == ['BLACK GLUE', 'NOT CHARGING']
+        assert data['vqc_statuses'] == ['ACCEPTED', 'REJECTED']
+
+    def test_etag_revalidation(self, client, reasons, db_execute):
+        first = client.get('/api/search/filters')
+        etag = first.headers['ETag']
+
+        unchanged = client.get('/api/search/filters', headers={'If-None-Match': etag})
+        assert unchanged.status_code == 304
+        assert unchanged.data == b''
+
+        db_execute("INSERT INTO rings (date, vendor, serial_number) VALUES ('2024-01-16', 'NEW VENDOR', 'R5')")
+        changed = client.get('/api/search/filters', headers={'If-None-Match': etag})
+        assert changed.status_code == 200
+        assert 'NEW VENDOR' in json.loads(changed.data)['vendors']
+
+    def test_backfill_loads_existing_reasons(self, app, reasons, db_execute):
+        from app.dictionaries import backfill_reason_options
+        db_execute("TRUNCATE TABLE ring_reason_options")
+
+        with app.app_context():
+            from app.database import get_db_connection, return_db_connection
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    assert backfill_reason_options(cursor) == 3
+                conn.commit()
+            finally:
+                return_db_connection(conn)
+
+    def test_clear_empties_reason_options(self, app, client, reasons):
+        client.delete('/api/db/clear')
+
+        assert json.loads(client.get('/api/search/filters').data)['reasons'] == []
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSearchFacets:
+    """Test faceted counts for the search filters."""
+
+    @pytest.fixture
+    def rings(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, vendor, serial_number, vqc_status, vqc_reason, ft_status, ft_reason) VALUES
+                ('2024-01-16', 'IHC', 'F1', 'REJECTED', 'BLACK GLUE', NULL, NULL),
+                ('2024-01-16', 'IHC', 'F2', 'ACCEPTED', NULL, 'FAIL', 'NOT CHARGING'),
+                ('2024-01-16', 'MAKENICA', 'F3', 'REJECTED', 'BLACK GLUE', 'FAIL', 'BLACK GLUE'),
+                ('2024-01-17', 'MAKENICA', 'F4', 'ACCEPTED', NULL, 'PASS', NULL),
+                ('2024-01-17', '3DE TECH', 'F5', 'REJECTED', 'DENT ON SHELL', NULL, ''),
+                (NULL, 'IHC', 'F6', 'ACCEPTED', NULL, NULL, NULL)
+        """)
+
+    def _facets(self, client, filters):
+        response = client.post('/api/search/facets', json=filters)
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        return data, {facet: {item['value']: item['count'] for item in values}
+                      for facet, values in data['facets'].items()}
+
+    def test_unfiltered_counts(self, client, rings):
+        data, facets = self._facets(client, {})
+
+        assert data['source'] == 'rings'
+        assert data['total'] == 8
+        assert facets['vendor'] == {'IHC': 4, 'MAKENICA': 2, '3DE TECH': 2}
+        assert facets['vqcStatus'] == {'ACCEPTED': 4, 'REJECTED': 4}
+        assert facets['ftStatus'] == {'FAIL': 3, 'PASS': 2}
+        # F3 has BLACK GLUE in both columns and counts once
+        assert facets['rejectionReason'] == {'BLACK GLUE': 2, 'NOT CHARGING': 1, 'DENT ON SHELL': 1}
+        assert data['facets']['vendor'][0] == {'value': 'IHC', 'count': 4}
+
+    def test_facets_ignore_their_own_filter(self, client, rings):
+        data, facets = self._facets(client, {'vendor': ['MAKENICA'], 'vqcStatus': ['REJECTED']})
+
+        assert data['total'] == 1
+        # Vendor counts apply the status filter only
+        assert facets['vendor'] == {'IHC': 2, 'MAKENICA': 1, '3DE TECH': 1}
+        # Status counts apply the vendor filter only
+        assert facets['vqcStatus'] == {'REJECTED': 1, 'ACCEPTED': 1}
+        assert facets['ftStatus'] == {'FAIL': 1}
+        assert facets['rejectionReason'] == {'BLACK GLUE': 1}
+
+    def test_reason_and_serial_filters(self, client, rings):
+        data, facets = self._facets(client, {'rejectionReason': ['BLACK GLUE'], 'serialNumbers': 'f1, f2, f3'})
+
+        assert data['total'] == 2
+        assert facets['vendor'] == {'IHC': 1, 'MAKENICA': 1}
+        assert facets['rejectionReason'] == {'BLACK GLUE': 2, 'NOT CHARGING': 1}
+
+    def test_date_and_vendor_filters_use_aggregates(self, client, rings, monkeypatch):
+        filters = {'dateFrom': '2024-01-15', 'dateTo': '2024-01-17', 'vendor': ['IHC', 'MAKENICA']}
+        data, facets = self._facets(client, filters)
+        assert data['source'] == 'aggregates'
+
+        monkeypatch.setattr('app.search_facets.uses_aggregates', lambda filters: False)
+        rings_data, rings_facets = self._facets(client, filters)
+        assert rings_data['source'] == 'rings'
+        assert facets == rings_facets
+        assert data['total'] == rings_data['total'] == 5
+
+    def test_open_date_range_uses_rings(self, client, rings):
+        data, _ = self._facets(client, {'dateFrom': '2024-01-16'})
+
+        assert data['source'] == 'rings'
+        assert data['total'] == 5
+
+    def test_invalid_date(self, client):
+        response = client.post('/api/search/facets', json={'dateTo': 'later'})
+        assert response.status_code == 400
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSerialLookup:
+    """Test the bulk serial lookup."""
+
+    def _used_connections(self):
+        from app import database
+        return len(database.db_pool._used)
+
+    def test_matches_and_not_found(self, client, seed_db):
+        response = client.post('/api/search/serials', json={'serials': ['IHC001', 'MISSING1', 'ABC123']})
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [match['requestedSerial'] for match in data['matches']] == ['IHC001', 'ABC123']
+        assert data['matches'][0]['vendor'] == 'IHC'
+        assert data['notFound'] == ['MISSING1']
+        assert data['summary'] == {'requested': 3, 'matched': 2, 'notFound': 1}
+
+    def test_serials_are_normalised(self, client, seed_db):
+        response = client.post('/api/search/serials', json={'serials': ' abc123,\nihc001; abc123 '})
+
+        data = json.loads(response.data)
+        assert [match['serial_number'] for match in data['matches']] == ['ABC123', 'IHC001']
+        assert data['summary']['requested'] == 2
+
+    def test_uploaded_file(self, client, seed_db):
+        import io
+        upload = io.BytesIO('﻿ABC123\r\nNOPE\r\n'.encode('utf-8'))
+        response = client.post('/api/search/serials', data={'file': (upload, 'serials.txt')},
+                               content_type='multipart/form-data')
+
+        data = json.loads(response.data)
+        assert data['summary'] == {'requested': 2, 'matched': 1, 'notFound': 1}
+        assert data['notFound'] == ['NOPE']
+
+    def test_plain_text_body(self, client, seed_db):
+        response = client.post('/api/search/serials', data='IHC001 X\\1', content_type='text/plain')
+
+        data = json.loads(response.data)
+        assert data['notFound'] == ['X\\1']
+
+    def test_ndjson(self, client, seed_db):
+        response = client.post('/api/search/serials?stream=ndjson', json={'serials': ['ABC123', 'NOPE']})
+
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert lines[0]['match']['serial_number'] == 'ABC123'
+        assert lines[1] == {'notFound': 'NOPE'}
+        assert lines[2]['summary']['matched'] == 1
+
+    def test_empty_and_oversized_requests(self, client, monkeypatch):
+        assert client.post('/api/search/serials', json={'serials': []}).status_code == 400
+
+        monkeypatch.setattr('app.routes.search_routes.MAX_LOOKUP_SERIALS', 2)
+        response = client.post('/api/search/serials', json={'serials': 'A,B,C'})
+        assert response.status_code == 400
+        assert 'Too many' in json.loads(response.data)['error']
+
+    def test_connection_returned_to_pool(self, client, seed_db):
+        before = self._used_connections()
+        response = client.post('/api/search/serials', json={'serials': ['ABC123']})
+        assert json.loads(response.data)['summary']['matched'] == 1
+        response.close()
+
+        assert self._used_connections() == before
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestSerialIndex:
+    """Test serial status lookups from the in-process index."""
+
+    def _build(self):
+        from app.database import get_db_connection, return_db_connection
+        from app.serial_index import build_serial_index
+        conn = get_db_connection()
+        try:
+            return build_serial_index(conn)
+        finally:
+            return_db_connection(conn)
+
+    def test_lookup_from_index(self, client, seed_db):
+        assert self._build() == 2
+
+        data = json.loads(client.get('/api/search/serials/ihc001').data)
+        assert data == {'serial': 'IHC001', 'known': True, 'source': 'index', 'date': '2024-01-15',
+                        'vendor': 'IHC', 'vqcStatus': 'REJECTED', 'ftStatus': 'FAIL'}
+        with patch('app.routes.search_routes.refresh_serial_index') as refresh:
+            assert json.loads(client.get('/api/search/serials/NOPE').data) == {
+                'serial': 'NOPE', 'known': False, 'source': 'index'}
+
+        # An unknown serial is answered by the index without rebuilding it
+        refresh.assert_not_called()
+
+    def test_falls_back_to_database_until_built(self, client, seed_db):
+        with patch('app.routes.search_routes.refresh_serial_index') as refresh:
+            data = json.loads(client.get('/api/search/serials/ABC123').data)
+
+        refresh.assert_called_once()
+        assert data['source'] == 'database'
+        assert data['known'] and data['vendor'] == '3DE TECH'
+
+    def test_lookup_leaves_a_running_build_alone(self, client, seed_db, monkeypatch):
+        from app import serial_index
+        monkeypatch.setitem(serial_index._state, 'building', True)
+
+        with patch('app.routes.search_routes.refresh_serial_index') as refresh:
+            data = json.loads(client.get('/api/search/serials/ABC123').data)
+
+        refresh.assert_not_called()
+        assert data['source'] == 'database'
+
+    def _sync(self, client, google_config, mock_gspread, records):
+        mock_gc, _, _ = mock_gspread
+        with patch('app.routes.data_routes.Credentials.from_service_account_info'), \
+             patch('app.routes.data_routes.gspread.authorize', return_value=mock_gc), \
+             patch('app.routes.data_routes.load_sheets_data_parallel') as mock_load, \
+             patch('app.routes.data_routes.merge_ring_data_fast') as mock_merge:
+            mock_load.return_value = ([], {}, [], [])
+            mock_merge.return_value = ([dict(record) for record in records], [])
+            response = client.post('/api/migrate', json=google_config)
+            assert 'Migration completed successfully' in response.data.decode('utf-8')
+
+    def test_migration_updates_index(self, client, seed_db, google_config, mock_gspread):
+        from app.serial_index import apply_serial_index_changes
+        sheet = [{'date': '2024-01-15', 'serial_number': 'ABC123', 'vendor': '3DE TECH',
+                  'vqc_status': 'ACCEPTED', 'ft_status': 'PASS'}]
+        with patch('app.routes.data_routes.refresh_serial_index'):
+            self._sync(client, google_config, mock_gspread, sheet)
+        self._build()
+        version = json.loads(client.get('/api/search/serial-index/stats').data)['dataVersion']
+
+        sheet.append({'date': '2024-01-16', 'serial_number': 'NEW1', 'vendor': 'IHC',
+                      'vqc_status': 'ACCEPTED', 'ft_status': 'PASS'})
+        with patch('app.routes.data_routes.apply_serial_index_changes', wraps=apply_serial_index_changes) as apply, \
+             patch('app.routes.data_routes.refresh_serial_index') as refresh:
+            self._sync(client, google_config, mock_gspread, sheet)
+
+        refresh.assert_not_called()
+        # ABC123 is unchanged, so only the inserted row is applied
+        assert [row[0] for row in apply.call_args.args[0]] == ['NEW1']
+        stats = json.loads(client.get('/api/search/serial-index/stats').data)
+        assert stats['dataVersion'] == version + 1
+        data = json.loads(client.get('/api/search/serials/NEW1').data)
+        assert data['known'] and data['source'] == 'index'
+
+    def test_migration_rebuilds_index_that_is_not_ready(self, client, seed_db, google_config, mock_gspread):
+        import threading
+        import time
+        mock_gc, _, _ = mock_gspread
+        with patch('app.routes.data_routes.Credentials.from_service_account_info'), \
+             patch('app.routes.data_routes.gspread.authorize', return_value=mock_gc), \
+             patch('app.routes.data_routes.load_sheets_data_parallel') as mock_load, \
+             patch('app.routes.data_routes.merge_ring_data_fast') as mock_merge:
+            mock_load.return_value = ([], {}, [], [])
+            mock_merge.return_value = ([
+                {'date': '2024-01-16', 'serial_number': 'NEW1', 'vendor': 'IHC',
+                 'vqc_status': 'ACCEPTED', 'ft_status': 'PASS'},
+            ], [])
+            response = client.post('/api/migrate', json=google_config, buffered=False)
+            # Read the stream from another thread, outside any app context, as a server would
+            chunks = []
+            reader = threading.Thread(target=lambda: chunks.append(response.get_data(as_text=True)))
+            reader.start()
+            reader.join()
+            log = chunks[0]
+
+        assert 'Migration completed successfully' in log
+        assert 'ERROR' not in log
+        deadline = time.monotonic() + 5
+        while not json.loads(client.get('/api/search/serial-index/stats').data)['ready']:
+            assert time.monotonic() < deadline, 'serial index was not rebuilt'
+            time.sleep(0.05)
+        assert json.loads(client.get('/api/search/serials/NEW1').data)['source'] == 'index'
+
+    def test_write_from_another_process_is_noticed(self, client, seed_db, monkeypatch, db_execute):
+        self._build()
+        monkeypatch.setattr('app.serial_index.SERIAL_INDEX_VERSION_TTL', 0)
+        db_execute("""
+            DELETE FROM rings WHERE serial_number = 'ABC123';
+            UPDATE rings_data_version SET version = version + 1;
+        """)
+
+        with patch('app.routes.search_routes.refresh_serial_index') as refresh:
+            data = json.loads(client.get('/api/search/serials/ABC123').data)
+
+        refresh.assert_called_once()
+        assert data == {'serial': 'ABC123', 'known': False, 'source': 'database'}
+
+    def test_schema_reset_drops_index(self, client, seed_db):
+        self._build()
+
+        with patch('app.routes.db_routes.refresh_serial_index') as refresh:
+            client.post('/api/db/schema', json={'reset': True})
+
+        refresh.assert_called_once()
+        assert not json.loads(client.get('/api/search/serial-index/stats').data)['ready']
+
+    def test_clear_drops_index(self, client, seed_db):
+        self._build()
+
+        with patch('app.routes.db_routes.refresh_serial_index') as refresh:
+            client.delete('/api/db/clear')
+
+        refresh.assert_called_once()
+        assert not json.loads(client.get('/api/search/serial-index/stats').data)['ready']
+
+
+@pytest.mark.integration
+@pytest.mark.database
+class TestAutocomplete:
+    """Test serial and MO number suggestions."""
+
+    @pytest.fixture
+    def rings(self, seed_db, db_execute):
+        db_execute("""
+            INSERT INTO rings (date, mo_number, vendor, serial_number, vqc_status, ft_status) VALUES
+            ('2024-01-16', 'MO100', 'IHC', 'ABD777', 'ACCEPTED', 'PASS'),
+            ('2024-01-16', 'MO100', 'IHC', 'abc124', 'ACCEPTED', 'PASS'),
+            ('2024-01-16', 'MO101', 'IHC', 'XABC9', 'ACCEPTED', 'PASS'),
+            ('2024-01-16', 'MO_1', 'IHC', 'AB%1', 'ACCEPTED', 'PASS')
+        """)
+
+    def _suggest(self, client, **args):
+        response = client.get('/api/search/autocomplete', query_string=args)
+        return response.status_code, json.loads(response.data)
+
+    def test_prefix_suggestions_in_order(self, client, rings):
+        status, data = self._suggest(client, q='abc')
+
+        assert status == 200
+        assert data == {'field': 'serial', 'query': 'ABC', 'suggestions': ['ABC123', 'ABC124'], 'complete': True}
+
+    def test_limit(self, client, rings):
+        _, data = self._suggest(client, q='AB', limit=2)
+        assert data['suggestions'] == ['AB%1', 'ABC123']
+
+    def test_mo_suggestions_are_distinct(self, client, rings):
+        _, data = self._suggest(client, field='mo', q='mo1')
+        assert data['suggestions'] == ['MO100', 'MO101']
+
+    def test_wildcards_are_literal(self, client, rings):
+        assert self._suggest(client, q='AB%')[1]['suggestions'] == ['AB%1']
+        assert self._suggest(client, field='mo', q='MO_')[1]['suggestions'] == ['MO_1']
+
+    def test_contains_fills_after_prefix_matches(self, client, rings):
+        _, data = self._suggest(client, q='ABC', match='contains')
+        assert data['suggestions'] == ['ABC123', 'ABC124', 'XABC9']
+
+    def test_timeout_returns_incomplete_suggestions(self, app, client, rings, monkeypatch):
+        from app.database import get_db_connection, return_db_connection
+        monkeypatch.setattr('app.autocomplete.AUTOCOMPLETE_TIMEOUT_MS', 50)
+        with app.app_context():
+            blocker = get_db_connection()
+        try:
+            with blocker.cursor() as cursor:
+                cursor.execute("LOCK TABLE rings IN ACCESS EXCLUSIVE MODE")
+            status, data = self._suggest(client, q='ABC')
+        finally:
+            blocker.rollback()
+            return_db_connection(blocker)
+
+        assert status == 200
+        assert data['suggestions'] == [] and data['complete'] is False
+
+    def test_invalid_requests(self, client):
+        assert self._suggest(client, q='')[0] == 400
+        assert self._suggest(client, q='A', field='vendor')[0] == 400
+        assert self._suggest(client, q='A', limit='many')[0] == 400
+        assert self._suggest(client, q='A', match='fuzzy')[0] == 400
@@ -0,0 +1,58 @@
+"""
+Unit tests for excel.py
+"""
+from openpyxl import load_workbook
+from openpyxl.styles import PatternFill
+from app.excel import MAX_COLUMN_WIDTH, iter_file, write_xlsx
+
+def _load(output):
+    return load_workbook(output)
+
+class TestWriteXlsx:
+    """Test the write-only workbook writer."""
+
+    def test_rows_from_generator(self):
+        rows = ([i, f'ring {i}'] for i in range(3))
+
+        worksheet = _load(write_xlsx('Sheet', ['Id', 'Name'], rows))['Sheet']
+
+        assert [list(row) for row in worksheet.iter_rows(values_only=True)] == [
+            ['Id', 'Name'], [0, 'ring 0'], [1, 'ring 1'], [2, 'ring 2']
+        ]
+
+    def test_header_style_and_row_fill(self):
+        fill = PatternFill(start_color="E3F2FD", end_color="E3F2FD", fill_type="solid")
+        rows = [['ASSEMBLY', 'BLACK GLUE', 1], ['OTHER', 'X', 2]]
+
+        worksheet = _load(write_xlsx(
+            'Sheet', ['Stage', 'Type', 'Count'], rows,
+            row_fill=lambda row: fill if row[0] == 'ASSEMBLY' else None, styled_columns=2, style_header=True
+        ))['Sheet']
+
+        assert worksheet['A1'].font.bold
+        assert worksheet['A1'].fill.start_color.rgb.endswith('366092')
+        assert worksheet['A2'].fill.start_color.rgb.endswith('E3F2FD')
+        assert worksheet['B2'].fill.start_color.rgb.endswith('E3F2FD')
+        assert worksheet['C2'].fill.fill_type is None
+        assert worksheet['A3'].fill.fill_type is None
+
+    def test_autosize_from_data(self):
+        rows = [['a', 'x' * 100], ['abcdefgh', 'y']]
+
+        worksheet = _load(write_xlsx('Sheet', ['H', 'Header'], rows, autosize=True))['Sheet']
+
+        assert worksheet.column_dimensions['A'].width == len('abcdefgh') + 2
+        assert worksheet.column_dimensions['B'].width == MAX_COLUMN_WIDTH
+
+class TestIterFile:
+    """Test streaming a finished file."""
+
+    def test_chunks_and_closes(self):
+        output = write_xlsx('Sheet', ['A'], [[1]])
+        size = len(output.read())
+        output.seek(0)
+
+        chunks = list(iter_file(output, chunk_size=100))
+
+        assert sum(len(chunk) for chunk in chunks) == size
+        assert output.closed
@@ -0,0 +1,81 @@
+"""
+Unit tests for the export job store.
+"""
+import time
+
+import pytest
+
+from app import export_jobs
+from app.export_jobs import cleanup_expired_exports, export_job_id, get_export_job, submit_export_job
+
+
+@pytest.fixture
+def artifact_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_jobs, 'EXPORT_ARTIFACT_DIR', str(tmp_path))
+    return tmp_path
+
+
+def _wait(job_id):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = get_export_job(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError('job did not finish')
+
+
+def test_job_id_depends_on_type_format_and_spec():
+    assert export_job_id('search', 'csv', {'a': 1, 'b': 2}) == export_job_id('search', 'csv', {'b': 2, 'a': 1})
+    assert export_job_id('search', 'csv', {'a': 1}) != export_job_id('search', 'csv', {'a': 2})
+    assert export_job_id('search', 'csv', {}) != export_job_id('rejection-trends', 'csv', {})
+
+
+def test_job_writes_artifact(artifact_dir):
+    job, created = submit_export_job('search', 'csv', {'n': 1}, 'out.csv', 'text/csv', lambda f: f.write(b'a,b\n'))
+
+    assert created
+    job = _wait(job['jobId'])
+    assert job['status'] == 'done' and job['size'] == 4
+    assert (artifact_dir / f"{job['jobId']}.artifact").read_bytes() == b'a,b\n'
+
+
+def test_duplicate_submission_reuses_job(artifact_dir):
+    calls = []
+    job, _ = submit_export_job('search', 'csv', {'n': 2}, 'out.csv', 'text/csv', calls.append)
+    _wait(job['jobId'])
+    again, created = submit_export_job('search', 'csv', {'n': 2}, 'out.csv', 'text/csv', calls.append)
+
+    assert not created
+    assert again['jobId'] == job['jobId']
+    assert len(calls) == 1
+
+
+def test_failed_job_is_retried(artifact_dir):
+    def fail(_):
+        raise RuntimeError('boom')
+
+    job, _ = submit_export_job('search', 'csv', {'n': 3}, 'out.csv', 'text/csv', fail)
+    assert _wait(job['jobId'])['error'] == 'boom'
+    assert list(artifact_dir.glob('*.part')) == []
+
+    job, created = submit_export_job('search', 'csv', {'n': 3}, 'out.csv', 'text/csv', lambda f: f.write(b'ok'))
+    assert created
+    assert _wait(job['jobId'])['status'] == 'done'
+
+
+def test_cleanup_removes_expired_jobs(artifact_dir, monkeypatch):
+    job, _ = submit_export_job('search', 'csv', {'n': 4}, 'out.csv', 'text/csv', lambda f: f.write(b'x'))
+    _wait(job['jobId'])
+    assert cleanup_expired_exports() == 0
+
+    now = time.time()
+    monkeypatch.setattr(export_jobs.time, 'time', lambda: now + export_jobs.EXPORT_ARTIFACT_TTL + 1)
+
+    assert cleanup_expired_exports() == 1
+    assert get_export_job(job['jobId']) is None
+    assert list(artifact_dir.iterdir()) == []
+
+
+def test_unsafe_job_ids_are_unknown(artifact_dir):
+    assert get_export_job('../secrets') is None
@@ -0,0 +1,69 @@
+"""
+Unit tests for the search result cache.
+"""
+import pytest
+
+from app import search_cache
+from app.search_cache import (
+    clear_search_cache, get_cached_search, search_cache_stats, search_fingerprint, store_cached_search,
+)
+from app.search_query import normalize_search_filters
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_search_cache()
+    yield
+    clear_search_cache()
+
+
+def test_fingerprint_ignores_spelling_and_order():
+    a = normalize_search_filters({'serialNumbers': 'b2, a1', 'vendor': ['IHC', '3DE TECH'], 'dateTo': '2024-01-31'})
+    b = normalize_search_filters({'serialNumbers': 'A1,B2,a1', 'vendor': ['3DE TECH', 'IHC'], 'dateTo': '2024/01/31',
+                                  'ftStatus': []})
+    assert search_fingerprint(a, 100, None) == search_fingerprint(b, 100, None)
+    assert search_fingerprint(a, 100, None) != search_fingerprint(a, 50, None)
+    assert search_fingerprint(a, 100, None) != search_fingerprint(a, 100, 'token')
+
+
+def test_hit_and_miss_counts():
+    assert get_cached_search(1, 'k') is None
+    store_cached_search(1, 'k', b'[1]', 'next')
+
+    assert get_cached_search(1, 'k') == (b'[1]', 'next')
+    stats = search_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['hitRatio'], stats['bytes']) == (1, 1, 0.5, 3)
+
+
+def test_lru_eviction_by_size(monkeypatch):
+    monkeypatch.setattr(search_cache, 'SEARCH_CACHE_MAX_BYTES', 40)
+    store_cached_search(1, 'a', b'x' * 10, None)
+    store_cached_search(1, 'b', b'x' * 10, None)
+    store_cached_search(1, 'c', b'x' * 10, None)
+    get_cached_search(1, 'a')
+    store_cached_search(1, 'd', b'x' * 10, None)
+    store_cached_search(1, 'e', b'x' * 10, None)
+
+    assert get_cached_search(1, 'b') is None
+    assert get_cached_search(1, 'a') is not None
+    stats = search_cache_stats()
+    assert stats['bytes'] <= 40
+    assert stats['evictions'] == 1
+
+
+def test_oversized_pages_are_not_cached(monkeypatch):
+    monkeypatch.setattr(search_cache, 'SEARCH_CACHE_MAX_BYTES', 40)
+    store_cached_search(1, 'big', b'x' * 11, None)
+
+    assert search_cache_stats()['entries'] == 0
+
+
+def test_newer_version_drops_older_entries():
+    store_cached_search(1, 'a', b'[]', None)
+    assert get_cached_search(2, 'a') is None
+
+    stats = search_cache_stats()
+    assert stats['entries'] == 0 and stats['bytes'] == 0 and stats['dataVersion'] == 2
+    # A page built under the old version must not come back
+    store_cached_search(1, 'a', b'[]', None)
+    assert search_cache_stats()['entries'] == 0
@@ -0,0 +1,62 @@
+"""
+Unit tests for search filter parsing and keyset cursors.
+"""
+from datetime import date
+
+import pytest
+
+from app.search_query import (
+    DEFAULT_SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE, build_search_conditions, decode_cursor, encode_cursor,
+    keyset_condition, parse_page_size,
+)
+
+
+class TestBuildSearchConditions:
+
+    def test_empty_filters(self):
+        assert build_search_conditions({}) == ([], [])
+
+    def test_numbers_are_split_and_upper_cased(self):
+        clauses, params = build_search_conditions({'serialNumbers': 'abc1, ,abc2', 'moNumbers': ' , '})
+        assert clauses == ["UPPER(serial_number) = ANY(%s)"]
+        assert params == [['ABC1', 'ABC2']]
+
+    def test_dates_are_parsed(self):
+        _, params = build_search_conditions({'dateFrom': '2024-01-15', 'dateTo': '2024-01-31'})
+        assert params == [date(2024, 1, 15), date(2024, 1, 31)]
+
+    def test_invalid_date(self):
+        with pytest.raises(ValueError, match='Invalid dateTo format'):
+            build_search_conditions({'dateTo': 'yesterday-ish'})
+
+
+class TestCursor:
+
+    def test_round_trip(self):
+        token = encode_cursor(date(2024, 1, 15), 42)
+        assert decode_cursor(token) == (date(2024, 1, 15), 42)
+        assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+
+    @pytest.mark.parametrize('token', ['', 'garbage', encode_cursor(date(2024, 1, 1), 1)[:-3]])
+    def test_malformed(self, token):
+        with pytest.raises(ValueError, match='Invalid cursor'):
+            decode_cursor(token)
+
+    def test_condition(self):
+        assert keyset_condition(encode_cursor(date(2024, 1, 15), 42)) == (
+            "(date, id) < (%s, %s)", [date(2024, 1, 15), 42])
+        clause, params = keyset_condition(encode_cursor(None, 3))
+        assert 'date IS NOT NULL' in clause and params == [3]
+
+
+class TestPageSize:
+
+    def test_default_and_cap(self):
+        assert parse_page_size(None) == DEFAULT_SEARCH_PAGE_SIZE
+        assert parse_page_size('25') == 25
+        assert parse_page_size(MAX_SEARCH_PAGE_SIZE + 1) == MAX_SEARCH_PAGE_SIZE
+
+    @pytest.mark.parametrize('value', [0, -5, 'lots'])
+    def test_invalid(self, value):
+        with pytest.raises(ValueError):
+            parse_page_size(value)
@@ -0,0 +1,69 @@
+"""
+Unit tests for the in-process serial index.
+"""
+from datetime import date
+
+import pytest
+
+from app import serial_index
+from app.serial_index import (
+    _intern_lock, apply_serial_index_changes, invalidate_serial_index, lookup_serial, pack_record, unpack_record,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_index():
+    invalidate_serial_index()
+    yield
+    invalidate_serial_index()
+
+
+@pytest.fixture
+def ready_index(monkeypatch):
+    monkeypatch.setitem(serial_index._state, 'ready', True)
+    monkeypatch.setitem(serial_index._state, 'dataVersion', 7)
+
+
+def test_records_round_trip():
+    with _intern_lock:
+        record = pack_record(date(2024, 1, 15), 'IHC', 'REJECTED', None)
+        undated = pack_record(None, 'IHC', '', 'PASS')
+
+    assert unpack_record(record) == {'date': date(2024, 1, 15), 'vendor': 'IHC', 'vqcStatus': 'REJECTED',
+                                     'ftStatus': None}
+    assert unpack_record(undated) == {'date': None, 'vendor': 'IHC', 'vqcStatus': '', 'ftStatus': 'PASS'}
+
+
+def test_lookup_is_none_until_ready():
+    assert lookup_serial('ABC123') is None
+
+
+def test_changes_apply_on_top_of_the_previous_version(ready_index):
+    assert apply_serial_index_changes([('ABC123', date(2024, 1, 15), 'IHC', 'ACCEPTED', 'PASS')], 8)
+
+    known, status = lookup_serial(' abc123 ')
+    assert known and status['vendor'] == 'IHC'
+    assert lookup_serial('OTHER') == (False, None)
+    assert serial_index._state['dataVersion'] == 8
+
+
+def test_version_gap_drops_the_index(ready_index):
+    assert not apply_serial_index_changes([('ABC123', None, 'IHC', None, None)], 9)
+
+    assert lookup_serial('ABC123') is None
+
+
+def test_version_mismatch_drops_the_index(ready_index):
+    assert serial_index.check_serial_index_version(7)
+    assert not serial_index.check_serial_index_version(8)
+
+    assert lookup_serial('ABC123') is None
+
+
+def test_refresh_leaves_a_running_build_alone(monkeypatch):
+    monkeypatch.setitem(serial_index._state, 'building', True)
+    monkeypatch.setattr(serial_index, '_get_executor', lambda: pytest.fail('a second build was started'))
+
+    serial_index.refresh_serial_index(None, None)
+
+    assert serial_index._state['stale'] is False
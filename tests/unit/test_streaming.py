@@ -0,0 +1,62 @@
+"""
+Unit tests for the streaming response helpers.
+"""
+import json
+from unittest.mock import Mock
+
+from flask import Flask
+
+from app import streaming
+from app.streaming import iter_records, json_array_chunks, ndjson_chunks, stream_response
+
+
+class FakeCursor:
+    description = None
+
+    def __init__(self, columns, rows):
+        self._columns = columns
+        self._rows = rows
+
+    def __iter__(self):
+        for row in self._rows:
+            self.description = [(column,) for column in self._columns]
+            yield row
+
+
+def test_iter_records_reads_columns_after_first_row():
+    cursor = FakeCursor(['a', 'b'], [(1, 2), (3, 4)])
+    assert list(iter_records(cursor)) == [{'a': 1, 'b': 2}, {'a': 3, 'b': 4}]
+
+
+def test_json_array_chunks():
+    records = [{'n': i} for i in range(3)]
+    assert json.loads(''.join(json_array_chunks(iter(records), json.dumps))) == records
+    assert ''.join(json_array_chunks(iter([]), json.dumps)) == '[]'
+
+
+def test_ndjson_chunks():
+    lines = ''.join(ndjson_chunks(iter([{'n': 1}, {'n': 2}]), json.dumps)).splitlines()
+    assert [json.loads(line) for line in lines] == [{'n': 1}, {'n': 2}]
+
+
+def test_chunks_are_bounded(monkeypatch):
+    monkeypatch.setattr(streaming, 'STREAM_CHUNK_SIZE', 100)
+    chunks = list(streaming.chunk_text(('x' * 30 for _ in range(10)), 100))
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    assert ''.join(chunks) == 'x' * 300
+
+
+def test_stream_response_closes_once():
+    on_close = Mock()
+    with Flask(__name__).test_request_context():
+        response = stream_response(iter(['a', 'b']), on_close, 'text/plain')
+        assert b''.join(response.iter_encoded()) == b'ab'
+        response.close()
+
+    on_close.assert_called_once()
+
+
+def test_csv_chunks():
+    from app.streaming import csv_chunks
+    text = ''.join(csv_chunks(['a', 'b'], iter([(1, 'x,y'), (2, None)])))
+    assert text.splitlines() == ['a,b', '1,"x,y"', '2,']
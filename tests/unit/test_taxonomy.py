@@ -0,0 +1,55 @@
+"""
+Unit tests for taxonomy.py
+"""
+from app.taxonomy import (
+    REJECTION_REASONS, REJECTION_CATEGORIES, UNCLASSIFIED_REASON_CODE,
+    classify_reason, normalize_reason, reason_code
+)
+
+class TestNormalizeReason:
+    """Test the normalize_reason lookup key."""
+
+    def test_case_and_whitespace(self):
+        assert normalize_reason('  black   glue ') == 'BLACK GLUE'
+
+    def test_punctuation_is_collapsed(self):
+        assert normalize_reason('Side Scratch(Emery)') == normalize_reason('SIDE SCRATCH (EMERY)')
+        assert normalize_reason('coil thickness issue / battery thickness') == \
+            normalize_reason('COIL THICKNESS ISSUE/BATTERY THICKNESS')
+
+    def test_symbol_spacing(self):
+        assert normalize_reason('R & D REJECTION') == normalize_reason('R&D REJECTION')
+        assert normalize_reason('100 % ISSUE') == normalize_reason('100% ISSUE')
+
+    def test_empty(self):
+        assert normalize_reason(None) == ''
+        assert normalize_reason(' - ') == ''
+
+class TestClassifyReason:
+    """Test mapping free-text reasons onto the taxonomy."""
+
+    def test_canonical_reasons_classify_to_themselves(self):
+        for code, category, reason in REJECTION_REASONS:
+            assert reason_code(reason) == code
+            assert classify_reason(reason) == (category, reason)
+
+    def test_known_variants(self):
+        assert classify_reason('GLOP TOP ISSUE') == ('CASTING', 'GLOB TOP ISSUE')
+        assert classify_reason('r & d rejection') == ('FUNCTIONAL', 'R&D REJECTION')
+        assert classify_reason('100 % issue') == ('FUNCTIONAL', '100% ISSUE')
+
+    def test_unknown_reason(self):
+        assert reason_code('SOMETHING NEW') == UNCLASSIFIED_REASON_CODE
+        assert classify_reason('SOMETHING NEW') is None
+
+    def test_empty_reason(self):
+        assert reason_code('') is None
+        assert reason_code(None) is None
+
+    def test_codes_are_unique(self):
+        codes = [code for code, _, _ in REJECTION_REASONS]
+        assert len(codes) == len(set(codes))
+        assert UNCLASSIFIED_REASON_CODE not in codes
+
+    def test_categories_keep_report_order(self):
+        assert REJECTION_CATEGORIES == ['ASSEMBLY', 'CASTING', 'FUNCTIONAL', 'POLISHING', 'SHELL']